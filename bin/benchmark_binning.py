@@ -0,0 +1,65 @@
+#! /usr/bin/env python
+
+## Micro-benchmark of the space-magnitude binning kernel using catalogs with 10^6 events in the RELM testing region.
+## The reference implementation accumulates the events in a for-loop, which is how catalogs were binned before.
+##
+## running like this:
+##   python bin/benchmark_binning.py [n_events]
+
+import sys
+import time
+
+import numpy
+
+from csep.core.catalogs import CSEPCatalog
+from csep.core.regions import california_relm_region, magnitude_bins, _bin_catalog_spatio_magnitude_counts
+from csep.utils.calc import bin1d_vec
+
+
+def loop_spatial_magnitude_counts(catalog):
+    """ Reference implementation using a for-loop """
+    region = catalog.region
+    event_counts = numpy.zeros((region.num_nodes, len(region.magnitudes)))
+    spatial_idx = region.get_index_of(catalog.get_longitudes(), catalog.get_latitudes())
+    mag_idx = bin1d_vec(catalog.get_magnitudes(), region.magnitudes, tol=0.00001, right_continuous=True)
+    for idx in range(spatial_idx.shape[0]):
+        event_counts[(spatial_idx[idx], mag_idx[idx])] += 1
+    return event_counts
+
+
+def timeit(func, *args, repeat=3):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+
+n_events = int(float(sys.argv[1])) if len(sys.argv) > 1 else 10 ** 6
+region = california_relm_region(magnitudes=magnitude_bins(4.95, 8.95, 0.1))
+rng = numpy.random.default_rng(0)
+
+# events located at random cells in the region
+origins = region.origins()
+cells = rng.integers(0, region.num_nodes, n_events)
+events = numpy.zeros(n_events, dtype=CSEPCatalog.dtype)
+events['longitude'] = origins[cells, 0] + rng.uniform(0, region.dh, n_events)
+events['latitude'] = origins[cells, 1] + rng.uniform(0, region.dh, n_events)
+events['magnitude'] = 4.95 + rng.exponential(1 / numpy.log(10), n_events)
+catalog = CSEPCatalog(data=events, region=region, compute_stats=False)
+
+print(f'Binning {n_events} events into {region.num_nodes} x {len(region.magnitudes)} space-magnitude bins')
+t_loop, expected = timeit(loop_spatial_magnitude_counts, catalog, repeat=1)
+print(f'for-loop:                               {t_loop:.3f} seconds')
+t_vec, result = timeit(catalog.spatial_magnitude_counts)
+assert numpy.array_equal(expected, result)
+print(f'spatial_magnitude_counts():             {t_vec:.3f} seconds ({t_loop / t_vec:.0f}x)')
+
+# also including events outside of the region, these are reported in bulk
+lons = numpy.append(events['longitude'], rng.uniform(-130, -110, n_events // 10))
+lats = numpy.append(events['latitude'], rng.uniform(30, 45, n_events // 10))
+mags = numpy.append(events['magnitude'], rng.uniform(4.95, 8.95, n_events // 10))
+t_skip, (_, skipped) = timeit(_bin_catalog_spatio_magnitude_counts, lons, lats, mags, region.num_nodes,
+                              region.bbox_mask, region.idx_map, region.xs, region.ys, region.magnitudes)
+print(f'_bin_catalog_spatio_magnitude_counts(): {t_skip:.3f} seconds ({len(skipped)} events outside region)')
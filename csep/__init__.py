@@ -71,7 +71,7 @@ def load_stochastic_event_sets(filename, type='csv', format='native',
 
     Args:
         filename (str): name of file or directory where stochastic event sets live.
-        type (str): either 'ucerf3' or 'csep' depending on the type of observed_catalog to load
+        type (str): either 'ucerf3', 'csv' or 'binary' depending on the type of observed_catalog to load
         format (str): ('csep' or 'native') if native catalogs are not converted to csep format.
         kwargs (dict): see the documentation of that class corresponding to the type you selected
                          for the kwargs options
@@ -80,17 +80,18 @@ def load_stochastic_event_sets(filename, type='csv', format='native',
         (generator): :class:`~csep.core.catalogs.AbstractBaseCatalog`
 
     """
-    if type not in ('ucerf3', 'csv'):
-        raise ValueError("type must be one of the following: (ucerf3)")
+    if type not in ('ucerf3', 'csv', 'binary'):
+        raise ValueError("type must be one of the following: (ucerf3, csv, binary)")
 
     # use mapping to dispatch to correct function
     # in general, stochastic event sets are loaded with classmethods and single catalogs use the
     # constructor
     mapping = {'ucerf3': catalogs.UCERF3Catalog.load_catalogs,
-               'csv': catalogs.CSEPCatalog.load_ascii_catalogs}
+               'csv': catalogs.CSEPCatalog.load_ascii_catalogs,
+               'binary': catalogs.CSEPBinaryCatalog.load_catalogs}
 
     # dispatch to proper loading function
-    result = mapping[type](filename, **kwargs)
+    result = iter(mapping[type](filename, **kwargs))
 
     # factory function to load catalogs from different classes
     while True:
@@ -486,8 +487,8 @@ def load_catalog_forecast(fname, catalog_loader=None, format='native',
             catalog_loader (func): callable that can load catalogs, see load_stochastic_event_sets above.
             format (str): either 'native' or 'csep'. if 'csep', will attempt to be returned into csep catalog format. used to convert between
                           observed_catalog type.
-            type (str): either 'ucerf3' or 'csep', determines the catalog format of the forecast. if loader is provided, then
-                        this parameter is ignored.
+            type (str): either 'ascii', 'ucerf3' or 'binary', determines the catalog format of the forecast. if loader is
+                        provided, then this parameter is ignored.
             **kwargs: other keyword arguments passed to the :class:`csep.core.forecasts.CatalogForecast`.
 
         Returns:
@@ -504,7 +505,8 @@ def load_catalog_forecast(fname, catalog_loader=None, format='native',
     # factory methods for loading different types of catalogs
     catalog_loader_mapping = {
         'ascii': catalogs.CSEPCatalog.load_ascii_catalogs,
-        'ucerf3': catalogs.UCERF3Catalog.load_catalogs
+        'ucerf3': catalogs.UCERF3Catalog.load_catalogs,
+        'binary': catalogs.CSEPBinaryCatalog.load_catalogs
     }
     if catalog_loader is None:
         catalog_loader = catalog_loader_mapping[type]
@@ -1,9 +1,11 @@
 import numpy
+import scipy.sparse
 import scipy.stats
 import scipy.spatial
 
 from csep.models import EvaluationResult
 from csep.core.exceptions import CSEPCatalogException
+from csep.core.poisson_evaluations import _simulate_blocks
 
 
 def _nbd_number_test_ndarray(fore_cnt, obs_cnt, variance, epsilon=1e-6):
@@ -123,11 +125,63 @@ def _simulate_catalog(sim_cells, sampling_weights, sim_fore, random_numbers=None
 
     assert sim_fore.sum() == sim_cells, "simulated the wrong number of events!"
     return sim_fore
+
+
+def _sample_active_cells(rng, weights, num_cells, num_simulations, max_keys=2 ** 22):
+    """ Draws num_cells distinct cells for each simulation, sampling cells with probability proportional to weights.
+
+    This uses the algorithm of Efraimidis and Spirakis (2006). Each cell with positive weight gets the key E / w, where E
+    is drawn from an exponential distribution, and the cells with the smallest keys are a weighted sample without
+    replacement. This has the same distribution as drawing cells one at a time until num_cells cells are active.
+
+    Args:
+        rng (numpy.random.Generator): random number generator, the legacy numpy.random module also works
+        weights (numpy.ndarray): non-negative weight of each cell
+        num_cells (int): number of active cells in each simulation
+        num_simulations (int): number of simulations
+        max_keys (int): maximum number of keys generated at a time, this limits memory usage
+
+    Returns:
+        numpy.ndarray: (num_simulations, num_cells) array with the indexes of the active cells
+    """
+    candidates = numpy.flatnonzero(weights > 0)
+    if num_cells > len(candidates):
+        raise ValueError(f"unable to simulate {num_cells} active cells using {len(candidates)} cells with positive rates.")
+    cells = numpy.empty((num_simulations, num_cells), dtype=numpy.int64)
+    if num_cells == 0:
+        return cells
+    rows = max(1, max_keys // len(candidates))
+    for start in range(0, num_simulations, rows):
+        stop = min(start + rows, num_simulations)
+        keys = rng.standard_exponential((stop - start, len(candidates))) / weights[candidates]
+        cells[start:stop] = candidates[numpy.argpartition(keys, num_cells - 1, axis=1)[:, :num_cells]]
+    return cells
+
+
+def _simulate_binary_log_likelihoods(rng, num_simulations, forecast_data, num_cells):
+    """ Simulates catalogs with num_cells active cells and returns their binary joint log-likelihoods """
+    rates = forecast_data.ravel()
+    positive = rates > 0
+    # log-likelihood of a catalog without events, each active cell adds log(1 - exp(-rate)) + rate
+    no_events_ll = binary_joint_log_likelihood_ndarray(forecast_data, numpy.zeros(rates.shape))
+    active_ll = numpy.zeros(rates.shape)
+    active_ll[positive] = numpy.log(1.0 - numpy.exp(-rates[positive])) + rates[positive]
+    cells = _sample_active_cells(rng, numpy.where(positive, rates, 0.0), num_cells, num_simulations)
+    return no_events_ll + numpy.sum(active_ll[cells], axis=1)
     
 
 def _binary_likelihood_test(forecast_data, observed_data, num_simulations=1000, random_numbers=None, 
-                              seed=None, use_observed_counts=True, verbose=True, normalize_likelihood=False):
+                              seed=None, use_observed_counts=True, verbose=True, normalize_likelihood=False,
+                              block_size=100, rng=None, n_workers=None):
     """  Computes binary conditional-likelihood test from CSEP using an efficient simulation based approach.
+
+    Active cells are sampled for blocks of simulations at once using weighted sampling without replacement. If rng or
+    seed is given, blocks of block_size simulations use independent random streams spawned from rng, or from seed, and
+    can be simulated in a pool of n_workers processes. A given rng or seed yields the same results for any number of
+    workers. Otherwise, simulations are drawn from the global numpy random state.
+
+    Seeded results differ from versions up to 0.6.3, which simulated one catalog at a time from the global random state
+    and could activate cells without rates.
     
     Args:
         forecast_data (numpy.ndarray): nd array where [:, -1] are the magnitude bins.
@@ -137,17 +191,23 @@ def _binary_likelihood_test(forecast_data, observed_data, num_simulations=1000,
         random_numbers (numpy.ndarray): can supply an explicit list of random numbers, primarily used for software testing
         use_observed_counts (bool): if true, will simulate catalogs using the observed events, if false will draw from poisson 
         distribution
+        block_size (int): number of catalogs simulated at a time
+        rng (int, numpy.random.SeedSequence or numpy.random.Generator): seeds independent random streams, overrides seed
+        n_workers (int): number of worker processes used to simulate catalogs, if None catalogs are simulated serially.
+            if given, random streams are spawned from seed, so results don't depend on the number of workers
     """
     
+    # the binary likelihood uses every cell of the forecast
+    if scipy.sparse.issparse(forecast_data):
+        forecast_data = forecast_data.toarray()
+
     # Array-masking that avoids log singularities:
     forecast_data = numpy.ma.masked_where(forecast_data <= 0.0, forecast_data) 
     
-    # set seed for the likelihood test
-    if seed is not None:
-        numpy.random.seed(seed)
-
-    # used to determine where simulated earthquake should be placed, by definition of cumsum these are sorted
-    sampling_weights = numpy.cumsum(forecast_data.ravel()) / numpy.sum(forecast_data)
+    # used to determine where simulated earthquake should be placed, by definition of cumsum these are sorted. masked
+    # cells are filled with zeros, because dividing the masked cumsum leaves unnormalized values under the mask. these
+    # weights are not sorted and cells without rates could be sampled.
+    sampling_weights = numpy.cumsum(forecast_data.filled(0.0).ravel()) / numpy.sum(forecast_data)
 
     # data structures to store results
     sim_fore = numpy.zeros(sampling_weights.shape)
@@ -156,27 +216,29 @@ def _binary_likelihood_test(forecast_data, observed_data, num_simulations=1000,
     n_fore = numpy.sum(forecast_data)
     expected_forecast_count = int(n_active_cells)
 
-    # main simulation step in this loop
-    for idx in range(num_simulations):
-        if use_observed_counts:
-            num_cells_to_simulate = int(n_active_cells)
-    
-        if random_numbers is None:
-            sim_fore = _simulate_catalog(num_cells_to_simulate, sampling_weights, sim_fore)
-        else:
-            sim_fore = _simulate_catalog(num_cells_to_simulate, sampling_weights, sim_fore,
-                                         random_numbers=random_numbers[idx,:])
-
-        # compute joint log-likelihood
-        current_ll = binary_joint_log_likelihood_ndarray(forecast_data.data, sim_fore)
-        
-        # append to list of simulated log-likelihoods
-        simulated_ll.append(current_ll)
-
-        # just be verbose
-        if verbose:
-            if (idx + 1) % 100 == 0:
-                print(f'... {idx + 1} catalogs simulated.')
+    # seeded simulations use random streams spawned from seed, so the results don't depend on the number of workers
+    if rng is None and (seed is not None or n_workers is not None):
+        rng = numpy.random.SeedSequence(seed)
+
+    if rng is not None and random_numbers is None:
+        simulated_ll = _simulate_blocks(_simulate_binary_log_likelihoods, (forecast_data.data, int(n_active_cells)),
+                                        num_simulations, block_size, rng, n_workers=n_workers, verbose=verbose)
+    elif random_numbers is None:
+        # simulate batches of catalogs using the global random state
+        simulated_ll = numpy.empty(num_simulations)
+        for start in range(0, num_simulations, block_size):
+            stop = min(start + block_size, num_simulations)
+            simulated_ll[start:stop] = _simulate_binary_log_likelihoods(numpy.random, stop - start,
+                                                                        forecast_data.data, int(n_active_cells))
+            if verbose:
+                print(f'... {stop} catalogs simulated.')
+    else:
+        # catalogs are simulated from the given random numbers, one catalog at a time
+        for idx in range(num_simulations):
+            sim_fore = _simulate_catalog(int(n_active_cells), sampling_weights, sim_fore,
+                                         random_numbers=random_numbers[idx, :])
+            # compute joint log-likelihood
+            simulated_ll.append(binary_joint_log_likelihood_ndarray(forecast_data.data, sim_fore))
 
     # observed joint log-likelihood
     obs_ll = binary_joint_log_likelihood_ndarray(forecast_data.data, observed_data)
@@ -188,7 +250,7 @@ def _binary_likelihood_test(forecast_data, observed_data, num_simulations=1000,
     return qs, obs_ll, simulated_ll
  
     
-def binary_spatial_test(gridded_forecast, observed_catalog, num_simulations=1000, seed=None, random_numbers=None, verbose=False):
+def binary_spatial_test(gridded_forecast, observed_catalog, num_simulations=1000, seed=None, random_numbers=None, verbose=False, rng=None, n_workers=None):
     """  Performs the binary spatial test on the Forecast using the Observed Catalogs.
     
     Note: The forecast and the observations should be scaled to the same time period before calling this function. This increases
@@ -201,6 +263,10 @@ def binary_spatial_test(gridded_forecast, observed_catalog, num_simulations=1000
         num_simulations (int): number of simulations used to compute the quantile score
         seed (int): used fore reproducibility, and testing
         random_numbers (numpy.ndarray): random numbers used to override the random number generation. injection point for testing.
+        rng (int, numpy.random.SeedSequence or numpy.random.Generator): seeds independent random streams for the
+            simulations, if given the results don't depend on n_workers. overrides seed.
+        n_workers (int): number of worker processes used to simulate catalogs, if None catalogs are simulated serially.
+            if given, random streams are spawned from seed, so results don't depend on the number of workers
         
     Returns:
         evaluation_result: csep.core.evaluations.EvaluationResult
@@ -216,6 +282,8 @@ def binary_spatial_test(gridded_forecast, observed_catalog, num_simulations=1000
         num_simulations=num_simulations,
         seed=seed,
         random_numbers=random_numbers,
+        rng=rng,
+        n_workers=n_workers,
         use_observed_counts=True,
         verbose=verbose,
         normalize_likelihood=True
@@ -238,7 +306,7 @@ def binary_spatial_test(gridded_forecast, observed_catalog, num_simulations=1000
     return result
     
     
-def binary_conditional_likelihood_test(gridded_forecast, observed_catalog, num_simulations=1000, seed=None, random_numbers=None, verbose=False):
+def binary_conditional_likelihood_test(gridded_forecast, observed_catalog, num_simulations=1000, seed=None, random_numbers=None, verbose=False, rng=None, n_workers=None):
     """ Performs the binary conditional likelihood test on Gridded Forecast using an Observed Catalog.
 
     Normalizes the forecast so the forecasted rate are consistent with the observations. This modification
@@ -254,6 +322,10 @@ def binary_conditional_likelihood_test(gridded_forecast, observed_catalog, num_s
         num_simulations (int): number of simulations used to compute the quantile score
         seed (int): used fore reproducibility, and testing
         random_numbers (numpy.ndarray): random numbers used to override the random number generation. injection point for testing.
+        rng (int, numpy.random.SeedSequence or numpy.random.Generator): seeds independent random streams for the
+            simulations, if given the results don't depend on n_workers. overrides seed.
+        n_workers (int): number of worker processes used to simulate catalogs, if None catalogs are simulated serially.
+            if given, random streams are spawned from seed, so results don't depend on the number of workers
 
     Returns:
         evaluation_result: csep.core.evaluations.EvaluationResult
@@ -268,11 +340,13 @@ def binary_conditional_likelihood_test(gridded_forecast, observed_catalog, num_s
 
     # simply call likelihood test on catalog data and forecast
     qs, obs_ll, simulated_ll = _binary_likelihood_test(
-        gridded_forecast.data,
+        gridded_forecast.data_view.materialize(copy=False),
         gridded_catalog_data,
         num_simulations=num_simulations,
         seed=seed,
         random_numbers=random_numbers,
+        rng=rng,
+        n_workers=n_workers,
         use_observed_counts=True,
         verbose=verbose,
         normalize_likelihood=False
@@ -315,7 +389,7 @@ def matrix_binary_t_test(target_event_rates1, target_event_rates2, n_obs, n_f1,
     """
     # Some Pre Calculations -  Because they are being used repeatedly.
     N_p = n_obs  
-    N = len(np.unique(np.nonzero(catalog.spatial_magnitude_counts().ravel()))) # Number of active bins
+    N = len(numpy.unique(numpy.nonzero(catalog.spatial_magnitude_counts().ravel()))) # Number of active bins
     N1 = n_f1  
     N2 = n_f2  
     X1 = numpy.log(target_event_rates1)  # Log of every element of Forecast 1
@@ -373,9 +447,10 @@ def binary_paired_t_test(forecast, benchmark_forecast, observed_catalog, alpha=0
     target_event_rate_forecast1p, n_fore1 = forecast.target_event_rates(observed_catalog, scale=scale)
     target_event_rate_forecast2p, n_fore2 = benchmark_forecast.target_event_rates(observed_catalog, scale=scale)
     
-    target_event_rate_forecast1 = forecast.data.ravel()[np.unique(np.nonzero(observed_catalog.spatial_magnitude_counts().ravel()))]
-    target_event_rate_forecast2 = benchmark_forecast.data.ravel()[np.unique(np.nonzero(observed_catalog.spatial_magnitude_counts().
-    ravel()))]
+    # 2d indexing also works for sparse forecasts
+    target_idx = numpy.nonzero(observed_catalog.spatial_magnitude_counts())
+    target_event_rate_forecast1 = forecast.data_view[target_idx]
+    target_event_rate_forecast2 = benchmark_forecast.data_view[target_idx]
 
     # call the primative version operating on ndarray
     out = matrix_binary_t_test(target_event_rate_forecast1, target_event_rate_forecast2, observed_catalog.event_count, n_fore1, n_fore2,
@@ -391,5 +466,5 @@ def binary_paired_t_test(forecast, benchmark_forecast, observed_catalog, alpha=0
     result.sim_name = (forecast.name, benchmark_forecast.name)
     result.obs_name = observed_catalog.name
     result.status = 'normal'
-    result.min_mw = np.min(forecast.magnitudes)
+    result.min_mw = numpy.min(forecast.magnitudes)
     return result
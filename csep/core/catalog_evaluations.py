@@ -13,9 +13,14 @@ from csep.models import (
     CatalogPseudolikelihoodTestResult,
     CalibrationTestResult
 )
-from csep.utils.calc import _compute_likelihood
+from csep.core.forecasts import GriddedForecast
+from csep.core.regions import _bin_counts, _bin_spatial_magnitude_counts
+from csep.utils.calc import _compute_likelihood, LikelihoodEvaluator
 from csep.utils.stats import get_quantiles, cumulative_square_diff
 
+# names of the evaluations that can be computed with run_catalog_evaluations
+CATALOG_TESTS = ('number_test', 'spatial_test', 'magnitude_test', 'pseudolikelihood_test')
+
 
 def number_test(forecast, observed_catalog, verbose=True):
     """ Performs the number test on a catalog-based forecast.
@@ -31,6 +36,9 @@ def number_test(forecast, observed_catalog, verbose=True):
     Returns:
         evaluation result (:class:`csep.models.EvaluationResult`): evaluation result
     """
+    # event counts of indexed forecasts are read without loading the catalogs
+    if forecast.is_indexed:
+        return _number_test_result(forecast.get_event_counts().tolist(), forecast, observed_catalog)
     event_counts = []
     t0 = time.time()
     for i, catalog in enumerate(forecast):
@@ -41,19 +49,7 @@ def number_test(forecast, observed_catalog, verbose=True):
                 t1 = time.time()
                 print(f'Processed {i + 1} catalogs in {t1 - t0} seconds', flush=True)
         event_counts.append(catalog.event_count)
-    obs_count = observed_catalog.event_count
-    delta_1, delta_2 = get_quantiles(event_counts, obs_count)
-    # prepare result
-    result = CatalogNumberTestResult(test_distribution=event_counts,
-                                     name='Catalog N-Test',
-                                     observed_statistic=obs_count,
-                                     quantile=(delta_1, delta_2),
-                                     status='normal',
-                                     obs_catalog_repr=str(observed_catalog),
-                                     sim_name=forecast.name,
-                                     min_mw=forecast.min_magnitude,
-                                     obs_name=observed_catalog.name)
-    return result
+    return _number_test_result(event_counts, forecast, observed_catalog)
 
 def spatial_test(forecast, observed_catalog, verbose=True):
     """ Performs spatial test for catalog-based forecasts.
@@ -90,10 +86,10 @@ def spatial_test(forecast, observed_catalog, verbose=True):
     n_obs = numpy.sum(gridded_obs)
 
     # iterate through catalogs in forecast and compute likelihood
+    evaluator = LikelihoodEvaluator(forecast_mean_spatial_rates, expected_cond_count, n_obs)
     t0 = time.time()
     for i, catalog in enumerate(forecast):
-        gridded_cat = catalog.spatial_counts()
-        _, lh_norm = _compute_likelihood(gridded_cat, forecast_mean_spatial_rates, expected_cond_count, n_obs)
+        _, lh_norm = evaluator.evaluate(*_catalog_spatial_cells(catalog))
         test_distribution.append(lh_norm)
         # output status
         if verbose:
@@ -102,43 +98,8 @@ def spatial_test(forecast, observed_catalog, verbose=True):
                 t1 = time.time()
                 print(f'Processed {i + 1} catalogs in {t1 - t0} seconds', flush=True)
 
-    _, obs_lh_norm = _compute_likelihood(gridded_obs, forecast_mean_spatial_rates, expected_cond_count, n_obs)
-    # if obs_lh is -numpy.inf, recompute but only for indexes where obs and simulated are non-zero
-    message = "normal"
-    if obs_lh_norm == -numpy.inf:
-        idx_good_sim = forecast_mean_spatial_rates != 0
-        new_gridded_obs = gridded_obs[idx_good_sim]
-        new_n_obs = numpy.sum(new_gridded_obs)
-        print(f"Found -inf as the observed likelihood score. "
-              f"Assuming event(s) occurred in undersampled region of forecast.\n"
-              f"Recomputing with {new_n_obs} events after removing {n_obs - new_n_obs} events.")
-
-        new_ard = forecast_mean_spatial_rates[idx_good_sim]
-        _, obs_lh_norm = _compute_likelihood(new_gridded_obs, new_ard, expected_cond_count, n_obs)
-        message = "undersampled"
-
-    # check for nans here and remove from spatial distribution
-    test_distribution_spatial_1d = numpy.array(test_distribution)
-    if numpy.isnan(numpy.sum(test_distribution_spatial_1d)):
-        test_distribution_spatial_1d = test_distribution_spatial_1d[~numpy.isnan(test_distribution_spatial_1d)]
-
-    if n_obs == 0 or numpy.isnan(obs_lh_norm):
-        message = "not-valid"
-        delta_1, delta_2 = -1, -1
-    else:
-        delta_1, delta_2 = get_quantiles(test_distribution_spatial_1d, obs_lh_norm)
-
-    result = CatalogSpatialTestResult(test_distribution=test_distribution_spatial_1d,
-                                      name='S-Test',
-                                      observed_statistic=obs_lh_norm,
-                                      quantile=(delta_1, delta_2),
-                                      status=message,
-                                      min_mw=forecast.min_magnitude,
-                                      obs_catalog_repr=str(observed_catalog),
-                                      sim_name=forecast.name,
-                                      obs_name=observed_catalog.name)
-
-    return result
+    return _spatial_test_result(test_distribution, gridded_obs, forecast_mean_spatial_rates, expected_cond_count,
+                                forecast, observed_catalog)
 
 def magnitude_test(forecast, observed_catalog, verbose=True):
     """ Performs magnitude test for catalog-based forecasts """
@@ -149,46 +110,26 @@ def magnitude_test(forecast, observed_catalog, verbose=True):
 
     # short-circuit if zero events
     if observed_catalog.event_count == 0:
-        print("Cannot perform magnitude test when observed event count is zero.")
-        # prepare result
-        result = CatalogMagnitudeTestResult(test_distribution=test_distribution,
-                                            name='M-Test',
-                                            observed_statistic=None,
-                                            quantile=(None, None),
-                                            status='not-valid',
-                                            min_mw=forecast.min_magnitude,
-                                            obs_catalog_repr=str(observed_catalog),
-                                            obs_name=observed_catalog.name,
-                                            sim_name=forecast.name)
-
-        return result
+        return _magnitude_test_not_valid(forecast, observed_catalog)
 
     # compute expected rates for forecast if needed
     if forecast.expected_rates is None:
         forecast.get_expected_rates(verbose=verbose)
 
     # returns the average events in the magnitude bins
-    union_histogram = forecast.expected_rates.magnitude_counts()
-    n_union_events = numpy.sum(union_histogram)
     obs_histogram = observed_catalog.magnitude_counts()
-    n_obs = numpy.sum(obs_histogram)
-    union_scale = n_obs / n_union_events
-    scaled_union_histogram = union_histogram * union_scale
+    scaled_union_histogram = _scaled_union_histogram(forecast, obs_histogram)
 
     # compute the test statistic for each catalog
     t0 = time.time()
     for i, catalog in enumerate(forecast):
         mag_counts = catalog.magnitude_counts()
-        n_events = numpy.sum(mag_counts)
-        if n_events == 0:
+        d_statistic = _magnitude_statistic(mag_counts, obs_histogram, scaled_union_histogram)
+        if d_statistic is None:
             # print("Skipping to next because catalog contained zero events.")
             continue
-        scale = n_obs / n_events
-        catalog_histogram = mag_counts * scale
         # compute magnitude test statistic for the catalog
-        test_distribution.append(
-            cumulative_square_diff(numpy.log10(catalog_histogram + 1), numpy.log10(scaled_union_histogram + 1))
-        )
+        test_distribution.append(d_statistic)
         # output status
         if verbose:
             tens_exp = numpy.floor(numpy.log10(i + 1))
@@ -196,24 +137,7 @@ def magnitude_test(forecast, observed_catalog, verbose=True):
                 t1 = time.time()
                 print(f'Processed {i + 1} catalogs in {t1 - t0} seconds', flush=True)
 
-    # compute observed statistic
-    obs_d_statistic = cumulative_square_diff(numpy.log10(obs_histogram + 1), numpy.log10(scaled_union_histogram + 1))
-
-    # score evaluation
-    delta_1, delta_2 = get_quantiles(test_distribution, obs_d_statistic)
-
-    # prepare result
-    result = CatalogMagnitudeTestResult(test_distribution=test_distribution,
-                              name='M-Test',
-                              observed_statistic=obs_d_statistic,
-                              quantile=(delta_1, delta_2),
-                              status='normal',
-                              min_mw=forecast.min_magnitude,
-                              obs_catalog_repr=str(observed_catalog),
-                              obs_name=observed_catalog.name,
-                              sim_name=forecast.name)
-
-    return result
+    return _magnitude_test_result(test_distribution, obs_histogram, scaled_union_histogram, forecast, observed_catalog)
 
 def pseudolikelihood_test(forecast, observed_catalog, verbose=True):
     """ Performs the spatial pseudolikelihood test for catalog forecasts.
@@ -249,10 +173,10 @@ def pseudolikelihood_test(forecast, observed_catalog, verbose=True):
     gridded_obs = observed_catalog.spatial_counts()
     n_obs = numpy.sum(gridded_obs)
 
+    evaluator = LikelihoodEvaluator(forecast_mean_spatial_rates, expected_cond_count, n_obs)
     t0 = time.time()
     for i, catalog in enumerate(forecast):
-        gridded_cat = catalog.spatial_counts()
-        plh, _ = _compute_likelihood(gridded_cat, forecast_mean_spatial_rates, expected_cond_count, n_obs)
+        plh, _ = evaluator.evaluate(*_catalog_spatial_cells(catalog))
         test_distribution.append(plh)
         # output status
         if verbose:
@@ -261,6 +185,284 @@ def pseudolikelihood_test(forecast, observed_catalog, verbose=True):
                 t1 = time.time()
                 print(f'Processed {i + 1} catalogs in {t1 - t0} seconds', flush=True)
 
+    return _pseudolikelihood_test_result(test_distribution, gridded_obs, forecast_mean_spatial_rates,
+                                         expected_cond_count, forecast, observed_catalog)
+
+def run_catalog_evaluations(forecast, observed_catalog, tests=CATALOG_TESTS, verbose=True):
+    """ Performs several catalog-based evaluations while reading the forecast only once.
+
+    Each of :func:`number_test`, :func:`spatial_test`, :func:`magnitude_test` and :func:`pseudolikelihood_test` iterates
+    through the forecast on its own, and the spatial tests iterate a second time to compute the expected rates. This
+    function makes a single pass through the stochastic event set. Every synthetic catalog is binned into spatial and
+    magnitude bins once, and the binned counts are used to compute the expected rates (if needed) and the test
+    statistics of all requested evaluations.
+
+    The spatial counts of each catalog are stored as the indices of the non-empty cells, so the memory required scales
+    with the number of events in the forecast and not with the size of the region.
+
+    Args:
+        forecast (:class:`csep.core.forecasts.CatalogForecast`): forecast to evaluate
+        observed_catalog (:class:`csep.core.catalogs.AbstractBaseCatalog`): evaluation data filtered to be consistent
+                                                                          with the forecast
+        tests (iterable): names of the evaluations to compute, any of 'number_test', 'spatial_test', 'magnitude_test'
+                          and 'pseudolikelihood_test'
+        verbose (bool): if true, print progress while iterating through the forecast
+
+    Returns:
+        results (dict): evaluation results keyed by the name of the test. the results are identical to those returned
+                        by the individual test functions.
+
+    Raises:
+        CSEPEvaluationException: if an unknown test is requested or forecast does not have required region information
+    """
+    tests = list(tests)
+    unknown = [test for test in tests if test not in CATALOG_TESTS]
+    if unknown:
+        raise CSEPEvaluationException(f"Unknown catalog evaluation(s) {unknown}. Choose from {CATALOG_TESTS}.")
+
+    n_obs_events = observed_catalog.event_count
+    do_spatial = 'spatial_test' in tests
+    do_pseudolikelihood = 'pseudolikelihood_test' in tests and n_obs_events != 0
+    do_magnitude = 'magnitude_test' in tests and n_obs_events != 0
+
+    if (do_spatial or do_pseudolikelihood) and forecast.region is None:
+        raise CSEPEvaluationException("Forecast must have region member to perform spatial test.")
+    if 'magnitude_test' in tests and (forecast.region is None or forecast.region.magnitudes is None):
+        raise CSEPEvaluationException("Forecast must have region.magnitudes member to perform magnitude test.")
+
+    need_spatial = do_spatial or do_pseudolikelihood
+    need_rates = (need_spatial or do_magnitude) and forecast.expected_rates is None
+
+    # binned information about each catalog collected during the pass through the forecast
+    event_counts = []
+    spatial_cells = []
+    magnitude_counts = []
+    sum_counts = None
+    if need_rates or do_magnitude:
+        n_poly, n_mag = forecast.region.num_nodes, len(forecast.region.magnitudes)
+    if need_rates:
+        sum_counts = numpy.zeros((n_poly, n_mag))
+
+    t0 = time.time()
+    for i, catalog in enumerate(forecast):
+        event_counts.append(catalog.event_count)
+        if need_spatial or need_rates or do_magnitude:
+            # force catalog to use the forecast region
+            catalog.region = forecast.region
+            spatial_idx, mag_idx = _bin_catalog_indices(catalog, need_spatial or need_rates, do_magnitude or need_rates)
+            if need_rates:
+                if numpy.any(mag_idx == -1):
+                    raise ValueError("at least one magnitude value outside of the valid region.")
+                sum_counts += _bin_spatial_magnitude_counts(spatial_idx, mag_idx, n_poly, n_mag)
+            if need_spatial:
+                # store the spatial counts as the unique cells with events in them
+                spatial_cells.append(numpy.unique(spatial_idx, return_counts=True))
+            if do_magnitude:
+                # same as catalog.magnitude_counts(), magnitudes below the first bin are counted in the last bin
+                magnitude_counts.append(_bin_counts(mag_idx % n_mag, n_mag))
+        # output status
+        if verbose:
+            tens_exp = numpy.floor(numpy.log10(i + 1))
+            if (i + 1) % 10 ** tens_exp == 0:
+                t1 = time.time()
+                print(f'Processed {i + 1} catalogs in {t1 - t0} seconds', flush=True)
+
+    if need_rates:
+        # after we iterate through the catalogs, we know forecast.n_cat
+        forecast.expected_rates = GriddedForecast(forecast.start_time, forecast.end_time, data=sum_counts / forecast.n_cat,
+                                                  region=forecast.region, magnitudes=forecast.magnitudes,
+                                                  name=forecast.name)
+
+    results = {}
+    if 'number_test' in tests:
+        results['number_test'] = _number_test_result(event_counts, forecast, observed_catalog)
+
+    if need_spatial:
+        expected_cond_count = forecast.expected_rates.sum()
+        forecast_mean_spatial_rates = forecast.expected_rates.spatial_counts()
+        gridded_obs = observed_catalog.spatial_counts()
+        n_obs = numpy.sum(gridded_obs)
+        spatial_distribution = []
+        pseudolikelihood_distribution = []
+        evaluator = LikelihoodEvaluator(forecast_mean_spatial_rates, expected_cond_count, n_obs)
+        for cells, counts in spatial_cells:
+            plh, lh_norm = evaluator.evaluate(cells, counts)
+            spatial_distribution.append(lh_norm)
+            pseudolikelihood_distribution.append(plh)
+        if do_spatial:
+            if n_obs_events == 0:
+                print(f'Spatial test not-invalid because no events in observed catalog.')
+            results['spatial_test'] = _spatial_test_result(spatial_distribution, gridded_obs,
+                                                           forecast_mean_spatial_rates, expected_cond_count,
+                                                           forecast, observed_catalog)
+        if do_pseudolikelihood:
+            results['pseudolikelihood_test'] = _pseudolikelihood_test_result(pseudolikelihood_distribution,
+                                                                             gridded_obs, forecast_mean_spatial_rates,
+                                                                             expected_cond_count, forecast,
+                                                                             observed_catalog)
+
+    if 'pseudolikelihood_test' in tests and n_obs_events == 0:
+        print(f'Skipping pseudolikelihood test because no events in observed catalog.')
+        results['pseudolikelihood_test'] = None
+
+    if 'magnitude_test' in tests:
+        if n_obs_events == 0:
+            results['magnitude_test'] = _magnitude_test_not_valid(forecast, observed_catalog)
+        else:
+            obs_histogram = observed_catalog.magnitude_counts()
+            scaled_union_histogram = _scaled_union_histogram(forecast, obs_histogram)
+            magnitude_distribution = []
+            for mag_counts in magnitude_counts:
+                d_statistic = _magnitude_statistic(mag_counts, obs_histogram, scaled_union_histogram)
+                if d_statistic is not None:
+                    magnitude_distribution.append(d_statistic)
+            results['magnitude_test'] = _magnitude_test_result(magnitude_distribution, obs_histogram,
+                                                               scaled_union_histogram, forecast, observed_catalog)
+
+    return {test: results[test] for test in tests}
+
+def _bin_catalog_indices(catalog, spatial=True, magnitude=True):
+    """ Returns the spatial and magnitude bin indices of the events in catalog.
+
+    Either index is None if it was not requested. Catalogs without events return empty index arrays.
+    """
+    spatial_idx, mag_idx = None, None
+    if catalog.event_count == 0:
+        empty = numpy.empty(0, dtype=numpy.int64)
+        return (empty if spatial else None), (empty if magnitude else None)
+    if spatial:
+        # this function could throw ValueError if points are outside of the region
+        spatial_idx = catalog.get_spatial_idx()
+    if magnitude:
+        mag_idx = catalog.get_mag_idx()
+    return spatial_idx, mag_idx
+
+def _catalog_spatial_cells(catalog):
+    """ Returns the sorted indexes of the spatial cells with events in catalog and the number of events in each cell """
+    # this function could throw ValueError if points are outside of the region
+    spatial_idx, _ = _bin_catalog_indices(catalog, spatial=True, magnitude=False)
+    return numpy.unique(spatial_idx, return_counts=True)
+
+def _number_test_result(event_counts, forecast, observed_catalog):
+    """ Scores the observed event count against the event counts of the forecast """
+    obs_count = observed_catalog.event_count
+    delta_1, delta_2 = get_quantiles(event_counts, obs_count)
+    # prepare result
+    result = CatalogNumberTestResult(test_distribution=event_counts,
+                                     name='Catalog N-Test',
+                                     observed_statistic=obs_count,
+                                     quantile=(delta_1, delta_2),
+                                     status='normal',
+                                     obs_catalog_repr=str(observed_catalog),
+                                     sim_name=forecast.name,
+                                     min_mw=forecast.min_magnitude,
+                                     obs_name=observed_catalog.name)
+    return result
+
+def _spatial_test_result(test_distribution, gridded_obs, forecast_mean_spatial_rates, expected_cond_count,
+                         forecast, observed_catalog):
+    """ Computes the observed spatial statistic and scores it against the test distribution """
+    n_obs = numpy.sum(gridded_obs)
+    _, obs_lh_norm = _compute_likelihood(gridded_obs, forecast_mean_spatial_rates, expected_cond_count, n_obs)
+    # if obs_lh is -numpy.inf, recompute but only for indexes where obs and simulated are non-zero
+    message = "normal"
+    if obs_lh_norm == -numpy.inf:
+        idx_good_sim = forecast_mean_spatial_rates != 0
+        new_gridded_obs = gridded_obs[idx_good_sim]
+        new_n_obs = numpy.sum(new_gridded_obs)
+        print(f"Found -inf as the observed likelihood score. "
+              f"Assuming event(s) occurred in undersampled region of forecast.\n"
+              f"Recomputing with {new_n_obs} events after removing {n_obs - new_n_obs} events.")
+
+        new_ard = forecast_mean_spatial_rates[idx_good_sim]
+        _, obs_lh_norm = _compute_likelihood(new_gridded_obs, new_ard, expected_cond_count, n_obs)
+        message = "undersampled"
+
+    # check for nans here and remove from spatial distribution
+    test_distribution_spatial_1d = numpy.array(test_distribution)
+    if numpy.isnan(numpy.sum(test_distribution_spatial_1d)):
+        test_distribution_spatial_1d = test_distribution_spatial_1d[~numpy.isnan(test_distribution_spatial_1d)]
+
+    if n_obs == 0 or numpy.isnan(obs_lh_norm):
+        message = "not-valid"
+        delta_1, delta_2 = -1, -1
+    else:
+        delta_1, delta_2 = get_quantiles(test_distribution_spatial_1d, obs_lh_norm)
+
+    result = CatalogSpatialTestResult(test_distribution=test_distribution_spatial_1d,
+                                      name='S-Test',
+                                      observed_statistic=obs_lh_norm,
+                                      quantile=(delta_1, delta_2),
+                                      status=message,
+                                      min_mw=forecast.min_magnitude,
+                                      obs_catalog_repr=str(observed_catalog),
+                                      sim_name=forecast.name,
+                                      obs_name=observed_catalog.name)
+
+    return result
+
+def _scaled_union_histogram(forecast, obs_histogram):
+    """ Returns the average magnitude histogram of the forecast scaled to the observed event count """
+    union_histogram = forecast.expected_rates.magnitude_counts()
+    n_union_events = numpy.sum(union_histogram)
+    n_obs = numpy.sum(obs_histogram)
+    union_scale = n_obs / n_union_events
+    return union_histogram * union_scale
+
+def _magnitude_statistic(mag_counts, obs_histogram, scaled_union_histogram):
+    """ Computes the magnitude test statistic for a single catalog, returns None if the catalog has no events """
+    n_events = numpy.sum(mag_counts)
+    if n_events == 0:
+        return None
+    n_obs = numpy.sum(obs_histogram)
+    scale = n_obs / n_events
+    catalog_histogram = mag_counts * scale
+    return cumulative_square_diff(numpy.log10(catalog_histogram + 1), numpy.log10(scaled_union_histogram + 1))
+
+def _magnitude_test_not_valid(forecast, observed_catalog):
+    """ Returns the magnitude test result used when the observed catalog is empty """
+    print("Cannot perform magnitude test when observed event count is zero.")
+    # prepare result
+    result = CatalogMagnitudeTestResult(test_distribution=[],
+                                        name='M-Test',
+                                        observed_statistic=None,
+                                        quantile=(None, None),
+                                        status='not-valid',
+                                        min_mw=forecast.min_magnitude,
+                                        obs_catalog_repr=str(observed_catalog),
+                                        obs_name=observed_catalog.name,
+                                        sim_name=forecast.name)
+
+    return result
+
+def _magnitude_test_result(test_distribution, obs_histogram, scaled_union_histogram, forecast, observed_catalog):
+    """ Computes the observed magnitude statistic and scores it against the test distribution """
+    # compute observed statistic
+    obs_d_statistic = cumulative_square_diff(numpy.log10(obs_histogram + 1), numpy.log10(scaled_union_histogram + 1))
+
+    # score evaluation
+    delta_1, delta_2 = get_quantiles(test_distribution, obs_d_statistic)
+
+    # prepare result
+    result = CatalogMagnitudeTestResult(test_distribution=test_distribution,
+                              name='M-Test',
+                              observed_statistic=obs_d_statistic,
+                              quantile=(delta_1, delta_2),
+                              status='normal',
+                              min_mw=forecast.min_magnitude,
+                              obs_catalog_repr=str(observed_catalog),
+                              obs_name=observed_catalog.name,
+                              sim_name=forecast.name)
+
+    return result
+
+def _pseudolikelihood_test_result(test_distribution, gridded_obs, forecast_mean_spatial_rates, expected_cond_count,
+                                  forecast, observed_catalog):
+    """ Computes the observed pseudolikelihood and scores it against the test distribution
+
+    Returns None if there are no observed events after correcting for under-sampling in the forecast.
+    """
+    n_obs = numpy.sum(gridded_obs)
     obs_plh, _ = _compute_likelihood(gridded_obs, forecast_mean_spatial_rates, expected_cond_count, n_obs)
     # if obs_lh is -numpy.inf, recompute but only for indexes where obs and simulated are non-zero
     message = "normal"
@@ -1,9 +1,14 @@
+import copy
 import csv
 import gzip
 import json
 import operator
 import os
 import datetime
+import mmap
+import shutil
+import struct
+import warnings
 
 # 3rd party required for core package
 import numpy
@@ -11,10 +16,11 @@ import pandas
 
 # CSEP Imports
 from csep.utils.time_utils import epoch_time_to_utc_datetime, datetime_to_utc_epoch, strptime_to_utc_datetime, \
-    millis_to_days, parse_string_format, days_to_millis, strptime_to_utc_epoch, utc_now_datetime, create_utc_datetime
+    millis_to_days, parse_string_format, days_to_millis, strptime_to_utc_epoch, utc_now_datetime, create_utc_datetime, \
+    strptime_array_to_utc_epoch
 from csep.utils.stats import min_or_none, max_or_none
 from csep.utils.calc import discretize
-from csep.core.regions import CartesianGrid2D
+from csep.core.regions import CartesianGrid2D, _bin_counts, _bin_spatial_magnitude_counts
 import csep.utils.comcat as comcat
 import csep.utils.geonet as geonet
 from csep.core.exceptions import CSEPSchedulerException, CSEPCatalogException, CSEPIOException
@@ -26,6 +32,72 @@ from csep.utils.file import get_file_extension
 from csep.utils.plots import plot_catalog
 
 
+class CatalogFilter:
+    """
+    Filter statements compiled into a predicate over the columns of a catalog.
+
+    Statements are parsed once, and datetime literals are converted into epoch times when the filter is created. Calling
+    the filter on the structured array of a catalog evaluates all statements in a single pass over the columns and
+    returns a boolean mask, where the statements are joined using a logical and. This is the same result as applying
+    the statements one at a time using :meth:`AbstractBaseCatalog.filter`, without parsing the strings or copying the
+    events after each statement. Filters should be compiled once and reused when filtering many catalogs, e.g., the
+    catalogs in a :class:`csep.core.forecasts.CatalogForecast`.
+
+    Args:
+        statements (str, iter): logical statements to evaluate, e.g., ['magnitude > 4.0', 'datetime >= 1995-01-01 0:0:0']
+    """
+
+    operators = {'>': operator.gt,
+                 '<': operator.lt,
+                 '>=': operator.ge,
+                 '<=': operator.le,
+                 '==': operator.eq}
+
+    def __init__(self, statements):
+        if isinstance(statements, str):
+            filters = [statements]
+        elif isinstance(statements, (list, tuple)):
+            filters = list(statements)
+        else:
+            raise ValueError('statements should be either a string or list or tuple of strings')
+        self.statements = statements
+        # list of tuples (column name, operator, value)
+        self.predicates = [self._parse(filt) for filt in filters]
+
+    @classmethod
+    def compile(cls, statements):
+        """ Returns the statements as a :class:`CatalogFilter`, these are returned as is if they are already compiled. """
+        if isinstance(statements, cls):
+            return statements
+        return cls(statements)
+
+    @classmethod
+    def _parse(cls, statement):
+        tokens = statement.split()
+        if tokens and tokens[0] == 'datetime':
+            _, oper, date, time = tokens
+            # we map the requested datetime to an epoch time so we act like the user requested origin_time
+            name = 'origin_time'
+            value = strptime_to_utc_epoch(' '.join([date, time]))
+        else:
+            name, oper, value = tokens
+        try:
+            oper = cls.operators[oper]
+        except KeyError:
+            raise ValueError(f"unsupported operator '{oper}' in filter statement '{statement}'") from None
+        return name, oper, float(value)
+
+    def __call__(self, events):
+        """ Returns boolean mask of events in the structured array that satisfy all statements. """
+        mask = numpy.ones(len(events), dtype=bool)
+        for name, oper, value in self.predicates:
+            mask &= oper(events[name], value)
+        return mask
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.statements!r})'
+
+
 class AbstractBaseCatalog(LoggingMixin):
     """
     Abstract catalog base class for PyCSEP catalogs. This class should not and cannot be used on its own. This just
@@ -67,13 +139,9 @@ class AbstractBaseCatalog(LoggingMixin):
         # integer index
         self.metadata = metadata or {}
 
-        # cleans the catalog to set as ndarray, see setter.
+        # cleans the catalog to set as ndarray and computes summary statistics, see setter.
         self.catalog = data  # type: numpy.ndarray
 
-        # use user defined stats if entered into catalog
-        if data is not None and self.compute_stats:
-            self.update_catalog_stats()
-
     def __eq__(self, other):
         """ Compares whether two catalogs are equal by comparing their dicts. """
         return self.to_dict() == other.to_dict()
@@ -492,8 +560,11 @@ class AbstractBaseCatalog(LoggingMixin):
         simulations, so likely all other simulations. Implementations should try and limit how often this function
         will be called.
 
+        The statements are compiled into a :class:`CatalogFilter` that evaluates all statements in a single pass over
+        the catalog. When filtering many catalogs, pass a compiled filter to avoid parsing the statements each time.
+
         Args:
-            statements (str, iter): logical statements to evaluate, e.g., ['magnitude > 4.0', 'year >= 1995']
+            statements (str, iter, CatalogFilter): logical statements to evaluate, e.g., ['magnitude > 4.0', 'year >= 1995']
             in_place (bool): return new instance of catalog
 
         Returns:
@@ -503,58 +574,28 @@ class AbstractBaseCatalog(LoggingMixin):
         if not self.filters and statements is None:
             raise CSEPCatalogException("Must provide filter statements to function or class to filter")
 
-        # programmatically assign operators
-        operators = {'>': operator.gt,
-                     '<': operator.lt,
-                     '>=': operator.ge,
-                     '<=': operator.le,
-                     '==': operator.eq}
-
         # filter catalogs, implied logical and
         if statements is None:
             statements = self.filters
 
-        if isinstance(statements, str):
-            name = statements.split(' ')[0]
-            if name == 'datetime':
-                _, oper, date, time = statements.split(' ')
-                name = 'origin_time'
-                # can be a datetime.datetime object or datetime string, if we want to support filtering on meta data it
-                # can happen here. but need to determine what to do if entry are not present bc meta data does not
-                # need to be square
-                value = strptime_to_utc_epoch(' '.join([date, time]))
-                filtered = self.catalog[operators[oper](self.catalog[name], float(value))]
-            else:
-                name, oper, value = statements.split(' ')
-                filtered = self.catalog[operators[oper](self.catalog[name], float(value))]
-        elif isinstance(statements, (list, tuple)):
-            # slower but at the convenience of not having to call multiple times
-            filters = list(statements)
-            filtered = numpy.copy(self.catalog)
-            for filt in filters:
-                name = filt.split(' ')[0]
-                # create indexing array, start with all events
-                if name == 'datetime':
-                    _, oper, date, time = filt.split(' ')
-                    # we map the requested datetime to an epoch time so we act like the user requested origin_time
-                    name = 'origin_time'
-                    value = strptime_to_utc_epoch(' '.join([date, time]))
-                    filtered = filtered[operators[oper](filtered[name], float(value))]
-                else:
-                    name, oper, value = filt.split(' ')
-                    filtered = filtered[operators[oper](filtered[name], float(value))]
+        compiled = CatalogFilter.compile(statements)
+        mask = compiled(self.catalog)
+        if in_place and mask.all():
+            # nothing to remove, so we can keep the events and statistics as they are
+            filtered = self.catalog
         else:
-            raise ValueError('statements should be either a string or list or tuple of strings')
+            filtered = self.catalog[mask]
         # can return new instance of class or original instance
-        self.filters = statements
+        self.filters = compiled.statements
         if in_place:
-            self.catalog = filtered
+            if filtered is not self.catalog:
+                self.catalog = filtered
             return self
         else:
             # make and return new object
             cls = self.__class__
             inst = cls(data=filtered, catalog_id=self.catalog_id, format=self.format, name=self.name,
-                       region=self.region, filters=statements)
+                       region=self.region, filters=compiled.statements)
             return inst
 
     def filter_spatial(self, region=None, update_stats=False, in_place=True):
@@ -604,42 +645,38 @@ class AbstractBaseCatalog(LoggingMixin):
             mc (float): mag_completeness
 
         Returns:
+            self: instance of AbstractBaseCatalog, so that this function can be chained.
         """
+        mask = _mct_mask(self.get_epoch_times(), self.get_magnitudes(), m_main, event_epoch, mc=mc)
+        if not mask.all():
+            self.catalog = self.catalog[mask]
+        return self
 
-        def compute_mct(t, m):
-            return m - 4.5 - 0.75 * numpy.log10(t)
-
-        # compute critical time for efficiency
-        t_crit_days = 10 ** -((mc - m_main + 4.5) / 0.75)
-        t_crit_millis = days_to_millis(t_crit_days)
-
-        times = self.get_epoch_times()
-        mws = self.get_magnitudes()
+    @classmethod
+    def apply_mct_batch(cls, events, offsets, m_main, event_epoch, mc=2.5):
+        """
+        Applies time-dependent magnitude of completeness to a block of catalogs stored in columnar form.
 
-        # catalogs are stored stored by milliseconds
-        t_crit_epoch = t_crit_millis + event_epoch
+        The events of all catalogs are stored in one structured array and the events of catalog i are
+        events[offsets[i]:offsets[i+1]], which is the layout used by :class:`CSEPBinaryCatalogSet`. The completeness
+        model is applied to each catalog the same way as :meth:`apply_mct`, but all catalogs are handled at once.
 
-        # another short-circuit, again assumes that catalogs are sorted in time
-        if times[0] > t_crit_epoch:
-            return self
+        Args:
+            events (numpy.ndarray): structured array with at least the fields 'origin_time' and 'magnitude'
+            offsets (numpy.ndarray): offsets of the first event of each catalog with length n_cat + 1 and offsets[0] == 0
+            m_main (float): mainshock magnitude
+            event_epoch: epoch time in millis of event
+            mc (float): mag_completeness
 
-        # this is used to index the array, starting with accepting all events
-        filter = numpy.ones(self.event_count, dtype=bool)
-        for i, (mw, time) in enumerate(zip(mws, times)):
-            # we can break bc events are sorted in time
-            if time > t_crit_epoch:
-                break
-            if time < event_epoch:
-                continue
-            time_from_mshock_in_days = millis_to_days(time - event_epoch)
-            mct = compute_mct(time_from_mshock_in_days, m_main)
-            # ignore events with mw < mct
-            if mw < mct:
-                filter[i] = False
-
-        filtered = self.catalog[filter]
-        self.catalog = filtered
-        return self
+        Returns:
+            events (numpy.ndarray): events that are retained, in the same order
+            offsets (numpy.ndarray): offsets of the first retained event of each catalog
+        """
+        offsets = numpy.asarray(offsets)
+        mask = _mct_mask(events['origin_time'], events['magnitude'], m_main, event_epoch, mc=mc, offsets=offsets)
+        kept = numpy.zeros(len(mask) + 1, dtype=numpy.int64)
+        numpy.cumsum(mask, out=kept[1:])
+        return events[mask], kept[offsets]
 
     def get_csep_format(self):
         """
@@ -678,12 +715,9 @@ class AbstractBaseCatalog(LoggingMixin):
         if self.region is None:
             raise CSEPSchedulerException("Cannot create binned rates without region information.")
 
-        n_poly = self.region.num_nodes
-        event_counts = numpy.zeros(n_poly)
         # this function could throw ValueError if points are outside of the region
         idx = self.region.get_index_of(self.get_longitudes(), self.get_latitudes())
-        numpy.add.at(event_counts, idx, 1)
-        return event_counts
+        return _bin_counts(idx, self.region.num_nodes)
 
     def spatial_event_probability(self):
         # make sure region is specified with catalog
@@ -728,24 +762,30 @@ class AbstractBaseCatalog(LoggingMixin):
             else:
                 return out
         idx = bin1d_vec(self.get_magnitudes(), mag_bins, tol=tol, right_continuous=True)
-        numpy.add.at(out, idx, 1)
+        # magnitudes below the first bin have index -1 and are counted in the last bin, same as numpy.add.at
+        out = _bin_counts(numpy.asarray(idx) % len(mag_bins), len(mag_bins))
         if retbins:
             return (mag_bins, out)
         else:
             return out
 
-    def spatial_magnitude_counts(self, mag_bins=None, tol=0.00001):
+    def spatial_magnitude_counts(self, mag_bins=None, tol=0.00001, return_skipped=False):
         """ Return counts of events in space-magnitude region.
 
         We figure out the index of the polygons and create a map that relates the spatial coordinate in the
         Cartesian grid with the polygon in region.
 
+        By default, a ValueError is raised if any event is outside of the space-magnitude region. If return_skipped is
+        true, these events are not counted and they are returned along with the counts.
+
         Args:
             mag_bins (list, numpy.array): magnitude bins (optional), if empty tries to use magnitude bins associated with region
             tol (float): tolerance for comparisons within magnitude bins
+            return_skipped (bool): if true, return events outside of the space-magnitude region instead of raising
 
         Returns:
             output: unnormalized event count in each bin, 1d ndarray where index corresponds to midpoints
+            skipped (numpy.ndarray): events outside of the region, only returned if return_skipped is true
 
         """
         # make sure region is specified with catalog
@@ -760,16 +800,21 @@ class AbstractBaseCatalog(LoggingMixin):
             mag_bins = self.region.magnitudes
         # short-circuit if zero-events in catalog... return array of zeros
         n_poly = self.region.num_nodes
-        event_counts = numpy.zeros((n_poly, len(mag_bins)))
-        if self.event_count != 0:
-            # this will throw ValueError if points outside range
-            spatial_idx = self.region.get_index_of(self.get_longitudes(), self.get_latitudes())
-            # also throwing the same error
-            mag_idx = bin1d_vec(self.get_magnitudes(), mag_bins, tol=tol, right_continuous=True)
-            for idx in range(spatial_idx.shape[0]):
-                if mag_idx[idx] == -1:
-                    raise ValueError("at least one magnitude value outside of the valid region.")
-                event_counts[(spatial_idx[idx], mag_idx[idx])] += 1
+        if self.event_count == 0:
+            event_counts = numpy.zeros((n_poly, len(mag_bins)))
+            return (event_counts, self.catalog[:0]) if return_skipped else event_counts
+        lons, lats = self.get_longitudes(), self.get_latitudes()
+        mag_idx = bin1d_vec(self.get_magnitudes(), mag_bins, tol=tol, right_continuous=True).astype(numpy.int64)
+        if return_skipped:
+            skipped = self.region.get_masked(lons, lats) | (mag_idx == -1)
+            lons, lats, mag_idx = lons[~skipped], lats[~skipped], mag_idx[~skipped]
+        # this will throw ValueError if points outside range
+        spatial_idx = self.region.get_index_of(lons, lats)
+        if numpy.any(mag_idx == -1):
+            raise ValueError("at least one magnitude value outside of the valid region.")
+        event_counts = _bin_spatial_magnitude_counts(spatial_idx, mag_idx, n_poly, len(mag_bins))
+        if return_skipped:
+            return event_counts, self.catalog[skipped]
         return event_counts
 
     def length_in_seconds(self):
@@ -907,14 +952,19 @@ class CSEPCatalog(AbstractBaseCatalog):
         super().__init__(**kwargs)
 
     @classmethod
-    def load_ascii_catalogs(cls, filename, **kwargs):
+    def load_ascii_catalogs(cls, filename, chunk_size=1000000, **kwargs):
         """ Loads multiple catalogs in csep-ascii format.
 
         This function can load multiple catalogs stored in a single file. This typically called to
         load a catalog-based forecast, but could also load a collection of catalogs stored in the same file
 
+        The file is parsed in chunks of rows using columnar operations. Time strings are converted in bulk and rows are
+        split into catalogs using the catalog_id column. Catalogs without events, either listed using an empty row or
+        missing from the file, are yielded as empty catalogs.
+
         Args:
             filename (str): filepath or directory of catalog files
+            chunk_size (int): number of rows parsed at a time
             **kwargs (dict): passed to class constructor
 
         Return:
@@ -929,38 +979,63 @@ class CSEPCatalog(AbstractBaseCatalog):
             start_time = strptime_to_utc_datetime(split_fname[1], format="%Y-%m-%dT%H-%M-%S-%f")
             return (name, start_time)
 
-        def read_float(val):
-            """Returns val as float or None if unable"""
-            try:
-                val = float(val)
-            except:
-                val = None
-            return val
-
-        def is_header_line(line):
-            if line[0].lower() == 'lon':
-                return True
-            else:
-                return False
-
-        def read_catalog_line(line):
-            # convert to correct types
-            lon = read_float(line[0])
-            lat = read_float(line[1])
-            magnitude = read_float(line[2])
-            # maybe fractional seconds are not included
-            origin_time = line[3]
-            if origin_time:
-                try:
-                    origin_time = strptime_to_utc_epoch(line[3], format='%Y-%m-%dT%H:%M:%S.%f')
-                except ValueError:
-                    origin_time = strptime_to_utc_epoch(line[3], format='%Y-%m-%dT%H:%M:%S')
-            depth = read_float(line[4])
-            catalog_id = int(line[5])
-            event_id = line[6]
-            # temporary event
-            temp_event = (event_id, origin_time, lat, lon, depth, magnitude)
-            return temp_event, catalog_id
+        def has_header_line(filename):
+            with open(filename, 'r', newline='') as input_file:
+                line = next(csv.reader(input_file, delimiter=','), None)
+            return bool(line) and line[0].lower() == 'lon'
+
+        def read_chunk(chunk):
+            """ Returns catalog ids of all rows and events from rows that are not empty """
+            catalog_ids = chunk['catalog_id'].to_numpy(dtype=numpy.int64)
+            time_strings = chunk['origin_time'].to_numpy(dtype=object)
+            # OK if event_id is empty
+            not_empty = (time_strings != '') | chunk[float_cols].notna().any(axis=1).to_numpy()
+            chunk = chunk[not_empty]
+            events = numpy.empty(len(chunk), dtype=cls.dtype)
+            events['id'] = chunk['id'].to_numpy(dtype=object)
+            events['origin_time'] = strptime_array_to_utc_epoch(time_strings[not_empty])
+            for col in float_cols:
+                events[col] = chunk[col].to_numpy()
+            return catalog_ids, not_empty, events
+
+        def summarize_groups(events, bounds):
+            """ Returns (min, max) of the summary columns for each group of events, None if a group is empty """
+            sizes = numpy.diff(bounds)
+            starts = bounds[:-1][sizes > 0]
+            summaries = [None] * len(sizes)
+            if len(starts) > 0:
+                reduced = [(numpy.minimum.reduceat(events[col], starts), numpy.maximum.reduceat(events[col], starts))
+                           for col in summary_cols]
+                for j, i in enumerate(numpy.flatnonzero(sizes)):
+                    summaries[i] = [(mins[j], maxs[j]) for mins, maxs in reduced]
+            return summaries
+
+        def merge_summaries(first, second):
+            if first is None or second is None:
+                return first or second
+            return [(numpy.minimum(a[0], b[0]), numpy.maximum(a[1], b[1])) for a, b in zip(first, second)]
+
+        def create_catalog(events, catalog_id, summary):
+            """ Creates catalog using summary statistics computed in bulk instead of calling update_catalog_stats()
+
+            Events are already structured arrays of cls.dtype, so catalogs are copied from a template instead of
+            running the constructor and the catalog setter for every catalog.
+            """
+            catalog = cls.__new__(cls)
+            catalog.__dict__.update(template.__dict__)
+            catalog.filters = list(template.filters)
+            catalog.metadata = dict(template.metadata)
+            catalog.catalog_id = catalog_id
+            catalog._catalog = events if len(events) > 0 else numpy.empty(0, dtype=cls.dtype)
+            if compute_stats:
+                if summary is None:
+                    catalog.update_catalog_stats()
+                else:
+                    (catalog.min_magnitude, catalog.max_magnitude), (catalog.min_latitude, catalog.max_latitude), \
+                        (catalog.min_longitude, catalog.max_longitude), (start_time, end_time) = summary
+                    catalog.start_time = epoch_time_to_utc_datetime(start_time)
+                    catalog.end_time = epoch_time_to_utc_datetime(end_time)
+            return catalog
 
         # overwrite filename, if user specifies
         try:
@@ -971,70 +1046,54 @@ class CSEPCatalog(AbstractBaseCatalog):
 
         # handle all catalogs in single file
         if os.path.isfile(filename):
-            with open(filename, 'r', newline='') as input_file:
-                catalog_reader = csv.reader(input_file, delimiter=',')
-                # csv treats everything as a string convert to correct types
-                events = []
-                # all catalogs should start at zero
-                prev_id = None
-                for line in catalog_reader:
-                    # skip header line on first read if included in file
-                    if prev_id is None:
-                        if is_header_line(line):
-                            continue
-                    # read line and return catalog id
-                    temp_event, catalog_id = read_catalog_line(line)
-                    empty = False
-                    # OK if event_id is empty
-                    if all([val in (None, '') for val in temp_event[1:]]):
-                        empty = True
-                    # first event is when prev_id is none, catalog_id should always start at zero
-                    if prev_id is None:
-                        prev_id = 0
-                        # if the first catalog doesn't start at zero
-                        if catalog_id != prev_id:
-                            if not empty:
-                                events = [temp_event]
-                            else:
-                                events = []
-                            for id in range(catalog_id):
-                                yield cls(data=[], catalog_id=id, **kwargs)
-                            prev_id = catalog_id
-                            continue
-                    # accumulate event if catalog_id is the same as previous event
+            names = ['longitude', 'latitude', 'magnitude', 'origin_time', 'depth', 'catalog_id', 'id']
+            float_cols = ['longitude', 'latitude', 'magnitude', 'depth']
+            summary_cols = ['magnitude', 'latitude', 'longitude', 'origin_time']
+            compute_stats = kwargs.pop('compute_stats', True)
+            # constructor runs once, catalogs share its attributes
+            template = cls(data=None, compute_stats=compute_stats, **kwargs)
+            dtypes = {'origin_time': str, 'catalog_id': numpy.int64, 'id': str}
+            dtypes.update({col: numpy.float64 for col in float_cols})
+            reader = pandas.read_csv(filename, header=None, names=names, usecols=range(len(names)), dtype=dtypes,
+                                     skiprows=1 if has_header_line(filename) else 0, keep_default_na=False,
+                                     na_values={col: [''] for col in float_cols}, chunksize=chunk_size)
+            # events from the current catalog, these can span multiple chunks
+            events = []
+            summary = None
+            # all catalogs should start at zero
+            prev_id = None
+            for chunk in reader:
+                catalog_ids, not_empty, chunk_events = read_chunk(chunk)
+                first_id = catalog_ids[:1] if prev_id is None else [prev_id]
+                if numpy.any(numpy.diff(catalog_ids, prepend=first_id) < 0):
+                    raise ValueError(
+                        "catalog_id should be monotonically increasing and events should be ordered by catalog_id")
+                # rows with the same catalog_id are contiguous, so each group maps onto a slice of the events
+                starts = numpy.flatnonzero(numpy.diff(catalog_ids, prepend=catalog_ids[0] - 1))
+                event_bounds = numpy.append(numpy.cumsum(not_empty)[starts] - not_empty[starts], len(chunk_events))
+                summaries = summarize_groups(chunk_events, event_bounds)
+                for i, catalog_id in enumerate(catalog_ids[starts].tolist()):
+                    group_events = chunk_events[event_bounds[i]:event_bounds[i + 1]]
                     if catalog_id == prev_id:
-                        if not all([val in (None, '') for val in temp_event]):
-                            events.append(temp_event)
-                        prev_id = catalog_id
-                    # create and yield class if the events are from different catalogs
-                    elif catalog_id == prev_id + 1:
-                        yield cls(data=events, catalog_id=prev_id, **kwargs)
-                        # add event to new event list
-                        if not empty:
-                            events = [temp_event]
-                        else:
-                            events = []
-                        prev_id = catalog_id
-                    # this implies there are empty catalogs, because they are not listed in the ascii file
-                    elif catalog_id > prev_id + 1:
-                        yield cls(data=events, catalog_id=prev_id, **kwargs)
-                        # if prev_id = 0 and catalog_id = 2, then we skipped one catalog. thus, we skip catalog_id - prev_id - 1 catalogs
-                        num_empty_catalogs = catalog_id - prev_id - 1
-                        # first yield empty catalog classes
-                        for id in range(num_empty_catalogs):
-                            yield cls(data=[], catalog_id=catalog_id - num_empty_catalogs + id, **kwargs)
-                        prev_id = catalog_id
-                        # add event to new event list
-                        if not empty:
-                            events = [temp_event]
-                        else:
-                            events = []
+                        events.append(group_events)
+                        summary = merge_summaries(summary, summaries[i])
+                        continue
+                    # if the first catalog doesn't start at zero
+                    if prev_id is None:
+                        num_empty_catalogs = catalog_id
                     else:
-                        raise ValueError(
-                            "catalog_id should be monotonically increasing and events should be ordered by catalog_id")
-                # yield final catalog, note: since this is just loading catalogs, it has no idea how many should be there
-                cat = cls(data=events, catalog_id=prev_id, **kwargs)
-                yield cat
+                        yield create_catalog(numpy.concatenate(events), prev_id, summary)
+                        num_empty_catalogs = catalog_id - prev_id - 1
+                    # this implies there are empty catalogs, because they are not listed in the ascii file
+                    for id in range(catalog_id - num_empty_catalogs, catalog_id):
+                        yield create_catalog([], id, None)
+                    events = [group_events]
+                    summary = summaries[i]
+                    prev_id = catalog_id
+            # yield final catalog, note: since this is just loading catalogs, it has no idea how many should be there
+            if events:
+                events = numpy.concatenate(events)
+            yield create_catalog(events, prev_id, summary)
 
         elif os.path.isdir(filename):
             raise NotImplementedError("reading from directory or batched files not implemented yet!")
@@ -1077,7 +1136,7 @@ class UCERF3Catalog(AbstractBaseCatalog):
         super().__init__(**kwargs)
 
     @classmethod
-    def load_catalogs(cls, filename, **kwargs):
+    def load_catalogs(cls, filename, decompress=False, cache_index=False, **kwargs):
         """
         Loads catalogs based on the merged binary file format of UCERF3. File format is described at
         https://scec.usc.edu/scecpedia/CSEP2_Storing_Stochastic_Event_Sets#Introduction.
@@ -1085,51 +1144,69 @@ class UCERF3Catalog(AbstractBaseCatalog):
         There is also the load_catalog method that will work on the individual binary output of the UCERF3-ETAS
         model.
 
+        Uncompressed files are opened as a :class:`UCERF3CatalogSet`, which supports len(), random access by catalog_id,
+        slicing and sharding. Compressed files (.gz) can only be read in sequence, so the catalogs are returned using a
+        generator. If decompress is true, the compressed file is decompressed once next to the original file and the
+        decompressed file is opened as a :class:`UCERF3CatalogSet` instead.
+
         Args:
             filename (str): filename of binary stochastic event set
+            decompress (bool): if true, decompress .gz files to allow random access to the catalogs
+            cache_index (bool): if true, stores the offsets of the catalogs next to the file, see :class:`UCERF3CatalogSet`
             kwargs (dict): keyword arguments to pass to class constructor
         Returns:
-            list of catalogs of type UCERF3Catalog
-        """
-
-        # handle uncompressed binary file
-        if get_file_extension(filename) == 'bin':
-            with open(filename, 'rb') as catalog_file:
-                # parse 4byte header from merged file
-                number_simulations_in_set = numpy.fromfile(catalog_file, dtype='>i4', count=1)[0]
-                # load all catalogs from merged file
-                for catalog_id in range(number_simulations_in_set):
-                    version = numpy.fromfile(catalog_file, dtype=">i2", count=1)[0]
-                    dtype = cls._get_header_dtype(version)
-                    header = numpy.fromfile(catalog_file, dtype=dtype, count=1)
-                    catalog_size = header['catalog_size'][0]
-                    # read catalog
-                    catalog = numpy.fromfile(catalog_file, dtype=cls._get_catalog_dtype(version), count=catalog_size)
-                    # add column that stores catalog_id in case we want to store in database
-                    u3_catalog = cls(filename=filename, data=catalog, catalog_id=catalog_id, **kwargs)
-                    u3_catalog.dtype = dtype
-                    yield u3_catalog
-
-        # handle compressed file by decompressing inline
-        elif get_file_extension(filename) == 'gz':
-            with gzip.open(filename, 'rb') as catalog_file:
-                number_simulations_in_set = numpy.frombuffer(catalog_file.read(4), dtype='>i4')[0]
-                for catalog_id in range(number_simulations_in_set):
-                    version = numpy.frombuffer(catalog_file.read(2), dtype='>i2')[0]
-                    dtype = cls._get_header_dtype(version)
-                    header_bytes = dtype.itemsize
-                    header = numpy.frombuffer(catalog_file.read(header_bytes), dtype=dtype)
-                    catalog_size = header['catalog_size'][0]
-                    catalog_dtype = cls._get_catalog_dtype(version)
-                    event_bytes = catalog_dtype.itemsize
-                    catalog = numpy.frombuffer(
-                        catalog_file.read(event_bytes*catalog_size),
-                        dtype=catalog_dtype,
-                        count=catalog_size
-                    )
-                    u3_catalog = cls(filename=filename, data=catalog, catalog_id=catalog_id, **kwargs)
-                    u3_catalog.dtype = dtype
-                    yield u3_catalog
+            :class:`UCERF3CatalogSet` or generator of catalogs of type UCERF3Catalog
+        """
+        extension = get_file_extension(filename)
+        if extension == 'gz' and decompress:
+            filename = cls._decompress(filename)
+            extension = 'bin'
+        if extension == 'bin':
+            return UCERF3CatalogSet(filename, catalog_class=cls, cache_index=cache_index, **kwargs)
+        elif extension == 'gz':
+            return cls._load_compressed_catalogs(filename, **kwargs)
+        raise CSEPIOException(f"Unable to load UCERF3 catalogs from {filename}. Expected a .bin or .gz file.")
+
+    @classmethod
+    def _load_compressed_catalogs(cls, filename, **kwargs):
+        """ Reads catalogs from a compressed merged binary file by decompressing inline. """
+        with gzip.open(filename, 'rb') as catalog_file:
+            number_simulations_in_set = numpy.frombuffer(catalog_file.read(4), dtype='>i4')[0]
+            for catalog_id in range(number_simulations_in_set):
+                version = numpy.frombuffer(catalog_file.read(2), dtype='>i2')[0]
+                dtype = cls._get_header_dtype(version)
+                header_bytes = dtype.itemsize
+                header = numpy.frombuffer(catalog_file.read(header_bytes), dtype=dtype)
+                catalog_size = header['catalog_size'][0]
+                catalog_dtype = cls._get_catalog_dtype(version)
+                event_bytes = catalog_dtype.itemsize
+                catalog = numpy.frombuffer(
+                    catalog_file.read(event_bytes*catalog_size),
+                    dtype=catalog_dtype,
+                    count=catalog_size
+                )
+                u3_catalog = cls(filename=filename, data=catalog, catalog_id=catalog_id, **kwargs)
+                u3_catalog.dtype = dtype
+                yield u3_catalog
+
+    @staticmethod
+    def _decompress(filename):
+        """ Decompresses the file next to the original file, unless this was done after the file was last modified.
+
+        Returns:
+            filename of the decompressed file
+        """
+        out_fname = filename[:-len('.gz')]
+        if get_file_extension(out_fname) != 'bin':
+            out_fname = out_fname + '.bin'
+        if os.path.exists(out_fname) and os.path.getmtime(out_fname) >= os.path.getmtime(filename):
+            return out_fname
+        # write to temporary file first, so that other processes never see a partially decompressed file
+        tmp_fname = f'{out_fname}.{os.getpid()}.tmp'
+        with gzip.open(filename, 'rb') as infile, open(tmp_fname, 'wb') as outfile:
+            shutil.copyfileobj(infile, outfile)
+        os.replace(tmp_fname, out_fname)
+        return out_fname
 
     @classmethod
     def load_catalog(cls, filename, loader=None, **kwargs):
@@ -1143,20 +1220,33 @@ class UCERF3Catalog(AbstractBaseCatalog):
         new_class.dtype = dtype
         return new_class
 
-    def get_csep_format(self):
-        n = len(self.catalog)
-        # allocate array for csep catalog
-        csep_catalog = numpy.zeros(n, dtype=CSEPCatalog.dtype)
-        for i, event in enumerate(self.catalog):
-            csep_catalog[i] = (i,
-                               event['origin_time'],
-                               event['latitude'],
-                               event['longitude'],
-                               event['depth'],
-                               event['magnitude'])
-        return CSEPCatalog(data=csep_catalog, catalog_id=self.catalog_id, filename=self.filename, format='csep',
-                           name=self.name, region=self.region, compute_stats=self.compute_stats, filters=self.filters,
-                           metadata=self.metadata, date_accessed=self.date_accessed)
+    def get_csep_format(self, copy=True):
+        """ Returns the catalog in CSEP format.
+
+        The event columns are copied at once into the native byte order of :attr:`CSEPCatalog.dtype` and the event ids
+        are the index of each event. If copy is False, the events are not copied. Instead, this returns a
+        :class:`CSEPBinaryCatalog` with a view of the origin_time, latitude, longitude, depth and magnitude columns of
+        this catalog, which keep the big-endian byte order of the UCERF3 format.
+
+        Args:
+            copy (bool): if false, returns catalog with a view of the events instead of a copy
+
+        Returns:
+            :class:`CSEPCatalog` or :class:`CSEPBinaryCatalog` if copy is False
+        """
+        if copy:
+            csep_catalog = numpy.empty(self.event_count, dtype=CSEPCatalog.dtype)
+            csep_catalog['id'] = numpy.arange(self.event_count)
+            for name in CSEPBinaryCatalog.dtype.names:
+                csep_catalog[name] = self.catalog[name]
+            catalog_class = CSEPCatalog
+        else:
+            # multi-field index returns a view of the events
+            csep_catalog = self.catalog[list(CSEPBinaryCatalog.dtype.names)]
+            catalog_class = CSEPBinaryCatalog
+        return catalog_class(data=csep_catalog, catalog_id=self.catalog_id, filename=self.filename, format='csep',
+                             name=self.name, region=self.region, compute_stats=self.compute_stats,
+                             filters=self.filters, metadata=self.metadata, date_accessed=self.date_accessed)
 
     @staticmethod
     def _get_catalog_dtype(version):
@@ -1227,6 +1317,439 @@ class UCERF3Catalog(AbstractBaseCatalog):
             raise ValueError("unknown catalog version, cannot parse catalog header.")
         return dtype
 
+
+class CSEPBinaryCatalog(AbstractBaseCatalog):
+    """
+    Catalog stored in the pyCSEP binary format for stochastic event sets.
+
+    The binary format stores all events of a stochastic event set as packed little-endian records containing the
+    origin_time, latitude, longitude, depth and magnitude of each event. Events are ordered by catalog_id and an offsets
+    array indexed by catalog_id points to the first event of each catalog. File layout:
+
+        header (header_dtype) | events (dtype) x n_events | offsets ('<i8') x (n_cat + 1)
+
+    The events and offsets are opened using numpy.memmap, so catalogs loaded from the file are views into the file and
+    are not read until they are accessed.
+
+    :var header_dtype: numpy.dtype description of the file header
+    :var dtype: numpy.dtype description of the event records
+    """
+    dtype = numpy.dtype([('origin_time', '<i8'),
+                         ('latitude', '<f8'),
+                         ('longitude', '<f8'),
+                         ('depth', '<f8'),
+                         ('magnitude', '<f8')])
+
+    header_dtype = numpy.dtype([('magic', 'S8'),
+                                ('version', '<i8'),
+                                ('n_cat', '<i8'),
+                                ('n_events', '<i8')])
+
+    magic = b'CSEPBIN'
+    version = 1
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+    @classmethod
+    def load_catalogs(cls, filename, **kwargs):
+        """ Loads catalogs stored in the pyCSEP binary format.
+
+        Catalogs are not loaded into memory. Instead, this returns a sequence of catalogs that supports len(), indexing
+        by catalog_id and slicing. Each catalog is a zero-copy view into the memory-mapped file.
+
+        Args:
+            filename (str): filename of binary stochastic event set
+            **kwargs (dict): passed to class constructor
+
+        Returns:
+            :class:`csep.core.catalogs.CSEPBinaryCatalogSet`
+        """
+        return CSEPBinaryCatalogSet(filename, catalog_class=cls, **kwargs)
+
+    @classmethod
+    def write_catalogs(cls, filename, catalogs):
+        """ Writes a collection of catalogs into the pyCSEP binary format.
+
+        This works for any catalog implementing the accessors of :class:`AbstractBaseCatalog`, so it can be used to
+        convert stochastic event sets stored in other formats. The catalogs are processed one at a time, e.g.,
+
+            >>> CSEPBinaryCatalog.write_catalogs('forecast.bin', CSEPCatalog.load_ascii_catalogs('forecast.csv'))
+            >>> CSEPBinaryCatalog.write_catalogs('forecast.bin', UCERF3Catalog.load_catalogs('results_complete.bin'))
+
+        Catalogs are assigned consecutive catalog_ids in the order they are provided. Event ids are not stored.
+
+        Args:
+            filename (str): output filename
+            catalogs (iterable): iterable of :class:`AbstractBaseCatalog`, e.g., a :class:`CatalogForecast`
+
+        Returns:
+            (int): number of catalogs written to file
+        """
+        offsets = [0]
+        with open(filename, 'wb') as outfile:
+            # header is written again once we know the number of catalogs and events
+            outfile.write(numpy.zeros(1, dtype=cls.header_dtype).tobytes())
+            for catalog in catalogs:
+                events = numpy.empty(catalog.event_count, dtype=cls.dtype)
+                if catalog.event_count > 0:
+                    events['origin_time'] = catalog.get_epoch_times()
+                    events['latitude'] = catalog.get_latitudes()
+                    events['longitude'] = catalog.get_longitudes()
+                    events['depth'] = catalog.get_depths()
+                    events['magnitude'] = catalog.get_magnitudes()
+                outfile.write(events.tobytes())
+                offsets.append(offsets[-1] + catalog.event_count)
+            outfile.write(numpy.array(offsets, dtype='<i8').tobytes())
+            header = numpy.array([(cls.magic, cls.version, len(offsets) - 1, offsets[-1])], dtype=cls.header_dtype)
+            outfile.seek(0)
+            outfile.write(header.tobytes())
+        return len(offsets) - 1
+
+    def get_event_ids(self):
+        """ Returns event ids, these are not stored in the binary format so they are the index of the event. """
+        return numpy.arange(self.event_count)
+
+    def get_csep_format(self):
+        csep_catalog = numpy.zeros(self.event_count, dtype=CSEPCatalog.dtype)
+        csep_catalog['id'] = self.get_event_ids()
+        for name in self.dtype.names:
+            csep_catalog[name] = self.catalog[name]
+        return CSEPCatalog(data=csep_catalog, catalog_id=self.catalog_id, filename=self.filename, format='csep',
+                           name=self.name, region=self.region, compute_stats=self.compute_stats, filters=self.filters,
+                           metadata=self.metadata, date_accessed=self.date_accessed)
+
+
+class _CatalogSet:
+    """ Sequence of catalogs stored in a file that are created when they are accessed.
+
+    Subclasses store the catalog_ids in the set as a range and implement :meth:`_get_catalog` to create the catalog
+    with that catalog_id and :meth:`_summarize` to compute the summaries of all catalogs in the file. Summaries are
+    stored in the dict _summaries, which is shared with the catalog sets created by slicing.
+
+    :var summary_dtype: numpy.dtype description of the catalog summaries
+    """
+
+    summary_dtype = numpy.dtype([('event_count', '<i8'),
+                                 ('min_longitude', '<f8'),
+                                 ('max_longitude', '<f8'),
+                                 ('min_latitude', '<f8'),
+                                 ('max_latitude', '<f8'),
+                                 ('min_magnitude', '<f8'),
+                                 ('max_magnitude', '<f8')])
+
+    def __len__(self):
+        return len(self.catalog_ids)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            catalog_set = copy.copy(self)
+            catalog_set.catalog_ids = self.catalog_ids[idx]
+            return catalog_set
+        return self._get_catalog(self.catalog_ids[idx])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def _get_catalog(self, catalog_id):
+        raise NotImplementedError('_get_catalog() not implemented.')
+
+    def _summarize(self):
+        raise NotImplementedError('_summarize() not implemented.')
+
+    def get_summaries(self):
+        """ Returns the number of events, bounding box and magnitude range of each catalog without creating the catalogs.
+
+        Summaries of all catalogs in the file are computed the first time this is called. The minimum and maximum values
+        are NaN for empty catalogs.
+
+        Returns:
+            numpy.ndarray: structured array with dtype :attr:`summary_dtype` and one record for each catalog in the set
+        """
+        if 'summaries' not in self._summaries:
+            self._summaries['summaries'] = self._summarize()
+        return self._summaries['summaries'][numpy.asarray(self.catalog_ids)]
+
+    def shard(self, index, num_shards):
+        """ Returns a contiguous part of the catalog set, e.g., to process the catalogs using multiple workers.
+
+        Each catalog belongs to exactly one of the shards and the sizes of the shards differ by at most one catalog.
+
+        Args:
+            index (int): index of the shard, between 0 and num_shards - 1
+            num_shards (int): number of shards
+
+        Returns:
+            catalog set with the catalogs in the shard
+        """
+        if not 0 <= index < num_shards:
+            raise ValueError(f"index must be between 0 and {num_shards - 1}.")
+        n_cat = len(self)
+        return self[index * n_cat // num_shards:(index + 1) * n_cat // num_shards]
+
+
+class CSEPBinaryCatalogSet(_CatalogSet):
+    """
+    Sequence of catalogs stored in a file using the pyCSEP binary format, see :class:`CSEPBinaryCatalog`.
+
+    Catalogs are created when they are accessed and their events are views into the memory-mapped file. Indexing with
+    an integer returns the catalog with that catalog_id and slicing returns a new catalog set without reading any
+    events, e.g.,
+
+        >>> catalog_set = CSEPBinaryCatalog.load_catalogs('forecast.bin')
+        >>> catalog = catalog_set[10]
+        >>> first_half = catalog_set[:len(catalog_set) // 2]
+
+    Catalog sets can be pickled to send them to other processes, which map the file again instead of copying events.
+
+    Args:
+        filename (str): filename of binary stochastic event set
+        catalog_class (type): class of the catalogs, should be :class:`CSEPBinaryCatalog` or a subclass
+        **kwargs (dict): passed to catalog constructor
+    """
+
+    def __init__(self, filename, catalog_class=CSEPBinaryCatalog, **kwargs):
+        self.filename = filename
+        self.catalog_class = catalog_class
+        self.kwargs = kwargs
+        n_cat = self._map_file()
+        self.catalog_ids = range(n_cat)
+        self._summaries = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # memory maps are not pickled, the file is mapped again when the catalog set is unpickled
+        del state['events']
+        del state['offsets']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._map_file()
+
+    def _map_file(self):
+        """ Maps the events and catalog offsets of the file into memory and returns the number of catalogs """
+        filename = self.filename
+        catalog_class = self.catalog_class
+        header = numpy.fromfile(filename, dtype=catalog_class.header_dtype, count=1)
+        if len(header) == 0 or header['magic'][0] != catalog_class.magic:
+            raise CSEPIOException(f"{filename} is not a pyCSEP binary catalog file.")
+        if header['version'][0] > catalog_class.version:
+            raise CSEPIOException(f"Unable to read version {header['version'][0]} of pyCSEP binary catalog file.")
+        n_cat = int(header['n_cat'][0])
+        n_events = int(header['n_events'][0])
+        events_offset = catalog_class.header_dtype.itemsize
+        # plain ndarray views of the memory-mapped file avoid the overhead of numpy.memmap for every catalog
+        if n_events > 0:
+            self.events = numpy.memmap(filename, dtype=catalog_class.dtype, mode='r', offset=events_offset,
+                                       shape=(n_events,)).view(numpy.ndarray)
+        else:
+            # numpy.memmap raises for empty arrays
+            self.events = numpy.empty(0, dtype=catalog_class.dtype)
+        self.offsets = numpy.memmap(filename, dtype='<i8', mode='r',
+                                    offset=events_offset + n_events * catalog_class.dtype.itemsize,
+                                    shape=(n_cat + 1,)).view(numpy.ndarray)
+        return n_cat
+
+    def _get_catalog(self, catalog_id):
+        events = self.events[self.offsets[catalog_id]:self.offsets[catalog_id + 1]]
+        return self.catalog_class(filename=self.filename, data=events, catalog_id=catalog_id, **self.kwargs)
+
+    def _summarize(self):
+        events = self.events
+        return _summarize_events(events['longitude'], events['latitude'], events['magnitude'], self.offsets)
+
+    def get_event_counts(self):
+        """ Returns the number of events in each catalog without loading the catalogs """
+        return numpy.diff(self.offsets)[numpy.asarray(self.catalog_ids)]
+
+
+class UCERF3CatalogSet(_CatalogSet):
+    """
+    Sequence of catalogs stored in the merged binary file format of UCERF3, see :meth:`UCERF3Catalog.load_catalogs`.
+
+    The headers of the catalogs are scanned once to build an index with the offset, size and version of each catalog.
+    If cache_index is true, the index is cached next to the file using the suffix :attr:`index_suffix` and it is
+    rebuilt if the file changes.
+    Catalogs are created when they are accessed and their events are views into the memory-mapped file, so catalogs can
+    be accessed in any order without reading the catalogs before them, e.g.,
+
+        >>> catalog_set = UCERF3Catalog.load_catalogs('results_complete.bin')
+        >>> catalog = catalog_set[90000]
+        >>> shard = catalog_set.shard(worker_id, num_workers)
+
+    Catalog sets can be pickled to send them to other processes, which open the file again instead of copying events.
+
+    Args:
+        filename (str): filename of merged binary stochastic event set
+        catalog_class (type): class of the catalogs, should be :class:`UCERF3Catalog` or a subclass
+        cache_index (bool): if true, writes the index next to the file. the cached index is read if it exists
+        **kwargs (dict): passed to catalog constructor
+    """
+
+    index_suffix = '.index.npz'
+
+    def __init__(self, filename, catalog_class=UCERF3Catalog, cache_index=False, **kwargs):
+        self.filename = filename
+        self.catalog_class = catalog_class
+        self.kwargs = kwargs
+        self.cache_index = cache_index
+        self._buffer = None
+        index = self._read_index() if cache_index else None
+        if index is None:
+            index = self._build_index()
+            if cache_index:
+                self._write_index(index)
+        self.offsets = index['offsets']
+        self.sizes = index['sizes']
+        self.versions = index['versions']
+        self.catalog_ids = range(len(self.offsets))
+        self._summaries = {}
+        if 'summaries' in index:
+            self._summaries['summaries'] = index['summaries']
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # memory maps cannot be pickled, the file is mapped again when a catalog is accessed
+        state['_buffer'] = None
+        return state
+
+    @property
+    def buffer(self):
+        """ Read-only memory map of the file """
+        if self._buffer is None:
+            with open(self.filename, 'rb') as f:
+                self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._buffer
+
+    def _get_catalog(self, catalog_id):
+        catalog_dtype = self.catalog_class._get_catalog_dtype(self.versions[catalog_id])
+        events = numpy.frombuffer(self.buffer, dtype=catalog_dtype, count=self.sizes[catalog_id],
+                                  offset=self.offsets[catalog_id])
+        catalog = self.catalog_class(filename=self.filename, data=events, catalog_id=catalog_id, **self.kwargs)
+        catalog.dtype = catalog_dtype
+        return catalog
+
+    def get_event_counts(self):
+        """ Returns the number of events in each catalog without loading the catalogs """
+        return self.sizes[numpy.asarray(self.catalog_ids)]
+
+    def _summarize(self, chunk_size=10000):
+        """ Summarizes the catalogs in chunks of catalogs, and stores the summaries with the cached index. """
+        n_cat = len(self.offsets)
+        summaries = numpy.empty(n_cat, dtype=self.summary_dtype)
+        for start in range(0, n_cat, chunk_size):
+            end = min(start + chunk_size, n_cat)
+            # catalogs are separated by headers, so the columns are collected from each catalog
+            events = [numpy.frombuffer(self.buffer, dtype=self.catalog_class._get_catalog_dtype(self.versions[i]),
+                                       count=self.sizes[i], offset=self.offsets[i]) for i in range(start, end)]
+            offsets = numpy.zeros(end - start + 1, dtype=numpy.int64)
+            numpy.cumsum(self.sizes[start:end], out=offsets[1:])
+            lons, lats, mags = [numpy.concatenate([e[name] for e in events]) if events else numpy.empty(0)
+                                for name in ('longitude', 'latitude', 'magnitude')]
+            summaries[start:end] = _summarize_events(lons, lats, mags, offsets)
+        if self.cache_index:
+            self._write_index({'offsets': self.offsets, 'sizes': self.sizes, 'versions': self.versions,
+                               'summaries': summaries})
+        return summaries
+
+    def _build_index(self):
+        """ Scans the headers of all catalogs in the file.
+
+        Returns:
+            dict with offsets of the first event, number of events and file version of each catalog
+        """
+        file_size = os.path.getsize(self.filename)
+        if file_size < 4:
+            raise CSEPIOException(f"{self.filename} is not a merged UCERF3 binary file.")
+        buffer = self.buffer
+        n_cat = struct.unpack_from('>i', buffer, 0)[0]
+        offsets = numpy.empty(n_cat, dtype=numpy.int64)
+        sizes = numpy.empty(n_cat, dtype=numpy.int64)
+        versions = numpy.empty(n_cat, dtype=numpy.int16)
+        # byte offsets of the catalog size in the header and the size of each event for each version
+        layouts = {}
+        pos = 4
+        for catalog_id in range(n_cat):
+            if pos + 2 > file_size:
+                raise CSEPIOException(f"{self.filename} is truncated, unable to read catalog {catalog_id}.")
+            version = struct.unpack_from('>h', buffer, pos)[0]
+            if version not in layouts:
+                header_dtype = self.catalog_class._get_header_dtype(version)
+                layouts[version] = (header_dtype.fields['catalog_size'][1], header_dtype.itemsize,
+                                    self.catalog_class._get_catalog_dtype(version).itemsize)
+            size_offset, header_bytes, event_bytes = layouts[version]
+            pos += 2
+            if pos + header_bytes > file_size:
+                raise CSEPIOException(f"{self.filename} is truncated, unable to read catalog {catalog_id}.")
+            size = struct.unpack_from('>i', buffer, pos + size_offset)[0]
+            pos += header_bytes
+            offsets[catalog_id] = pos
+            sizes[catalog_id] = size
+            versions[catalog_id] = version
+            pos += size * event_bytes
+        if pos > file_size:
+            raise CSEPIOException(f"{self.filename} is truncated, unable to read catalog {n_cat - 1}.")
+        return {'offsets': offsets, 'sizes': sizes, 'versions': versions}
+
+    def _file_signature(self):
+        stat = os.stat(self.filename)
+        return numpy.array([stat.st_size, stat.st_mtime_ns], dtype=numpy.int64)
+
+    def _read_index(self):
+        """ Returns the cached index, or None if there is no valid index for the file """
+        try:
+            with numpy.load(self.filename + self.index_suffix) as index:
+                if not numpy.array_equal(index['signature'], self._file_signature()):
+                    return None
+                return {name: index[name] for name in ('offsets', 'sizes', 'versions', 'summaries') if name in index}
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def _write_index(self, index):
+        """ Writes the index next to the file, a warning is issued if the index cannot be written """
+        index_fname = self.filename + self.index_suffix
+        # write to temporary file first, so that other processes never read a partially written index
+        tmp_fname = f'{index_fname}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_fname, 'wb') as f:
+                numpy.savez(f, signature=self._file_signature(), **index)
+            os.replace(tmp_fname, index_fname)
+        except OSError as e:
+            # the index is rebuilt the next time the file is opened
+            if os.path.exists(tmp_fname):
+                os.remove(tmp_fname)
+            warnings.warn(f"Unable to write catalog index to {index_fname}: {e}", RuntimeWarning)
+
+
+def _summarize_events(lons, lats, mags, offsets):
+    """ Returns summaries of catalogs stored in columnar form, see :meth:`_CatalogSet.get_summaries`.
+
+    Args:
+        lons, lats, mags (numpy.ndarray): columns with the events of all catalogs
+        offsets (numpy.ndarray): offsets of the first event of each catalog with length n_cat + 1 and offsets[0] == 0
+
+    Returns:
+        numpy.ndarray: structured array with dtype :attr:`_CatalogSet.summary_dtype`
+    """
+    offsets = numpy.asarray(offsets)
+    counts = numpy.diff(offsets)
+    summaries = numpy.zeros(len(counts), dtype=_CatalogSet.summary_dtype)
+    summaries['event_count'] = counts
+    # reductions between the first events of consecutive non-empty catalogs only include events of the first catalog
+    non_empty = counts > 0
+    starts = offsets[:-1][non_empty]
+    for name, values in (('longitude', lons), ('latitude', lats), ('magnitude', mags)):
+        values = numpy.asarray(values)[:offsets[-1]]
+        for stat, reduce in (('min', numpy.minimum), ('max', numpy.maximum)):
+            column = summaries[f'{stat}_{name}']
+            column[:] = numpy.nan
+            if len(starts) > 0:
+                column[non_empty] = reduce.reduceat(values, starts)
+    return summaries
+
+
 # helps to parse time-strings
 def _none_or_datetime(value):
     if isinstance(value, datetime.datetime):
@@ -1235,3 +1758,48 @@ def _none_or_datetime(value):
         format = parse_string_format(value)
         value = strptime_to_utc_datetime(value, format=format)
     return value
+
+
+def _mct_mask(times, magnitudes, m_main, event_epoch, mc=2.5, offsets=None):
+    """ Returns boolean mask of the events retained by the time-dependent magnitude of completeness.
+
+    Events are removed if they occur after the mainshock and before the critical time, where the time-dependent
+    magnitude of completeness falls below mc, and their magnitude is less than the completeness at their origin time.
+    Catalogs are assumed to be sorted in time, so all events following the first event after the critical time are
+    retained in each catalog defined by offsets.
+
+    Args:
+        times (numpy.ndarray): epoch times in millis
+        magnitudes (numpy.ndarray): event magnitudes
+        m_main (float): mainshock magnitude
+        event_epoch: epoch time in millis of event
+        mc (float): mag_completeness
+        offsets (numpy.ndarray): offsets of the first event of each catalog, if None all events belong to one catalog
+
+    Returns:
+        numpy.ndarray: boolean mask of retained events
+    """
+    times = numpy.asarray(times)
+    # compute critical time for efficiency, catalogs are stored stored by milliseconds
+    t_crit_days = 10 ** -((mc - m_main + 4.5) / 0.75)
+    t_crit_epoch = days_to_millis(t_crit_days) + event_epoch
+    after_crit = times > t_crit_epoch
+    if offsets is None:
+        checked = ~numpy.logical_or.accumulate(after_crit)
+    else:
+        # number of events after the critical time up to each event, counted from the start of its catalog
+        n_after = numpy.zeros(len(times) + 1, dtype=numpy.int64)
+        numpy.cumsum(after_crit, out=n_after[1:])
+        catalog_start = numpy.repeat(n_after[offsets[:-1]], numpy.diff(offsets))
+        checked = n_after[1:] == catalog_start
+    candidates = numpy.flatnonzero(checked & (times >= event_epoch))
+    mask = numpy.ones(len(times), dtype=bool)
+    if len(candidates) == 0:
+        return mask
+    time_from_mshock_in_days = millis_to_days(times[candidates] - event_epoch)
+    # events at the time of the mainshock are always below completeness
+    with numpy.errstate(divide='ignore'):
+        mct = m_main - 4.5 - 0.75 * numpy.log10(time_from_mshock_in_days)
+    # ignore events with mw < mct
+    mask[candidates] = ~(numpy.asarray(magnitudes)[candidates] < mct)
+    return mask
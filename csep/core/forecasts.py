@@ -1,21 +1,94 @@
+import collections
+import copy
+import hashlib
 import itertools
+import json
+import multiprocessing
 import time
 import os
 import datetime
 
 # third-party imports
 import numpy
+import scipy.sparse
 
 from csep.utils.log import LoggingMixin
-from csep.core.regions import CartesianGrid2D, create_space_magnitude_region
-from csep.models import Polygon
+from csep.core.regions import CartesianGrid2D, create_space_magnitude_region, _bin_spatial_magnitude_counts
 from csep.utils.calc import bin1d_vec
 from csep.utils.time_utils import decimal_year, datetime_to_utc_epoch
-from csep.core.catalogs import AbstractBaseCatalog
+from csep.core.catalogs import AbstractBaseCatalog, CatalogFilter, _summarize_events
 from csep.utils.constants import SECONDS_PER_ASTRONOMICAL_YEAR
+from csep.utils.file import ArrayCache
 from csep.utils.plots import plot_spatial_dataset
 
 
+class ScaledDataView:
+    """ Read-only view of gridded data multiplied by a scale factor.
+
+    The scale factor is applied lazily in reductions and indexed lookups, so these operations do not create a scaled copy
+    of the data. The scaled data are only created when the view is materialized or converted into a numpy.ndarray.
+
+    Args:
+        data (numpy.ndarray or scipy.sparse.csr_array): unscaled data
+        scale (float or numpy.ndarray): scale factor, arrays must broadcast with the data
+    """
+
+    def __init__(self, data, scale=1):
+        self._data = data
+        self.scale = scale
+
+    @property
+    def shape(self):
+        return self._data.shape
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return numpy.prod(self.shape)
+
+    @property
+    def is_sparse(self):
+        return scipy.sparse.issparse(self._data)
+
+    def sum(self, axis=None):
+        """ Sums the scaled data along axis, same as numpy.sum """
+        if numpy.ndim(self.scale) == 0:
+            out = self._data.sum(axis=axis)
+            return out if self.scale == 1 else out * self.scale
+        return numpy.sum(self.materialize(), axis=axis)
+
+    def __getitem__(self, idx):
+        values = self._data[idx]
+        if numpy.ndim(self.scale) == 0:
+            return values * self.scale
+        return values * numpy.broadcast_to(self.scale, self.shape)[idx]
+
+    def materialize(self, copy=True):
+        """ Returns the scaled data.
+
+        Args:
+            copy (bool): if false, returns the unscaled data without copying them if the scale factor is one. these
+                         must not be modified.
+
+        Returns:
+            numpy.ndarray or scipy.sparse.csr_array
+        """
+        if not copy and numpy.ndim(self.scale) == 0 and self.scale == 1:
+            return self._data
+        if self.is_sparse and numpy.ndim(self.scale) != 0:
+            return self._data.multiply(self.scale).tocsr()
+        return self._data * self.scale
+
+    def __array__(self, dtype=None, copy=None):
+        data = self.materialize(copy=bool(copy))
+        if self.is_sparse:
+            data = data.toarray()
+        return numpy.asarray(data, dtype=dtype)
+
+
 # idea: should this be a SpatialDataSet and the class below SpaceMagnitudeDataSet, bc of functions like
 #       get_latitudes(), and get_longitudes()
 #       or this class should be refactored as to use the underlying region
@@ -36,8 +109,13 @@ class GriddedDataSet(LoggingMixin):
     support multiple types of region including 2d and 3d cartesian meshes. The appropriate region must be provided. By default
     the magniutde is always treated as the 'fast' dimension of the numpy.array.
 
+    The data can also be stored as a sparse array from scipy.sparse, which saves memory for high-resolution forecasts
+    where most bins have zero rates. Sparse data are stored as :class:`scipy.sparse.csr_array`, and sums, rates and
+    the likelihood-based evaluations operate on the sparse array without converting it into a dense array.
+
     Attributes:
         data (numpy.ndarray): 2d numpy.ndarray containing the spatial and magnitude bins with magnitudes being the fast dimension.
+            This can also be a 2d sparse array from scipy.sparse.
         region: csep.utils.spatial.2DCartesianGrid class containing the mapping of the data points into the region.
         mags: list or numpy.ndarray class containing the lower (inclusive) magnitude values from the discretized
               magnitudes. The magnitude bins should be regularly spaced.
@@ -54,6 +132,10 @@ class GriddedDataSet(LoggingMixin):
         """
         super().__init__()
 
+        # sparse matrices are stored as sparse arrays, so indexing and reductions return numpy.ndarrays
+        if scipy.sparse.issparse(data):
+            data = scipy.sparse.csr_array(data)
+
         # note: do not access this member through _data, always use .data.
         self._data = data
         self.region = region
@@ -69,9 +151,21 @@ class GriddedDataSet(LoggingMixin):
 
         The dimensions of this array are (num_spatial_bins, num_magnitude_bins). The spatial bins can be indexed through
         a look up table as part of the region class. The magnitude bins used are stored as directly as an attribute of
-        class.
+        class. If the data are sparse, this returns a :class:`scipy.sparse.csr_array`.
+
+        This creates a scaled copy of the data. Use :attr:`data_view` to access the data without copying them.
         """
-        return self._data * self._scale
+        return self.data_view.materialize()
+
+    @property
+    def data_view(self):
+        """ Read-only :class:`ScaledDataView` of the data that applies the scale factor lazily """
+        return ScaledDataView(self._data, self._scale)
+
+    @property
+    def is_sparse(self):
+        """ True if the data are stored as a sparse array """
+        return scipy.sparse.issparse(self._data)
 
     @property
     def event_count(self):
@@ -80,7 +174,7 @@ class GriddedDataSet(LoggingMixin):
 
     def sum(self):
         """ Sums over all of the forecast data"""
-        return numpy.sum(self.data)
+        return self.data_view.sum()
 
     def spatial_counts(self, cartesian=False):
         """ Returns the counts (or rates) of earthquakes within each spatial bin.
@@ -93,7 +187,9 @@ class GriddedDataSet(LoggingMixin):
 
         """
         if cartesian:
-            return self.region.get_cartesian(self.data)
+            # sparse data are reduced to a dense spatial vector before they are put on the grid
+            counts = self.data_view.sum(axis=1) if self.data_view.ndim == 2 else self.data_view.materialize()
+            return self.region.get_cartesian(numpy.asarray(counts).ravel())
         else:
             return self.data
 
@@ -205,13 +301,13 @@ class MarkedGriddedDataSet(GriddedDataSet):
 
         """
         if cartesian:
-            return self.region.get_cartesian(numpy.sum(self.data, axis=1))
+            return self.region.get_cartesian(self.data_view.sum(axis=1))
         else:
-            return numpy.sum(self.data, axis=1)
+            return self.data_view.sum(axis=1)
 
     def magnitude_counts(self):
         """ Returns counts of events in magnitude bins """
-        return numpy.sum(self.data, axis=0)
+        return self.data_view.sum(axis=0)
 
     def get_magnitude_index(self, mags, tol=0.00001):
         """ Returns the indices into the magnitude bins of selected magnitudes
@@ -300,27 +396,22 @@ class GriddedForecast(MarkedGriddedDataSet):
         if not isinstance(target_catalog, AbstractBaseCatalog):
             raise TypeError("target_catalog must be csep.core.data.AbstractBaseCatalog class.")
 
-        if scale:
-            # first get copy so we dont contaminate the rates of the forecast, this can be quite large for global files
-            # if we run into memory problems, we can implement a sparse form of the forecast.
-            data = numpy.copy(self.data)
-            # straight-forward implementation, relies on correct start and end time
-            elapsed_days = (self.end_time - self.start_time).days
-            # scale the data down to days
-            data = data / elapsed_days
-        else:
-            # just pull reference to stored data
-            data = self.data
-
         # get longitudes and latitudes of target events
         lons = target_catalog.get_longitudes()
         lats = target_catalog.get_latitudes()
         mags = target_catalog.get_magnitudes()
 
         # this array does not keep track of any location anymore. however, it can be computed using the data again.
-        rates = self.get_rates(lons, lats, mags, data=data)
+        rates = self.get_rates(lons, lats, mags)
+        n_fore = self.sum()
+        if scale:
+            # straight-forward implementation, relies on correct start and end time
+            elapsed_days = (self.end_time - self.start_time).days
+            # scale the rates down to days, the forecast data are not copied
+            rates = rates / elapsed_days
+            n_fore = n_fore / elapsed_days
         # we return the sum of data, bc data might be scaled within this function
-        return rates, numpy.sum(data)
+        return rates, n_fore
 
     def get_rates(self, lons, lats, mags, data=None, ret_inds=False):
         """ Returns the rate associated with a longitude, latitude, and magnitude.
@@ -345,7 +436,7 @@ class GriddedForecast(MarkedGriddedDataSet):
         idm = self.get_magnitude_index(mags)
         # retrieve rates from internal data structure
         if data is None:
-            rates = self.data[idx,idm]
+            rates = self.data_view[idx,idm]
         else:
             rates = data[idx,idm]
         if ret_inds:
@@ -377,7 +468,7 @@ class GriddedForecast(MarkedGriddedDataSet):
         return cls(data=data, region=region, magnitudes=magnitudes, **kwargs)
 
     @classmethod
-    def load_ascii(cls, ascii_fname, start_date=None, end_date=None, name=None, swap_latlon=False):
+    def load_ascii(cls, ascii_fname, start_date=None, end_date=None, name=None, swap_latlon=False, sparse=False):
         """ Reads Forecast file from CSEP1 ascii format.
 
         The ascii format from CSEP1 testing centers. The ASCII format does not contain headers. The format is listed here:
@@ -392,35 +483,37 @@ class GriddedForecast(MarkedGriddedDataSet):
         Args:
             ascii_fname: file name of csep forecast in .dat format
             swap_latlon (bool): if true, read forecast spatial cells as lat_0, lat_1, lon_0, lon_1
+            sparse (bool): if true, store the rates as a sparse array
+
+        Raises:
+            ValueError: if the rows are not grouped by spatial cell with the same magnitude bins for every cell
         """
-        # Load data
-        data = numpy.loadtxt(ascii_fname)
-        # this is very ugly, but since unique returns a sorted list, we want to get the index, sort that and then return
-        # from the original array. same for magnitudes below.
-        all_polys = data[:, :4]
-        all_poly_mask = data[:, -1]
-        sorted_idx = numpy.sort(numpy.unique(all_polys, return_index=True, axis=0)[1], kind='stable')
-        unique_poly = all_polys[sorted_idx]
-        # gives the flag for a spatial cell in the order it was presented in the file
-        poly_mask = all_poly_mask[sorted_idx]
-        # create magnitudes bins using Mag_0, ignoring Mag_1 bc they are regular until last bin. we dont want binary search for this
-        all_mws = data[:, -4]
-        sorted_idx = numpy.sort(numpy.unique(all_mws, return_index=True)[1], kind='stable')
-        mws = all_mws[sorted_idx]
-        # csep1 stores the lat lons as min values and not (x,y) tuples
+        # the bounds of the first cell give the grid spacing
+        first = numpy.loadtxt(ascii_fname, max_rows=1, ndmin=1)
+        dh = float(first[3] - first[2])
+        # only the cell origins, magnitude bins, rates and flags are needed. lon0 and lat0 are swapped if swap_latlon
+        lon0, lat0, all_mws, rates, all_poly_mask = numpy.loadtxt(ascii_fname, usecols=(0, 2, 6, 8, 9), unpack=True, ndmin=2)
+        # copy so the rates do not keep the whole block of columns alive
+        rates = rates.copy()
+        # the file is row-ordered with magnitude bins fastest, so the first cell spans the rows before the origin changes
+        n_rows = len(rates)
+        new_cell = numpy.flatnonzero((lon0 != lon0[0]) | (lat0 != lat0[0]))
+        n_mag_bins = int(new_cell[0]) if len(new_cell) > 0 else n_rows
+        mws = all_mws[:n_mag_bins].copy()
+        if n_rows % n_mag_bins != 0 or not _is_cell_major(n_mag_bins, lon0, lat0, all_mws):
+            raise ValueError(f"{ascii_fname} is not ordered by spatial cell with {n_mag_bins} magnitude bins per cell.")
+        # unique cells are given by the first row of each cell, in the order they are presented in the file
         if swap_latlon:
-            bboxes = [((i[2], i[0]), (i[3], i[0]), (i[3], i[1]), (i[2], i[1])) for i in unique_poly]
+            origins = numpy.column_stack((lat0[::n_mag_bins], lon0[::n_mag_bins]))
         else:
-            bboxes = [((i[0], i[2]), (i[0], i[3]), (i[1], i[3]), (i[1], i[2])) for i in unique_poly]
-        # the spatial cells are arranged fast in latitude, so this only works for the specific csep1 file format
-        dh = float(unique_poly[0, 3] - unique_poly[0, 2])
+            origins = numpy.column_stack((lon0[::n_mag_bins], lat0[::n_mag_bins]))
+        poly_mask = all_poly_mask[::n_mag_bins].copy()
         # create CarteisanGrid of points
-        region = CartesianGrid2D([Polygon(bbox) for bbox in bboxes], dh, mask=poly_mask)
-        # get dims of 2d np.array
-        n_mag_bins = len(mws)
-        n_poly = region.num_nodes
+        region = CartesianGrid2D.from_origins(origins, dh=dh, name='cartesian2d', mask=poly_mask)
         # reshape rates into correct 2d format
-        rates = data[:,-2].reshape(n_poly, n_mag_bins)
+        rates = rates.reshape(region.num_nodes, n_mag_bins)
+        if sparse:
+            rates = scipy.sparse.csr_array(rates)
         # create / return class
         if name is None:
             name = os.path.basename(ascii_fname[:-4])
@@ -469,7 +562,7 @@ class CatalogForecast(LoggingMixin):
                  filter_spatial=False, filters=None, apply_mct=False,
                  region=None, expected_rates=None, start_time=None, end_time=None,
                  n_cat=None, event=None, loader=None, catalog_type='ascii',
-                 catalog_format='native', store=True, apply_filters=False):
+                 catalog_format='native', store=True, apply_filters=False, cache=None):
 
 
         """
@@ -499,6 +592,8 @@ class CatalogForecast(LoggingMixin):
                           with very large forecast files that cannot be stored in memory
             apply_filters (bool): if true, filters will be applied automatically to the catalogs as the forecast
                                   is iterated through
+            cache (str or :class:`csep.utils.file.ArrayCache`): directory or cache used to store the expected rates and
+                                  event counts of forecasts loaded from a file, see :meth:`get_expected_rates`
         """
 
         super().__init__()
@@ -524,6 +619,7 @@ class CatalogForecast(LoggingMixin):
 
         # these can be used to filter catalogs to a desired experiment region
         self.filters = filters or []
+        self._compiled_filters = None
 
         self.filter_spatial = filter_spatial
         self.apply_mct = apply_mct
@@ -547,6 +643,12 @@ class CatalogForecast(LoggingMixin):
         # stores catalogs in memory
         self.store = store
 
+        # optional on-disk cache of the expected rates and event counts
+        self.cache = ArrayCache(cache) if isinstance(cache, str) else cache
+
+        # true after filters were applied to the catalogs stored in memory
+        self._filters_applied = False
+
         # time horizon in years
         if self.start_time is not None and self.end_time is not None:
             self.time_horizon_years = (self.end_epoch - self.start_epoch) / SECONDS_PER_ASTRONOMICAL_YEAR / 1000
@@ -560,10 +662,50 @@ class CatalogForecast(LoggingMixin):
         # load catalogs if catalogs aren't provided, this might be a generator
         if not self.catalogs:
             self._load_catalogs()
+        elif self.n_cat is None and hasattr(self.catalogs, '__len__'):
+            self.n_cat = len(self.catalogs)
 
     def __iter__(self):
         return self
 
+    def __len__(self):
+        """ Returns the number of catalogs in the forecast.
+
+        This is known if the catalogs are stored in a sequence or the loader returns a sequence of catalogs, e.g.,
+        :meth:`CSEPBinaryCatalog.load_catalogs`. Otherwise, it is only known after iterating through the forecast once.
+        """
+        if hasattr(self.catalogs, '__len__'):
+            return len(self.catalogs)
+        if self.n_cat is None:
+            raise TypeError("Catalogs are loaded using a generator and the number of catalogs is not known until "
+                            "iterating through the forecast once.")
+        return self.n_cat
+
+    def __bool__(self):
+        # forecasts are true, even if the number of catalogs is not known yet
+        return True
+
+    def __getitem__(self, idx):
+        """ Returns catalog by index or a forecast with a subset of the catalogs for a slice.
+
+        This requires the catalogs to be stored in a sequence, which is the case after iterating through a forecast with
+        store=True, or if the loader returns a sequence of catalogs, e.g., :meth:`CSEPBinaryCatalog.load_catalogs`.
+        Filters are applied to the catalogs if apply_filters is true, same as when iterating through the forecast.
+        """
+        if not hasattr(self.catalogs, '__getitem__'):
+            raise TypeError("Catalogs are loaded using a generator and cannot be indexed. Iterate through the "
+                            "forecast with store=True or use a loader that supports random access.")
+        if isinstance(idx, slice):
+            forecast = copy.copy(self)
+            forecast.catalogs = self.catalogs[idx]
+            forecast.n_cat = len(forecast.catalogs)
+            forecast.expected_rates = None
+            forecast._catalogs = []
+            forecast._event_counts = []
+            forecast._idx = 0
+            return forecast
+        return self._filter_catalog(self.catalogs[idx])
+
     def __next__(self):
         """ Allows the class to be used in a for-loop. Handles the case where the catalogs are stored as a list or
         loaded in using a generator function. The latter solves the problem where memory is a concern or all of the
@@ -594,30 +736,64 @@ class CatalogForecast(LoggingMixin):
                     del self._catalogs
                     if self.apply_filters:
                         self.apply_filters = False
+                        self._filters_applied = True
 
                 self.n_cat = self._idx
                 self._idx = 0
                 raise StopIteration()
 
-        # apply filtering to catalogs, these can throw errors if not configured properly
+        catalog = self._filter_catalog(catalog)
+        self._event_counts.append(catalog.event_count)
+
+        if is_generator and self.store:
+            self._catalogs.append(catalog)
+
+        # return potentially filtered data
+        return catalog
+
+    def _filter_catalog(self, catalog):
+        """ Applies filtering to the catalog if apply_filters is true. """
+        # these can throw errors if not configured properly
         if self.apply_filters:
             if self.filters:
-                catalog = catalog.filter(self.filters)
+                catalog = catalog.filter(self.compiled_filters)
             if self.apply_mct:
                 catalog = catalog.apply_mct(self.event.magnitude, datetime_to_utc_epoch(self.event.time))
             if self.filter_spatial:
                 catalog = catalog.filter_spatial(self.region)
+        return catalog
 
-        self._event_counts.append(catalog.event_count)
+    @property
+    def is_indexed(self):
+        """ True if the catalogs are stored in a catalog set that summarizes catalogs without loading them, e.g.,
+        :class:`csep.core.catalogs.CSEPBinaryCatalogSet`.
 
-        if is_generator and self.store:
-            self._catalogs.append(catalog)
+        Summaries are computed from the catalogs as they are stored, so this is false if filters are applied to the
+        catalogs while iterating through the forecast.
+        """
+        filtered = self.apply_filters and (self.filters or self.apply_mct or self.filter_spatial)
+        return hasattr(self.catalogs, 'get_summaries') and not filtered
 
-        # return potentially filtered data
-        return catalog
+    @property
+    def compiled_filters(self):
+        """ Filters of the forecast compiled into a :class:`csep.core.catalogs.CatalogFilter`.
+
+        The statements are only parsed again if the filters of the forecast change, so iterating through the forecast
+        with apply_filters=True parses the statements once instead of once per catalog.
+        """
+        if not self.filters:
+            return None
+        # copy of the statements, so that changing the list of filters in place is detected
+        key = tuple(self.filters) if isinstance(self.filters, list) else self.filters
+        if self._compiled_filters is None or self._compiled_filters[0] != key:
+            self._compiled_filters = (key, CatalogFilter.compile(self.filters))
+        return self._compiled_filters[1]
 
     def _load_catalogs(self):
         self.catalogs = self.loader(format=self.catalog_format, filename=self.filename, region=self.region, name=self.name)
+        # loaders that return a sequence of catalogs know how many catalogs are in the forecast
+        if hasattr(self.catalogs, '__len__'):
+            self.n_cat = len(self.catalogs)
 
     @property
     def start_epoch(self):
@@ -659,6 +835,10 @@ class CatalogForecast(LoggingMixin):
             Returns:
                 (numpy.array): event counts with size equal of catalogs in forecast
         """
+        if self.is_indexed:
+            return self.catalogs.get_event_counts()
+        if len(self._event_counts) == 0 and self.expected_rates is None:
+            self._read_cache()
         if len(self._event_counts) == 0:
             # event counts is filled while iterating over the catalog
             t0 = time.time()
@@ -671,12 +851,51 @@ class CatalogForecast(LoggingMixin):
                 pass
         return numpy.array(self._event_counts)
 
-    def get_expected_rates(self, verbose=False):
+    def get_summaries(self, chunk_size=1000):
+        """ Returns the number of events, bounding box and magnitude range of each catalog in the forecast.
+
+        If the forecast is indexed, see :attr:`is_indexed`, the summaries are read from the catalog set without loading
+        the catalogs. Otherwise, the summaries are computed while iterating through the forecast, so filters are
+        applied to the catalogs if apply_filters is true.
+
+        Args:
+            chunk_size (int): number of catalogs summarized at a time when iterating through the forecast
+
+        Returns:
+            numpy.ndarray: structured array with dtype :attr:`csep.core.catalogs.CSEPBinaryCatalogSet.summary_dtype`
+        """
+        if self.is_indexed:
+            return self.catalogs.get_summaries()
+        summaries = [_summarize_catalogs([])]
+        chunk = []
+        for cat in self:
+            chunk.append(cat)
+            if len(chunk) == chunk_size:
+                summaries.append(_summarize_catalogs(chunk))
+                chunk = []
+        if chunk:
+            summaries.append(_summarize_catalogs(chunk))
+        return numpy.concatenate(summaries)
+
+    def get_expected_rates(self, verbose=False, n_workers=None, chunk_size=100):
         """ Compute the expected rates in space-magnitude bins
 
+        If n_workers > 1, catalogs are binned in a pool of worker processes in chunks of chunk_size catalogs and the
+        event counts from each chunk are added together. The results are identical to the serial computation.
+
+        Only forecasts stored in an indexed catalog set, e.g., forecasts loaded from a binary file or a UCERF3 file,
+        benefit from n_workers. For these, each worker loads, filters and bins its own shards of the catalog set. For
+        forecasts read through a generator, e.g., csep-ascii files, this process still reads and filters every catalog
+        and only the binning is done by the workers, so this is usually not faster than the serial computation.
+
+        If the forecast has a cache, the expected rates and event counts are read from the cache instead of iterating
+        through the forecast, if they were stored for the same forecast file, filters, magnitude of completeness and
+        space-magnitude region. Otherwise, they are stored in the cache after they are computed.
+
         Args:
-            catalogs_iterable (iterable): collection of catalogs, should be filtered outside the function
-            data (csep.core.AbstractBaseCatalog): observation data
+            verbose (bool): print status updates
+            n_workers (int): number of worker processes used to bin catalogs, if None catalogs are binned serially
+            chunk_size (int): number of catalogs binned by a worker at a time
 
         Return:
             :class:`csep.core.forecasts.GriddedForecast`
@@ -686,29 +905,146 @@ class CatalogForecast(LoggingMixin):
         # self.n_cat might be none here, if catalogs haven't been loaded and its not yet specified.
         if self.region is None or self.region.magnitudes is None:
             raise AttributeError("Forecast must have space-magnitude regions to compute expected rates.")
+        if self.expected_rates is None:
+            self._read_cache()
         # need to compute expected rates, else return.
         if self.expected_rates is None:
-            t0 = time.time()
-            data = numpy.empty([])
-            for i, cat in enumerate(self):
-                # compute spatial density from each data, force data region to use the forecast region
-                cat.region = self.region
-                gridded_counts = cat.spatial_magnitude_counts()
-                if i == 0:
-                    data = numpy.array(gridded_counts)
-                else:
-                    data += numpy.array(gridded_counts)
-                # output status
-                if verbose:
-                    tens_exp = numpy.floor(numpy.log10(i + 1))
-                    if (i + 1) % 10 ** tens_exp == 0:
-                        t1 = time.time()
-                        print(f'Processed {i + 1} catalogs in {t1 - t0:.3f} seconds', flush=True)
+            # event counts of the catalogs are appended while iterating through the forecast
+            n_counted = len(self._event_counts)
+            if n_workers is not None and n_workers > 1:
+                data = self._get_expected_counts_parallel(n_workers, chunk_size, verbose)
+            else:
+                data = self._get_expected_counts(verbose)
             # after we iterate through the catalogs, we know self.n_cat
             data = data / self.n_cat
             self.expected_rates = GriddedForecast(self.start_time, self.end_time, data=data, region=self.region,
                                                   magnitudes=self.magnitudes, name=self.name)
-            return self.expected_rates
+            self._write_cache(self._event_counts[n_counted:])
+        return self.expected_rates
+
+    def _get_expected_counts(self, verbose):
+        """ Returns the sum of spatial_magnitude_counts() over all catalogs """
+        t0 = time.time()
+        data = numpy.empty([])
+        for i, cat in enumerate(self):
+            # compute spatial density from each data, force data region to use the forecast region
+            cat.region = self.region
+            gridded_counts = cat.spatial_magnitude_counts()
+            if i == 0:
+                data = numpy.array(gridded_counts)
+            else:
+                data += numpy.array(gridded_counts)
+            # output status
+            if verbose:
+                tens_exp = numpy.floor(numpy.log10(i + 1))
+                if (i + 1) % 10 ** tens_exp == 0:
+                    t1 = time.time()
+                    print(f'Processed {i + 1} catalogs in {t1 - t0:.3f} seconds', flush=True)
+        return data
+
+    def _get_cache_key(self):
+        """ Returns key of the forecast in the cache, or None if the forecast is not cached
+
+        The key is a hash of the contents of the forecast file and of the settings that change the expected rates.
+        """
+        if self.cache is None or self.filename is None or self.region is None:
+            return None
+        apply_filters = self.apply_filters or self._filters_applied
+        filters = CatalogFilter.compile(self.filters).statements if apply_filters and self.filters else []
+        mct = None
+        if apply_filters and self.apply_mct:
+            mct = [self.event.magnitude, datetime_to_utc_epoch(self.event.time)]
+        settings = {'forecast': self.cache.file_hash(self.filename),
+                    'catalog_type': self.catalog_type,
+                    'filters': [filters] if isinstance(filters, str) else list(filters),
+                    'filter_spatial': bool(apply_filters and self.filter_spatial),
+                    'mct': mct,
+                    'region': self.region.fingerprint}
+        return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _read_cache(self):
+        """ Reads the expected rates and event counts from the cache, if they are stored for this forecast """
+        if self.region is None or self.region.magnitudes is None:
+            return
+        key = self._get_cache_key()
+        if key is None:
+            return
+        entry = self.cache.get(key)
+        if entry is None:
+            return
+        self.n_cat = int(entry['n_cat'])
+        if len(self._event_counts) == 0:
+            self._event_counts = entry['event_counts'].tolist()
+        self.expected_rates = GriddedForecast(self.start_time, self.end_time, data=entry['expected_rates'],
+                                              region=self.region, magnitudes=self.magnitudes, name=self.name)
+
+    def _write_cache(self, event_counts):
+        """ Stores the expected rates and event counts of the forecast in the cache """
+        key = self._get_cache_key()
+        if key is None:
+            return
+        self.cache.put(key, expected_rates=self.expected_rates.data, event_counts=numpy.array(event_counts),
+                       n_cat=numpy.array(self.n_cat))
+
+    def invalidate_cache(self):
+        """ Removes the expected rates and event counts of this forecast from the cache """
+        key = self._get_cache_key()
+        if key is not None:
+            self.cache.invalidate(key)
+
+    def _get_expected_counts_parallel(self, n_workers, chunk_size, verbose):
+        """ Returns the sum of spatial_magnitude_counts() over all catalogs computed using a pool of processes
+
+        If the catalogs are stored in a catalog set that can be sharded, e.g., :class:`csep.core.catalogs.CSEPBinaryCatalogSet`,
+        the workers load, filter and bin shards of chunk_size catalogs. Otherwise, the catalogs are read and filtered in
+        this process and their events are sent to the workers, so reading the forecast is not parallelized.
+        """
+        data = numpy.zeros((self.region.num_nodes, len(self.region.magnitudes)))
+        t0 = time.time()
+        n_processed = 0
+        if hasattr(self.catalogs, 'shard'):
+            num_shards = -(-len(self.catalogs) // chunk_size)
+            tasks = ((_expected_counts_shard_worker, (index, num_shards)) for index in range(num_shards))
+            # the workers iterate through the catalogs, so the catalogs are not stored on the forecast they receive
+            forecast = copy.copy(self)
+            forecast._event_counts = []
+            forecast.expected_rates = None
+            forecast.cache = None
+            initargs = (self.region, forecast)
+        else:
+            tasks = ((_expected_counts_worker, chunk) for chunk in self._iter_event_chunks(chunk_size))
+            initargs = (self.region,)
+        # limit the number of tasks waiting to be processed so generators are not read into memory at once
+        pending = collections.deque()
+        with multiprocessing.Pool(n_workers, initializer=_init_expected_counts_worker, initargs=initargs) as pool:
+            for worker, args in tasks:
+                pending.append(pool.apply_async(worker, args))
+                if len(pending) > 2 * n_workers:
+                    n_processed += self._reduce_expected_counts(data, pending.popleft(), n_processed, t0, verbose)
+            while pending:
+                n_processed += self._reduce_expected_counts(data, pending.popleft(), n_processed, t0, verbose)
+        return data
+
+    def _reduce_expected_counts(self, data, result, n_processed, t0, verbose):
+        n_cat, counts, event_counts = result.get()
+        data += counts
+        # event counts of catalogs loaded in the workers, these are returned in the order of the catalogs
+        if event_counts is not None:
+            self._event_counts.extend(event_counts)
+        if verbose:
+            print(f'Processed {n_processed + n_cat} catalogs in {time.time() - t0:.3f} seconds', flush=True)
+        return n_cat
+
+    def _iter_event_chunks(self, chunk_size):
+        """ Yields tuples of (n_cat, lons, lats, mags) with the events of chunk_size catalogs from the forecast """
+        chunk = []
+        for cat in self:
+            chunk.append(cat)
+            if len(chunk) == chunk_size:
+                yield _catalog_events(chunk)
+                chunk = []
+        if chunk:
+            yield _catalog_events(chunk)
 
     def plot(self, plot_args = None, verbose=True, **kwargs):
         plot_args = plot_args or {}
@@ -753,4 +1089,67 @@ class CatalogForecast(LoggingMixin):
         Returns:
               :class:`csep.core.forecasts.CatalogForecast
         """
-        raise NotImplementedError("load_ascii is not implemented!")
\ No newline at end of file
+        raise NotImplementedError("load_ascii is not implemented!")
+
+
+def _is_cell_major(n_mag_bins, lons, lats, mws):
+    """ Returns true if rows are grouped by spatial cell with the same magnitude bins repeated for every cell. """
+    n_cells = len(mws) // n_mag_bins
+    for col in (lons, lats):
+        col = col.reshape(n_cells, n_mag_bins)
+        if not numpy.all(col == col[:, :1]):
+            return False
+    return bool(numpy.all(mws.reshape(n_cells, n_mag_bins) == mws[:n_mag_bins]))
+
+
+def _catalog_events(catalogs):
+    """ Returns number of catalogs and concatenated longitudes, latitudes and magnitudes of their events """
+    return (len(catalogs),
+            numpy.concatenate([cat.get_longitudes() for cat in catalogs]),
+            numpy.concatenate([cat.get_latitudes() for cat in catalogs]),
+            numpy.concatenate([cat.get_magnitudes() for cat in catalogs]))
+
+
+def _summarize_catalogs(catalogs):
+    """ Returns the summaries of the catalogs, see :meth:`CatalogForecast.get_summaries` """
+    offsets = numpy.cumsum([0] + [cat.event_count for cat in catalogs])
+    if len(catalogs) == 0:
+        return _summarize_events([], [], [], offsets)
+    _, lons, lats, mags = _catalog_events(catalogs)
+    return _summarize_events(lons, lats, mags, offsets)
+
+
+# region and forecast used by worker processes in CatalogForecast.get_expected_rates, sent once when the worker starts
+_worker_region = None
+_worker_forecast = None
+
+
+def _init_expected_counts_worker(region, forecast=None):
+    global _worker_region, _worker_forecast
+    _worker_region = region
+    _worker_forecast = forecast
+
+
+def _expected_counts_worker(n_cat, lons, lats, mags, tol=0.00001):
+    """ Returns n_cat and the event counts in space-magnitude bins, same as summing spatial_magnitude_counts()
+
+    The event counts of the catalogs are None, because they are counted by the process reading the catalogs.
+    """
+    n_poly, n_mag = _worker_region.num_nodes, len(_worker_region.magnitudes)
+    if len(lons) == 0:
+        return n_cat, numpy.zeros((n_poly, n_mag)), None
+    spatial_idx = _worker_region.get_index_of(lons, lats)
+    mag_idx = bin1d_vec(mags, _worker_region.magnitudes, tol=tol, right_continuous=True).astype(numpy.int64)
+    if numpy.any(mag_idx == -1):
+        raise ValueError("at least one magnitude value outside of the valid region.")
+    return n_cat, _bin_spatial_magnitude_counts(spatial_idx, mag_idx, n_poly, n_mag), None
+
+
+def _expected_counts_shard_worker(index, num_shards):
+    """ Returns n_cat, the event counts in space-magnitude bins and the number of events of each catalog in a shard
+
+    The catalogs of the shard are loaded and filtered in the worker process.
+    """
+    catalogs = [_worker_forecast._filter_catalog(cat) for cat in _worker_forecast.catalogs.shard(index, num_shards)]
+    n_cat, counts, _ = _expected_counts_worker(*_catalog_events(catalogs))
+    return n_cat, counts, [cat.event_count for cat in catalogs]
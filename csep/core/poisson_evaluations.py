@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import multiprocessing
+
 import numpy
+import scipy.sparse
+import scipy.special
 import scipy.stats
 import scipy.spatial
 import warnings
@@ -170,7 +174,7 @@ def number_test(gridded_forecast, observed_catalog):
 
 def conditional_likelihood_test(gridded_forecast, observed_catalog,
                                 num_simulations=1000, seed=None,
-                                random_numbers=None, verbose=False):
+                                random_numbers=None, verbose=False, rng=None, n_workers=None):
     """Performs the conditional likelihood test on Gridded Forecast using an Observed Catalog.
 
     This test normalizes the forecast so the forecasted rate are consistent with the observations. This modification
@@ -186,6 +190,10 @@ def conditional_likelihood_test(gridded_forecast, observed_catalog,
         num_simulations (int): number of simulations used to compute the quantile score
         seed (int): used fore reproducibility, and testing
         random_numbers (numpy.ndarray): random numbers used to override the random number generation. injection point for testing.
+        rng (int, numpy.random.SeedSequence or numpy.random.Generator): seeds independent random streams for the
+            simulations, if given the results don't depend on n_workers. overrides seed.
+        n_workers (int): number of worker processes used to simulate catalogs, if None catalogs are simulated serially.
+            if given, random streams are spawned from seed, so results don't depend on the number of workers
 
     Returns:
         evaluation_result: csep.core.evaluations.EvaluationResult
@@ -200,11 +208,13 @@ def conditional_likelihood_test(gridded_forecast, observed_catalog,
     gridded_catalog_data = observed_catalog.spatial_magnitude_counts()
 
     # simply call likelihood test on catalog data and forecast
-    qs, obs_ll, simulated_ll = _poisson_likelihood_test(gridded_forecast.data,
+    qs, obs_ll, simulated_ll = _poisson_likelihood_test(gridded_forecast.data_view.materialize(copy=False),
                                                         gridded_catalog_data,
                                                         num_simulations=num_simulations,
                                                         seed=seed,
                                                         random_numbers=random_numbers,
+                                                        rng=rng,
+                                                        n_workers=n_workers,
                                                         use_observed_counts=True,
                                                         verbose=verbose,
                                                         normalize_likelihood=False)
@@ -292,7 +302,7 @@ def binary_spatial_likelihood(forecast, catalog):
 
 def magnitude_test(gridded_forecast, observed_catalog, num_simulations=1000,
                    seed=None, random_numbers=None,
-                   verbose=False):
+                   verbose=False, rng=None, n_workers=None):
     """
     Performs the Magnitude Test on a Gridded Forecast using an observed catalog.
 
@@ -306,6 +316,10 @@ def magnitude_test(gridded_forecast, observed_catalog, num_simulations=1000,
         num_simulations (int): number of simulations used to compute the quantile score
         seed (int): used fore reproducibility, and testing
         random_numbers (numpy.ndarray): random numbers used to override the random number generation. injection point for testing.
+        rng (int, numpy.random.SeedSequence or numpy.random.Generator): seeds independent random streams for the
+            simulations, if given the results don't depend on n_workers. overrides seed.
+        n_workers (int): number of worker processes used to simulate catalogs, if None catalogs are simulated serially.
+            if given, random streams are spawned from seed, so results don't depend on the number of workers
 
     Returns:
         evaluation_result: csep.core.evaluations.EvaluationResult
@@ -321,6 +335,8 @@ def magnitude_test(gridded_forecast, observed_catalog, num_simulations=1000,
         num_simulations=num_simulations,
         seed=seed,
         random_numbers=random_numbers,
+        rng=rng,
+        n_workers=n_workers,
         use_observed_counts=True,
         verbose=verbose,
         normalize_likelihood=True)
@@ -341,7 +357,7 @@ def magnitude_test(gridded_forecast, observed_catalog, num_simulations=1000,
 
 def spatial_test(gridded_forecast, observed_catalog, num_simulations=1000,
                  seed=None, random_numbers=None,
-                 verbose=False):
+                 verbose=False, rng=None, n_workers=None):
     """
     Performs the Spatial Test on the Forecast using the Observed Catalogs.
 
@@ -355,6 +371,10 @@ def spatial_test(gridded_forecast, observed_catalog, num_simulations=1000,
         num_simulations (int): number of simulations used to compute the quantile score
         seed (int): used fore reproducibility, and testing
         random_numbers (numpy.ndarray): random numbers used to override the random number generation. injection point for testing.
+        rng (int, numpy.random.SeedSequence or numpy.random.Generator): seeds independent random streams for the
+            simulations, if given the results don't depend on n_workers. overrides seed.
+        n_workers (int): number of worker processes used to simulate catalogs, if None catalogs are simulated serially.
+            if given, random streams are spawned from seed, so results don't depend on the number of workers
 
     Returns:
         evaluation_result: csep.core.evaluations.EvaluationResult
@@ -368,6 +388,8 @@ def spatial_test(gridded_forecast, observed_catalog, num_simulations=1000,
         num_simulations=num_simulations,
         seed=seed,
         random_numbers=random_numbers,
+        rng=rng,
+        n_workers=n_workers,
         use_observed_counts=True,
         verbose=verbose,
         normalize_likelihood=True)
@@ -390,7 +412,7 @@ def spatial_test(gridded_forecast, observed_catalog, num_simulations=1000,
 
 def likelihood_test(gridded_forecast, observed_catalog, num_simulations=1000,
                     seed=None, random_numbers=None,
-                    verbose=False):
+                    verbose=False, rng=None, n_workers=None):
     """
     Performs the likelihood test on Gridded Forecast using an Observed Catalog.
 
@@ -405,6 +427,10 @@ def likelihood_test(gridded_forecast, observed_catalog, num_simulations=1000,
         seed (int): used fore reproducibility, and testing
         random_numbers (numpy.ndarray): random numbers used to override the random number generation.
                                injection point for testing.
+        rng (int, numpy.random.SeedSequence or numpy.random.Generator): seeds independent random streams for the
+            simulations, if given the results don't depend on n_workers. overrides seed.
+        n_workers (int): number of worker processes used to simulate catalogs, if None catalogs are simulated serially.
+            if given, random streams are spawned from seed, so results don't depend on the number of workers
 
     Returns:
         evaluation_result: csep.core.evaluations.EvaluationResult
@@ -420,11 +446,13 @@ def likelihood_test(gridded_forecast, observed_catalog, num_simulations=1000,
     gridded_catalog_data = observed_catalog.spatial_magnitude_counts()
 
     # simply call likelihood test on catalog and forecast
-    qs, obs_ll, simulated_ll = _poisson_likelihood_test(gridded_forecast.data,
+    qs, obs_ll, simulated_ll = _poisson_likelihood_test(gridded_forecast.data_view.materialize(copy=False),
                                                         gridded_catalog_data,
                                                         num_simulations=num_simulations,
                                                         seed=seed,
                                                         random_numbers=random_numbers,
+                                                        rng=rng,
+                                                        n_workers=n_workers,
                                                         use_observed_counts=False,
                                                         verbose=verbose,
                                                         normalize_likelihood=False)
@@ -599,14 +627,186 @@ def _simulate_catalog(num_events, sampling_weights, sim_fore,
     return sim_fore
 
 
+def _joint_log_likelihoods(sim_idx, cell_idx, num_simulations, log_bin_expectations, expected_forecast_count):
+    """ Computes the joint log-likelihood of a block of simulated catalogs.
+
+    The simulated events are given as pairs of (simulation, bin) indices. The pairs are sorted to obtain the number of
+    events in each bin, so the terms of the joint log-likelihood are accumulated in the same order for every
+    simulation. This ensures that identical catalogs have identical log-likelihoods.
+
+    Args:
+        sim_idx (numpy.ndarray): index of the simulation of each event
+        cell_idx (numpy.ndarray): index of the bin of each event into the raveled forecast
+        num_simulations (int): number of simulations in the block
+        log_bin_expectations (numpy.ndarray): natural log of the raveled bin rates
+        expected_forecast_count (float): expected number of events from the forecast
+
+    Returns:
+        numpy.ndarray: joint log-likelihood of each simulation
+    """
+    n_bins = log_bin_expectations.shape[0]
+    keys, counts = numpy.unique(sim_idx.astype(numpy.int64) * n_bins + cell_idx, return_counts=True)
+    sims = keys // n_bins
+    # factorial(n) = loggamma(n+1)
+    sum_log_target_event_rates = numpy.bincount(sims, weights=log_bin_expectations[keys % n_bins] * counts,
+                                                minlength=num_simulations)
+    discrete_penalty_term = numpy.bincount(sims, weights=scipy.special.loggamma(counts + 1),
+                                           minlength=num_simulations)
+    return sum_log_target_event_rates - discrete_penalty_term - expected_forecast_count
+
+
+def _spawn_generators(rng, n):
+    """ Returns n independent random number generators derived from rng.
+
+    Args:
+        rng (int, numpy.random.SeedSequence or numpy.random.Generator): seeds the random streams, if None the streams
+            are seeded with fresh entropy from the operating system
+        n (int): number of generators
+
+    Returns:
+        list of numpy.random.Generator
+    """
+    if isinstance(rng, numpy.random.Generator):
+        return rng.spawn(n)
+    if not isinstance(rng, numpy.random.SeedSequence):
+        rng = numpy.random.SeedSequence(rng)
+    return [numpy.random.default_rng(child) for child in rng.spawn(n)]
+
+
+# arguments shared by all blocks of simulations, sent once when the worker starts
+_worker_args = None
+
+
+def _init_simulation_worker(args):
+    global _worker_args
+    _worker_args = args
+
+
+def _simulation_worker(task):
+    simulate_block, rng, num_simulations = task
+    return simulate_block(rng, num_simulations, *_worker_args)
+
+
+def _simulate_blocks(simulate_block, args, num_simulations, block_size, rng, n_workers=None, verbose=False):
+    """ Computes the test distribution of a simulation-based test in blocks of simulations.
+
+    Each block is simulated by calling simulate_block(generator, n, *args) and uses its own random stream spawned from
+    rng. The results only depend on rng and block_size, so they are the same whether the blocks are simulated in this
+    process or in a pool of n_workers processes.
+
+    Args:
+        simulate_block (callable): module-level function returning the statistic of n simulations
+        args (tuple): arguments passed to simulate_block, these are sent once to each worker process
+        num_simulations (int): total number of simulations
+        block_size (int): number of simulations in each block
+        rng (int, numpy.random.SeedSequence or numpy.random.Generator): seeds the random streams
+        n_workers (int): number of worker processes, if None the blocks are simulated serially
+        verbose (bool): if true, write progress of test to command line
+
+    Returns:
+        numpy.ndarray: statistic of each simulation
+    """
+    starts = numpy.arange(0, num_simulations, block_size)
+    block_sizes = numpy.diff(numpy.append(starts, num_simulations)).tolist()
+    tasks = zip([simulate_block] * len(block_sizes), _spawn_generators(rng, len(block_sizes)), block_sizes)
+
+    def collect(results):
+        simulated = [numpy.empty(0)]
+        n_simulated = 0
+        for block in results:
+            simulated.append(block)
+            n_simulated += len(block)
+            if verbose:
+                print(f'... {n_simulated} catalogs simulated.')
+        return numpy.concatenate(simulated)
+
+    if n_workers is not None and n_workers > 1:
+        with multiprocessing.Pool(n_workers, initializer=_init_simulation_worker, initargs=(args,)) as pool:
+            return collect(pool.imap(_simulation_worker, tasks))
+    return collect(simulate_block(block_rng, n, *args) for _, block_rng, n in tasks)
+
+
+def _simulate_poisson_log_likelihoods(rng, num_simulations, sampling_weights, log_bin_expectations,
+                                      expected_forecast_count, num_events=None, random_numbers=None):
+    """ Simulates catalogs from a gridded forecast and returns their joint log-likelihoods.
+
+    Args:
+        rng (numpy.random.Generator): random number generator, the legacy numpy.random module also works
+        num_simulations (int): number of catalogs to simulate
+        sampling_weights (numpy.ndarray): normalized cumulative sum of the raveled forecast
+        log_bin_expectations (numpy.ndarray): natural log of the raveled bin rates
+        expected_forecast_count (float): expected number of events from the forecast
+        num_events (int or numpy.ndarray): number of events in each catalog, if None these are drawn from a poisson
+            distribution with mean expected_forecast_count
+        random_numbers (numpy.ndarray): (num_simulations, num_events) array that overrides the random numbers. if
+            num_events is given, this can also be a 1d array with the random numbers of all catalogs
+
+    Returns:
+        numpy.ndarray: joint log-likelihood of each simulation
+    """
+    if random_numbers is not None:
+        if num_events is None:
+            num_events = numpy.full(num_simulations, random_numbers.shape[1])
+        num_events = numpy.broadcast_to(num_events, (num_simulations,))
+        random_numbers = random_numbers.ravel()
+    else:
+        if num_events is None:
+            num_events = rng.poisson(expected_forecast_count, size=num_simulations)
+        num_events = numpy.broadcast_to(num_events, (num_simulations,))
+        random_numbers = rng.random(numpy.sum(num_events))
+
+    # find insertion points using binary search inserting to satisfy a[i-1] <= v < a[i]
+    pnts = numpy.searchsorted(sampling_weights, random_numbers, side='right')
+    sim_idx = numpy.repeat(numpy.arange(num_simulations), num_events)
+
+    # compute joint log-likelihood from simulations by leveraging that only cells with target events contribute
+    return _joint_log_likelihoods(sim_idx, pnts, num_simulations, log_bin_expectations, expected_forecast_count)
+
+
+def _legacy_poisson_draws(num_simulations, expected_forecast_count):
+    """ Returns the number of events and the random numbers of catalogs drawn from the global numpy random state.
+
+    The number of events of each catalog is drawn right before its random numbers, as in previous releases that
+    simulated one catalog at a time, so that a fixed seed gives the same catalogs.
+    """
+    num_events = numpy.empty(num_simulations, dtype=numpy.int64)
+    random_numbers = []
+    for idx in range(num_simulations):
+        num_events[idx] = numpy.random.poisson(expected_forecast_count)
+        random_numbers.append(numpy.random.rand(num_events[idx]))
+    return num_events, numpy.concatenate(random_numbers) if random_numbers else numpy.empty(0)
+
+
+def _sparse_rates(forecast_data):
+    """ Returns the raveled index and the rate of the bins stored in a sparse forecast, ordered by the raveled index """
+    forecast_data = scipy.sparse.coo_array(forecast_data)
+    forecast_data.sum_duplicates()
+    bin_idx = numpy.ravel_multi_index((forecast_data.row, forecast_data.col), forecast_data.shape)
+    order = numpy.argsort(bin_idx, kind='stable')
+    return bin_idx[order], forecast_data.data[order]
+
+
 def _poisson_likelihood_test(forecast_data, observed_data,
                              num_simulations=1000, random_numbers=None,
                              seed=None, use_observed_counts=True, verbose=True,
-                             normalize_likelihood=False):
+                             normalize_likelihood=False, block_size=100, rng=None, n_workers=None):
     """
 	Computes the likelihood-test from CSEP using an efficient simulation based approach.
+
+	Catalogs are simulated in blocks of simulations. The events of all catalogs in a block are drawn at once and the
+	joint log-likelihoods are computed without storing the gridded catalogs, so memory is bounded by block_size and the
+	number of simulated events.
+
+	If rng is given, each block of simulations uses an independent random stream spawned from rng. The blocks can be
+	simulated in a pool of n_workers processes and a given rng yields the same results for any number of workers.
+	Otherwise, simulations are drawn from the global numpy random state, optionally seeded using seed, and the results
+	do not depend on block_size.
+
+	If forecast_data is a sparse array, events are only simulated in the stored bins and the forecast is not converted
+	into a dense array.
+
 	Args:
-	    forecast_data (numpy.ndarray): nd array where [:, -1] are the magnitude bins.
+	    forecast_data (numpy.ndarray): nd array where [:, -1] are the magnitude bins, or 2d sparse array.
 	    observed_data (numpy.ndarray): same format as observation.
 	    num_simulations: default number of simulations to use for likelihood based simulations
     	seed: used for reproducibility of the prng
@@ -614,82 +814,84 @@ def _poisson_likelihood_test(forecast_data, observed_data,
 	    use_observed_counts (bool): if true, will simulate catalogs using the observed events, if false will draw from poisson distribution
 	    verbose (bool): if true, write progress of test to command line
 	    normalize_likelihood (bool): if true, normalize likelihood. used by deafult for magnitude and spatial tests
+	    block_size (int): number of catalogs simulated at a time
+	    rng (int, numpy.random.SeedSequence or numpy.random.Generator): seeds independent random streams, overrides seed
+	    n_workers (int): number of worker processes used to simulate catalogs, if None catalogs are simulated serially.
+	        if given, random streams are spawned from seed, so results don't depend on the number of workers
 	"""
 
-    # set seed for the likelihood test
-    if seed is not None:
-        numpy.random.seed(seed)
+    # simulations operate on the stored bins of sparse forecasts, bin_idx maps these to the raveled forecast
+    if scipy.sparse.issparse(forecast_data):
+        bin_idx, rates = _sparse_rates(forecast_data)
+    else:
+        bin_idx, rates = None, forecast_data.ravel()
 
     # used to determine where simulated earthquake should be placed, by definition of cumsum these are sorted
-    sampling_weights = numpy.cumsum(forecast_data.ravel()) / numpy.sum(
-        forecast_data)
-
-    # data structures to store results
-    sim_fore = numpy.zeros(sampling_weights.shape)
-    simulated_ll = []
+    sampling_weights = numpy.cumsum(rates) / numpy.sum(rates)
 
     # properties of observations and forecasts
     n_obs = numpy.sum(observed_data)
-    n_fore = numpy.sum(forecast_data)
+    n_fore = numpy.sum(rates)
 
-    expected_forecast_count = numpy.sum(forecast_data)
-    log_bin_expectations = numpy.log(forecast_data.ravel())
+    expected_forecast_count = numpy.sum(rates)
+    log_bin_expectations = numpy.log(rates)
     # used for conditional-likelihood, magnitude, and spatial tests to normalize the rate-component of the forecasts
     if use_observed_counts and normalize_likelihood:
         scale = n_obs / n_fore
         expected_forecast_count = int(n_obs)
-        log_bin_expectations = numpy.log(forecast_data.ravel() * scale)
-
-    # gets the 1d indices to bins that contain target events, these indexes perform copies and not views into the array
-    target_idx = numpy.nonzero(observed_data.ravel())
-
-    # note for performance: these operations perform copies
-    observed_data_nonzero = observed_data.ravel()[target_idx]
-    target_event_forecast = log_bin_expectations[
-                                target_idx] * observed_data_nonzero
-
-    # main simulation step in this loop
-    for idx in range(num_simulations):
-        if use_observed_counts:
-            num_events_to_simulate = int(n_obs)
-        else:
-            num_events_to_simulate = int(
-                numpy.random.poisson(expected_forecast_count))
-
-        if random_numbers is None:
-            sim_fore = _simulate_catalog(num_events_to_simulate,
-                                         sampling_weights, sim_fore)
-        else:
-            sim_fore = _simulate_catalog(num_events_to_simulate,
-                                         sampling_weights, sim_fore,
-                                         random_numbers=random_numbers[idx, :])
-
-        # compute joint log-likelihood from simulation by leveraging that only cells with target events contribute to likelihood
-        sim_target_idx = numpy.nonzero(sim_fore)
-        sim_obs_nonzero = sim_fore[sim_target_idx]
-        sim_target_event_forecast = log_bin_expectations[
-                                        sim_target_idx] * sim_obs_nonzero
-
-        # compute joint log-likelihood
-        current_ll = poisson_joint_log_likelihood_ndarray(
-            sim_target_event_forecast, sim_obs_nonzero,
-            expected_forecast_count)
-
-        # append to list of simulated log-likelihoods
-        simulated_ll.append(current_ll)
-
-        # just be verbose
-        if verbose:
-            if (idx + 1) % 100 == 0:
-                print(f'... {idx + 1} catalogs simulated.')
-
-    # observed joint log-likelihood
-    obs_ll = poisson_joint_log_likelihood_ndarray(target_event_forecast,
-                                                  observed_data_nonzero,
-                                                  expected_forecast_count)
+        log_bin_expectations = numpy.log(rates * scale)
+
+    # if n_workers is given, the random streams are spawned from seed for any number of workers, including one,
+    # so the number of workers never changes the results for a seed
+    if rng is None and n_workers is not None:
+        rng = numpy.random.SeedSequence(seed)
+
+    if rng is not None and random_numbers is None:
+        num_events = int(n_obs) if use_observed_counts else None
+        simulated_ll = _simulate_blocks(_simulate_poisson_log_likelihoods,
+                                        (sampling_weights, log_bin_expectations, expected_forecast_count, num_events),
+                                        num_simulations, block_size, rng, n_workers=n_workers, verbose=verbose)
+    else:
+        # set seed for the likelihood test
+        if seed is not None:
+            numpy.random.seed(seed)
+
+        # main simulation step in this loop, each iteration simulates a block of catalogs. the random numbers are drawn
+        # in the same order as simulating one catalog at a time, so they don't depend on block_size
+        simulated_ll = numpy.empty(num_simulations)
+        for start in range(0, num_simulations, block_size):
+            stop = min(start + block_size, num_simulations)
+            if random_numbers is not None:
+                block_events, block_numbers = None, random_numbers[start:stop, :]
+            elif use_observed_counts:
+                block_events, block_numbers = int(n_obs), None
+            else:
+                block_events, block_numbers = _legacy_poisson_draws(stop - start, expected_forecast_count)
+            simulated_ll[start:stop] = _simulate_poisson_log_likelihoods(
+                numpy.random, stop - start, sampling_weights, log_bin_expectations, expected_forecast_count,
+                num_events=block_events, random_numbers=block_numbers)
+
+            # just be verbose
+            if verbose:
+                print(f'... {stop} catalogs simulated.')
+
+    # observed joint log-likelihood, computed like the simulations so that identical catalogs have the same value
+    target_idx = numpy.flatnonzero(observed_data.ravel())
+    observed_data_nonzero = observed_data.ravel()[target_idx].astype(numpy.int64)
+    target_has_rates = True
+    if bin_idx is not None:
+        # target events in bins that are not stored in a sparse forecast have zero rates
+        target_has_rates = numpy.all(numpy.isin(target_idx, bin_idx))
+        target_idx = numpy.searchsorted(bin_idx, target_idx)
+    if target_has_rates:
+        obs_ll = _joint_log_likelihoods(numpy.zeros(numpy.sum(observed_data_nonzero), dtype=numpy.int64),
+                                        numpy.repeat(target_idx, observed_data_nonzero), 1,
+                                        log_bin_expectations, expected_forecast_count)[0]
+    else:
+        obs_ll = -numpy.inf
 
     # quantile score
     qs = numpy.sum(simulated_ll <= obs_ll) / num_simulations
 
-    # float, float, list
+    # float, float, numpy.ndarray
     return qs, obs_ll, simulated_ll
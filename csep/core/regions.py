@@ -1,18 +1,16 @@
 # Python imports
-import itertools
+import hashlib
+import math
 import os
-from itertools import compress
 from xml.etree import ElementTree as ET
 
 # Third-party imports
 import numpy
 import numpy as np
 import mercantile
-from shapely import geometry
-from shapely.ops import unary_union
 
 # PyCSEP imports
-from csep.utils.calc import bin1d_vec, cleaner_range, first_nonnan, last_nonnan
+from csep.utils.calc import bin1d_vec, cleaner_range
 from csep.utils.scaling_relationships import WellsAndCoppersmith
 
 from csep.models import Polygon
@@ -50,9 +48,8 @@ def california_relm_collection_region(dh_scale=1, magnitudes=None, name="relm-ca
         origins = increase_grid_resolution(origins, dh, dh_scale)
         dh = dh / dh_scale
 
-    # turn points into polygons and make region object
-    bboxes = compute_vertices(origins, dh)
-    relm_region = CartesianGrid2D([Polygon(bbox) for bbox in bboxes], dh, name=name)
+    # make region object, the polygons are created from the origins when needed
+    relm_region = CartesianGrid2D.from_origins(origins, dh=dh, name=name)
 
     if magnitudes is not None:
         relm_region.magnitudes = magnitudes
@@ -95,9 +92,8 @@ def california_relm_region(dh_scale=1, magnitudes=None, name="relm-california",
         origins = increase_grid_resolution(origins, dh, dh_scale)
         dh = dh / dh_scale
 
-    # turn points into polygons and make region object
-    bboxes = compute_vertices(origins, dh)
-    relm_region = CartesianGrid2D([Polygon(bbox) for bbox in bboxes], dh, name=name)
+    # make region object, the polygons are created from the origins when needed
+    relm_region = CartesianGrid2D.from_origins(origins, dh=dh, name=name)
 
     if magnitudes is not None:
         relm_region.magnitudes = magnitudes
@@ -143,9 +139,8 @@ def italy_csep_region(dh_scale=1, magnitudes=None, name="csep-italy", use_midpoi
         origins = increase_grid_resolution(origins, dh, dh_scale)
         dh = dh / dh_scale
 
-    # turn points into polygons and make region object
-    bboxes = compute_vertices(origins, dh)
-    italy_region = CartesianGrid2D([Polygon(bbox) for bbox in bboxes], dh, name=name)
+    # make region object, the polygons are created from the origins when needed
+    italy_region = CartesianGrid2D.from_origins(origins, dh=dh, name=name)
 
     if magnitudes is not None:
         italy_region.magnitudes = magnitudes
@@ -185,9 +180,8 @@ def italy_csep_collection_region(dh_scale=1, magnitudes=None, name="csep-italy-c
         origins = increase_grid_resolution(origins, dh, dh_scale)
         dh = dh / dh_scale
 
-    # turn points into polygons and make region object
-    bboxes = compute_vertices(origins, dh)
-    relm_region = CartesianGrid2D([Polygon(bbox) for bbox in bboxes], dh, name=name)
+    # make region object, the polygons are created from the origins when needed
+    relm_region = CartesianGrid2D.from_origins(origins, dh=dh, name=name)
 
     if magnitudes is not None:
         relm_region.magnitudes = magnitudes
@@ -227,9 +221,8 @@ def nz_csep_region(dh_scale=1, magnitudes=None, name="csep-nz", use_midpoint=Tru
         origins = increase_grid_resolution(origins, dh, dh_scale)
         dh = dh / dh_scale
 
-    # turn points into polygons and make region object
-    bboxes = compute_vertices(origins, dh)
-    nz_region = CartesianGrid2D([Polygon(bbox) for bbox in bboxes], dh, name=name)
+    # make region object, the polygons are created from the origins when needed
+    nz_region = CartesianGrid2D.from_origins(origins, dh=dh, name=name)
 
     if magnitudes is not None:
         nz_region.magnitudes = magnitudes
@@ -269,9 +262,8 @@ def nz_csep_collection_region(dh_scale=1, magnitudes=None, name="csep-nz-collect
         origins = increase_grid_resolution(origins, dh, dh_scale)
         dh = dh / dh_scale
 
-    # turn points into polygons and make region object
-    bboxes = compute_vertices(origins, dh)
-    nz_collection_region = CartesianGrid2D([Polygon(bbox) for bbox in bboxes], dh, name=name)
+    # make region object, the polygons are created from the origins when needed
+    nz_collection_region = CartesianGrid2D.from_origins(origins, dh=dh, name=name)
 
     if magnitudes is not None:
         nz_collection_region.magnitudes = magnitudes
@@ -293,8 +285,9 @@ def global_region(dh=0.1, name="global", magnitudes=None):
 
     lons = cleaner_range(-180.0, 179.9, dh)
     lats = cleaner_range(-90, 89.9, dh)
-    coords = itertools.product(lons,lats)
-    region = CartesianGrid2D([Polygon(bbox) for bbox in compute_vertices(coords, dh)], dh, name=name)
+    # same ordering as itertools.product(lons, lats), latitudes are fastest
+    coords = numpy.column_stack((numpy.repeat(lons, len(lats)), numpy.tile(lats, len(lons))))
+    region = CartesianGrid2D.from_origins(coords, dh=dh, name=name)
     if magnitudes is not None:
         region.magnitudes = magnitudes
     return region
@@ -331,6 +324,24 @@ def create_space_magnitude_region(region, magnitudes):
     region.num_mag_bins = len(region.magnitudes)
     return region
 
+class _CSEPTemplateTarget:
+    """ Parser target that only keeps the cell coordinates and spacing of a CSEP XML template without building the tree """
+    namespace = '{http://www.scec.org/xml-ns/csep/forecast/0.1}'
+
+    def __init__(self):
+        self.points = []
+        self.cell_dimension = None
+
+    def start(self, tag, attrib):
+        if tag == self.namespace + 'cell':
+            self.points.append((float(attrib['lon']), float(attrib['lat'])))
+        elif tag == self.namespace + 'defaultCellDimension' and self.cell_dimension is None:
+            self.cell_dimension = (float(attrib['latRange']), float(attrib['lonRange']))
+
+    def close(self):
+        return self.points, self.cell_dimension
+
+
 def parse_csep_template(xml_filename):
     """
     Reads CSEP XML template file and returns the lat/lon values
@@ -339,17 +350,11 @@ def parse_csep_template(xml_filename):
     Returns:
         list of tuples where tuple is (lon, lat)
     """
-    tree = ET.parse(xml_filename)
-    root = tree.getroot()
-    points = []
-    for cell in root.iter('{http://www.scec.org/xml-ns/csep/forecast/0.1}cell'):
-        points.append((float(cell.attrib['lon']), float(cell.attrib['lat'])))
-
-    # get cell spacing
-    data = root.find('{http://www.scec.org/xml-ns/csep/forecast/0.1}forecastData')
-    dh_elem = data.find('{http://www.scec.org/xml-ns/csep/forecast/0.1}defaultCellDimension')
-    dh_lat = float(dh_elem.attrib['latRange'])
-    dh_lon = float(dh_elem.attrib['lonRange'])
+    parser = ET.XMLParser(target=_CSEPTemplateTarget())
+    with open(xml_filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(2 ** 20), b''):
+            parser.feed(chunk)
+    points, (dh_lat, dh_lon) = parser.close()
 
     if not numpy.isclose(dh_lat, dh_lon):
         raise ValueError("dh_lat must equal dh_lon. grid needs to be regular.")
@@ -402,10 +407,8 @@ def masked_region(region, polygon):
     """
     # contains is true if spatial cell in region is inside the polygon
     contains = polygon.contains(region.midpoints())
-    # compress only returns elements that are true, effectively removing elements outside of the polygons
-    new_polygons = list(compress(region.polygons, contains))
     # create new region with the spatial cells inside the polygon
-    return CartesianGrid2D(new_polygons, region.dh)
+    return CartesianGrid2D.from_origins(region.origins()[contains], dh=region.dh, name='cartesian2d')
 
 def generate_aftershock_region(mainshock_mw, mainshock_lon, mainshock_lat, num_radii=3, region=california_relm_region, **kwargs):
     """ Creates a spatial region around a given epicenter
@@ -495,6 +498,31 @@ def compute_vertices(origin_points, dh, tol=numpy.finfo(float).eps):
     """
     return list(map(lambda x: compute_vertex(x, dh, tol=tol), origin_points))
 
+def _bin_counts(flat_idx, n_bins):
+    """
+    Returns the number of occurrences of each index in flat_idx as float ndarray with shape (n_bins,).
+
+    This is the binning kernel shared by catalogs, forecasts and regions. Multi-dimensional bins, such as
+    space-magnitude bins, should be flattened before calling this function, see _bin_spatial_magnitude_counts. All
+    indexes must be valid, i.e., 0 <= flat_idx < n_bins.
+    """
+    flat_idx = numpy.asarray(flat_idx, dtype=numpy.int64)
+    # numpy.bincount needs to touch every bin, so scattering is faster for catalogs with few events compared to the bins
+    if flat_idx.size < n_bins // 64:
+        counts = numpy.zeros(n_bins)
+        numpy.add.at(counts, flat_idx, 1)
+        return counts
+    return numpy.bincount(flat_idx, minlength=n_bins).astype(numpy.float64)
+
+def _bin_spatial_magnitude_counts(spatial_idx, mag_idx, n_poly, n_mag):
+    """
+    Returns event counts in space-magnitude bins as ndarray with shape (n_poly, n_mag).
+
+    Events are counted using flat indexes into the space-magnitude grid, so spatial_idx and mag_idx must be valid.
+    """
+    flat_idx = numpy.asarray(spatial_idx, dtype=numpy.int64) * n_mag + mag_idx
+    return _bin_counts(flat_idx, n_poly * n_mag).reshape(n_poly, n_mag)
+
 def _bin_catalog_spatio_magnitude_counts(lons, lats, mags, n_poly, mask, idx_map, binx, biny, mag_bins, tol=0.00001):
     """
     Returns a list of event counts as ndarray with shape (n_poly, n_cat) where each value
@@ -504,8 +532,8 @@ def _bin_catalog_spatio_magnitude_counts(lons, lats, mags, n_poly, mask, idx_map
     that polygon in the mask. Additionally, the polygons are ordered such that the index of n_poly
     in the result corresponds to the index of the polygons.
 
-    Eventually, we can make a structure that could contain both of these, but the trade-offs will need
-    to be compared against performance.
+    Events outside of the region or the magnitude bins are returned as ndarray with shape (n_skipped, 3) containing
+    the lon, lat and magnitude of each skipped event.
     """
 
     # index in cartesian grid for events in data. note, this has a different index than the
@@ -514,20 +542,13 @@ def _bin_catalog_spatio_magnitude_counts(lons, lats, mags, n_poly, mask, idx_map
     idx = bin1d_vec(lons, binx)
     idy = bin1d_vec(lats, biny)
     mag_idxs = bin1d_vec(mags, mag_bins, tol=tol, right_continuous=True)
-    # start with zero event counts in each bin
-    event_counts = numpy.zeros((n_poly, len(mag_bins)))
-    # does not seem that we can vectorize this part
-    skipped = []
-    for i in range(idx.shape[0]):
-        if not mask[idy[i], idx[i]] and idy[i] != -1 and idx[i] != -1 and mag_idxs[i] != -1:
-            # getting spatial bin from mask
-            hash_idx = int(idx_map[idy[i], idx[i]])
-            mag_idx = mag_idxs[i]
-            # update event counts in that polygon
-            event_counts[(hash_idx, mag_idx)] += 1
-        else:
-            skipped.append((lons[i], lats[i], mags[i]))
-
+    # bin1d returns -1 if outside the region
+    good = (idx != -1) & (idy != -1) & (mag_idxs != -1)
+    good[good] = mask[idy[good], idx[good]] == 0
+    # getting spatial bin from mask
+    hash_idx = idx_map[idy[good], idx[good]].astype(numpy.int64)
+    event_counts = _bin_spatial_magnitude_counts(hash_idx, mag_idxs[good].astype(numpy.int64), n_poly, len(mag_bins))
+    skipped = numpy.column_stack((lons, lats, mags))[~good]
     return event_counts, skipped
 
 def _bin_catalog_spatial_counts(lons, lats, n_poly, mask, idx_map, binx, biny):
@@ -549,13 +570,10 @@ def _bin_catalog_spatial_counts(lons, lats, n_poly, mask, idx_map, binx, biny):
     # bin1d returns -1 if outside the region
     # todo: think about how to change this behavior for less confusions, bc -1 is an actual value that can be chosen
     bad = (idx == -1) | (idy == -1) | (mask[idy,idx] == 1)
-    # this can be memory optimized by keeping short list and storing index, only for case where n/2 events
-    event_counts = numpy.zeros(n_poly)
     # selecting the indexes into polygons correspoding to lons and lats within the grid
     hash_idx = idx_map[idy[~bad],idx[~bad]].astype(int)
     # aggregate in counts
-    numpy.add.at(event_counts, hash_idx, 1)
-    return event_counts
+    return _bin_counts(hash_idx, n_poly)
 
 def _bin_catalog_probability(lons, lats, n_poly, mask, idx_map, binx, biny):
     """
@@ -581,6 +599,92 @@ def _bin_catalog_probability(lons, lats, n_poly, mask, idx_map, binx, biny):
     event_counts[hash_idx] = 1
     return event_counts
 
+def _fingerprint(kind, *values):
+    """
+    Returns a sha256 hex digest identifying the contents of a region.
+
+    Each value is hashed as a float64 array together with its shape, None values are hashed as a marker.
+    """
+    digest = hashlib.sha256(kind.encode())
+    for value in values:
+        if value is None:
+            digest.update(b'none')
+            continue
+        value = numpy.ascontiguousarray(value, dtype=numpy.float64)
+        digest.update(str(value.shape).encode())
+        digest.update(value.tobytes())
+    return digest.hexdigest()
+
+def _raster_boundary(inside, x_edges, y_edges):
+    """
+    Returns the boundary of the cells of a 2d raster as a closed ring of vertices.
+
+    The edges between inside and outside cells are oriented with the inside on their left and linked into rings, similar
+    to marching squares on the corners of the raster. Cells touching only at a corner are traced as separate rings.
+    Collinear vertices are dropped. If the boundary consists of more than one ring, e.g., for islands or holes, the rings
+    are separated by a row of nan, which matplotlib draws as separate lines.
+
+    Args:
+        inside (numpy.ndarray): boolean array of shape (ny, nx), True for cells in the region
+        x_edges (numpy.ndarray): x coordinates of the nx + 1 cell edges
+        y_edges (numpy.ndarray): y coordinates of the ny + 1 cell edges
+
+    Returns:
+        numpy.ndarray: vertices of shape (m, 2)
+    """
+    ny, nx = inside.shape
+    padded = numpy.zeros((ny + 2, nx + 2), dtype=bool)
+    padded[1:-1, 1:-1] = inside
+    # edges between two rows of cells; at a bottom edge the boundary goes east, at a top edge it goes west
+    below, above = padded[:-1, 1:-1], padded[1:, 1:-1]
+    bottom_j, bottom_i = numpy.nonzero(above & ~below)
+    top_j, top_i = numpy.nonzero(below & ~above)
+    # edges between two columns of cells; at a left edge the boundary goes south, at a right edge it goes north
+    left, right = padded[1:-1, :-1], padded[1:-1, 1:]
+    left_j, left_i = numpy.nonzero(right & ~left)
+    right_j, right_i = numpy.nonzero(left & ~right)
+    # corner (j, i) of the raster is the start of the edge, directions are 0: east, 1: north, 2: west, 3: south
+    start_j = numpy.concatenate((bottom_j, top_j, left_j + 1, right_j))
+    start_i = numpy.concatenate((bottom_i, top_i + 1, left_i, right_i))
+    direction = numpy.concatenate((numpy.zeros(len(bottom_j), dtype=int), numpy.full(len(top_j), 2),
+                                   numpy.full(len(left_j), 3), numpy.ones(len(right_j), dtype=int)))
+    if len(direction) == 0:
+        return numpy.empty((0, 2))
+    step_j = numpy.array([0, 1, 0, -1])
+    step_i = numpy.array([1, 0, -1, 0])
+    start = start_j * (nx + 1) + start_i
+    end = (start_j + step_j[direction]) * (nx + 1) + start_i + step_i[direction]
+    # link every edge to the edge starting at its end, corners shared by two diagonal cells have two candidates
+    # and the left turn is taken to stay on the boundary of the same cell
+    order = numpy.argsort(start, kind='stable')
+    first = numpy.searchsorted(start, end, sorter=order)
+    candidate = order[first]
+    other = order[numpy.minimum(first + 1, len(order) - 1)]
+    ambiguous = (numpy.searchsorted(start, end, side='right', sorter=order) - first) == 2
+    left_turn = (direction + 1) % 4
+    nxt = numpy.where(ambiguous & (direction[candidate] != left_turn), other, candidate)
+    # vertices where the direction does not change are collinear
+    corner = numpy.zeros(len(direction), dtype=bool)
+    corner[nxt] = direction[nxt] != direction
+    visited = numpy.zeros(len(direction), dtype=bool)
+    rings = []
+    for edge in range(len(direction)):
+        if visited[edge]:
+            continue
+        ring = []
+        while not visited[edge]:
+            visited[edge] = True
+            ring.append(edge)
+            edge = nxt[edge]
+        ring = numpy.array(ring)
+        ring = ring[corner[ring]]
+        ring = numpy.append(ring, ring[0])
+        vertices = numpy.column_stack((x_edges[start_i[ring]], y_edges[start_j[ring]]))
+        if rings:
+            rings.append(numpy.full((1, 2), numpy.nan))
+        rings.append(vertices)
+    return numpy.concatenate(rings)
+
 class CartesianGrid2D:
     """Represents a 2D cartesian gridded region.
 
@@ -589,9 +693,18 @@ class CartesianGrid2D:
 
     Custom regions can be easily created by using the from_polygon classmethod. This function will accept an arbitrary closed
     polygon and return a CartesianGrid class with only points inside the polygon to be valid.
+
+    The region is stored as an array of cell origins. If the region is created from origins, the polygons are only
+    computed when they are accessed, see :meth:`from_origins`.
     """
-    def __init__(self, polygons, dh, name='cartesian2d', mask=None):
-        self.polygons = polygons
+    def __init__(self, polygons, dh, name='cartesian2d', mask=None, origins=None):
+        if origins is None:
+            origins = [poly.origin for poly in polygons]
+        self._origins = numpy.array(origins, dtype=numpy.float64).reshape(-1, 2)
+        self._origins.setflags(write=False)
+        # polygons are created lazily from the origins if they are not provided
+        self._polygons = polygons
+        self._lazy_polygons = polygons is None
         self.poly_mask = mask
         self.dh = dh
         self.name = name
@@ -604,16 +717,59 @@ class CartesianGrid2D:
         self.xs = xs
         self.ys = ys
         # Bounds [origin, top_right]
-        orgs = self.origins()
-        self.bounds = numpy.column_stack((orgs, orgs + dh))
+        self.bounds = numpy.column_stack((self._origins, self._origins + dh))
+
+    # changing one of these attributes changes the fingerprint of the region
+    _fingerprint_attributes = ('dh', 'poly_mask', 'magnitudes')
+
+    def __setattr__(self, name, value):
+        if name in self._fingerprint_attributes:
+            self.__dict__.pop('_fingerprint', None)
+        if name == 'dh':
+            self.__dict__.pop('_cell_area', None)
+        super().__setattr__(name, value)
 
     def __eq__(self, other):
-        return self.to_dict() == other.to_dict()
+        if not isinstance(other, CartesianGrid2D):
+            return NotImplemented
+        # names are compared as they are serialized by to_dict(), so regions survive a from_dict() round trip
+        return self is other or (str(self.name) == str(other.name) and self.fingerprint == other.fingerprint)
+
+    def __hash__(self):
+        return hash(self.fingerprint)
+
+    @property
+    def fingerprint(self):
+        """ Hash of the origins, dh, mask and magnitudes of the region, computed once and used for comparisons.
+
+        The fingerprint is recomputed if dh, poly_mask or magnitudes are assigned, but not if these arrays are modified
+        in-place.
+        """
+        fingerprint = self.__dict__.get('_fingerprint')
+        if fingerprint is None:
+            fingerprint = _fingerprint(self.__class__.__name__, self._origins, self.dh, self.poly_mask,
+                                       getattr(self, 'magnitudes', None))
+            self._fingerprint = fingerprint
+        return fingerprint
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # polygons created from the origins are not pickled
+        if self._lazy_polygons:
+            state['_polygons'] = None
+        return state
+
+    @property
+    def polygons(self):
+        """ List of :class:`csep.models.Polygon` for each cell in the region, created on first access """
+        if self._polygons is None:
+            self._polygons = [Polygon(bbox) for bbox in compute_vertices(self._origins, self.dh)]
+        return self._polygons
 
     @property
     def num_nodes(self):
         """ Number of polygons in region """
-        return len(self.polygons)
+        return len(self._origins)
 
     def get_index_of(self, lons, lats):
         """ Returns the index of lons, lats in self.polygons
@@ -645,7 +801,9 @@ class CartesianGrid2D:
 
         """
         indices = list(indices)
-        polys = [self.polygons[idx] for idx in indices]
+        if self._polygons is None:
+            return [Polygon(compute_vertex(self._origins[idx], self.dh)) for idx in indices]
+        polys = [self._polygons[idx] for idx in indices]
         return polys
 
     def get_masked(self, lons, lats):
@@ -676,38 +834,46 @@ class CartesianGrid2D:
         Args:
             data:
         """
-        assert len(data) == len(self.polygons)
-        results = numpy.zeros(self.bbox_mask.shape[:2])
-        ny = len(self.ys)
-        nx = len(self.xs)
-        for i in range(ny):
-            for j in range(nx):
-                if self.bbox_mask[i, j] == 0:
-                    idx = int(self.idx_map[i, j])
-                    results[i, j] = data[idx]
-                else:
-                    results[i, j] = numpy.nan
+        assert len(data) == self.num_nodes
+        rows, cols, idx = self._raster_index
+        results = numpy.full(self.bbox_mask.shape[:2], numpy.nan)
+        results[rows, cols] = numpy.asarray(data)[idx]
         return results
 
+    @property
+    def _raster_index(self):
+        """ Raster positions of the cells in the region and their index, computed once from the index map """
+        raster_index = self.__dict__.get('_raster_index_cache')
+        if raster_index is None:
+            rows, cols = numpy.nonzero(self.bbox_mask == 0)
+            raster_index = (rows, cols, self.idx_map[rows, cols].astype(numpy.int64))
+            self._raster_index_cache = raster_index
+        return raster_index
+
     def get_bbox(self):
         """ Returns rectangular bounding box around region. """
         return (self.xs.min(), self.xs.max()+self.dh, self.ys.min(), self.ys.max()+self.dh)
 
     def midpoints(self):
         """ Returns midpoints of rectangular polygons in region """
-        return numpy.array([poly.centroid() for poly in self.polygons])
+        return self._origins + self.dh / 2
 
     def origins(self):
         """ Returns origins of rectangular polygons in region """
-        return numpy.array([poly.origin for poly in self.polygons])
+        return self._origins.copy()
 
     def to_dict(self):
         adict = {
             'name': str(self.name),
             'dh': float(self.dh),
-            'polygons': [{'lat': float(poly.origin[1]), 'lon': float(poly.origin[0])} for poly in self.polygons],
+            'polygons': [{'lat': lat, 'lon': lon} for lon, lat in self._origins.tolist()],
             'class_id': self.__class__.__name__
         }
+        # optional members are only stored if they are set, so the region compares equal after a round-trip
+        if getattr(self, 'magnitudes', None) is not None:
+            adict['magnitudes'] = numpy.asarray(self.magnitudes, dtype=numpy.float64).tolist()
+        if self.poly_mask is not None:
+            adict['mask'] = numpy.asarray(self.poly_mask, dtype=numpy.float64).tolist()
         return adict
 
     @classmethod
@@ -716,6 +882,7 @@ class CartesianGrid2D:
         origins = adict.get('polygons', None)
         dh = adict.get('dh', None)
         magnitudes = adict.get('magnitudes', None)
+        mask = adict.get('mask', None)
         name = adict.get('name', 'CartesianGrid2D')
 
         if origins is None:
@@ -733,25 +900,30 @@ class CartesianGrid2D:
             except:
                 raise TypeError('magnitudes must be numpy array like.')
 
-        out = cls.from_origins(origins, dh=dh, magnitudes=magnitudes, name=name)
+        if mask is not None:
+            mask = numpy.array(mask)
+
+        out = cls.from_origins(origins, dh=dh, magnitudes=magnitudes, name=name, mask=mask)
         return out
 
     @classmethod
-    def from_origins(cls, origins, dh=None, magnitudes=None, name=None):
+    def from_origins(cls, origins, dh=None, magnitudes=None, name=None, mask=None):
         """Creates instance of class from 2d numpy.array of lon/lat origins.
 
         Note: Grid spacing should be constant in the entire region. This condition is not explicitly checked for for performance
-        reasons.
+        reasons. The polygons of the region are only created if :attr:`polygons` is accessed.
 
         Args:
             origins (numpy.ndarray like): [:,0] = lons and [:,1] = lats
             magnitudes (numpy.array like): optional, if provided will bind magnitude information to the class.
+            mask (numpy.array like): optional, csep1 flags for each origin where 1 indicates a valid cell
 
         Returns:
             cls
         """
         # ensure we can access the lons and lats
         try:
+            origins = numpy.asarray(origins, dtype=numpy.float64)
             lons = origins[:,0]
             lats = origins[:,1]
         except (TypeError):
@@ -763,7 +935,7 @@ class CartesianGrid2D:
             dh1 = numpy.abs(lats[1]-lats[0])
             dh = numpy.max([dh1, dh2])
 
-        region = CartesianGrid2D([Polygon(bbox) for bbox in compute_vertices(origins, dh)], dh, name=name)
+        region = cls(None, dh, name=name, mask=mask, origins=origins)
         if magnitudes is not None:
             region.magnitudes = magnitudes
         return region
@@ -773,12 +945,12 @@ class CartesianGrid2D:
         same as build mask but using vectorized calls to bin1d
         """
         # build bounding box of set of polygons based on origins
-        nd_origins = numpy.array([poly.origin for poly in self.polygons])
+        nd_origins = self._origins
         bbox = [(numpy.min(nd_origins[:, 0]), numpy.min(nd_origins[:, 1])),
                 (numpy.max(nd_origins[:, 0]), numpy.max(nd_origins[:, 1]))]
 
         # get midpoints for hashing
-        midpoints = numpy.array([poly.centroid() for poly in self.polygons])
+        midpoints = self.midpoints()
 
         # set up grid over bounding box
         xs = cleaner_range(bbox[0][0], bbox[1][0], self.dh)
@@ -793,45 +965,47 @@ class CartesianGrid2D:
         # bin1d returns the index of polygon within the cartesian grid
         idx = bin1d_vec(midpoints[:, 0], xs)
         idy = bin1d_vec(midpoints[:, 1], ys)
+        valid = (idx >= 0) & (idy >= 0)
+        a[idy[valid], idx[valid], 1] = numpy.flatnonzero(valid)
 
-        for i in range(len(self.polygons)):
-            a[idy[i], idx[i], 1] = int(i)
-            # build mask in dim=0; here masked values are 1. see note below.
-            if idx[i] >= 0 and idy[i] >= 0:
-                if self.poly_mask is not None:
-                    # note: csep1 gridded forecast file format convention states that a "1" indicates a valid cell, which is the opposite
-                    # of the masking criterion
-                    if self.poly_mask[i] == 1:
-                        a[idy[i], idx[i], 0] = 0
-                else:
-                    a[idy[i], idx[i], 0] = 0
+        # build mask in dim=0; here masked values are 1.
+        if self.poly_mask is not None:
+            # note: csep1 gridded forecast file format convention states that a "1" indicates a valid cell, which is the opposite
+            # of the masking criterion
+            valid &= numpy.asarray(self.poly_mask) == 1
+        a[idy[valid], idx[valid], 0] = 0
 
         return a, xs, ys
 
     def tight_bbox(self, precision=4):
-        # creates tight bounding box around the region
-        poly = np.array([i.points for i in self.polygons])
-
-        sorted_idx = np.sort(np.unique(poly, return_index=True, axis=0)[1], kind='stable')
-        unique_poly = poly[sorted_idx]
+        """ Returns the boundary of the region as closed ring of vertices, traced on the cells of the bounding box.
 
-        # merges all the cell polygons into one
-        polygons = [geometry.Polygon(np.round(i, precision)) for i in unique_poly]
-        joined_poly = unary_union(polygons)
-        bounds = np.array([i for i in joined_poly.boundary.xy]).T
+        Args:
+            precision (int): number of decimals the vertices are rounded to
 
-        return bounds
+        Returns:
+            numpy.ndarray: vertices of shape (m, 2), separate rings are separated by a row of nan
+        """
+        x_edges = numpy.append(self.xs, self.xs[-1] + self.dh)
+        y_edges = numpy.append(self.ys, self.ys[-1] + self.dh)
+        bounds = _raster_boundary(~numpy.isnan(self.idx_map), x_edges, y_edges)
+        return numpy.round(bounds, precision)
 
     def get_cell_area(self):
         """ Compute the area of each polygon in sq. kilometers.
 
+            The area only depends on the latitude of the cells, so it is computed once per row of the grid. The result
+            is cached on the region and returned as read-only array.
+
             Returns:
                 out (numpy.array): numpy array containing cell area in km^2
         """
-        area = numpy.zeros(self.num_nodes)
-        for idx, origin in enumerate(self.origins()):
-            top_right = origin + self.dh
-            area[idx] = geographical_area_from_bounds(origin[0], origin[1], top_right[0], top_right[1])
+        area = self.__dict__.get('_cell_area')
+        if area is None:
+            lats, row = numpy.unique(self._origins[:, 1], return_inverse=True)
+            area = geographical_area_from_bounds(0, lats, self.dh, lats + self.dh)[row.reshape(-1)]
+            area.setflags(write=False)
+            self._cell_area = area
         return area
 
 
@@ -839,24 +1013,164 @@ def geographical_area_from_bounds(lon1, lat1, lon2, lat2):
     """
     Computes area of spatial cell identified by origin coordinate and top right cooridnate.
     The functions computes area only for square/rectangle bounding box by based on spherical earth assumption.
+    The coordinates can also be arrays, in which case the area of each cell is returned.
     Args:
         lon1,lat1 : Origin coordinates
         lon2,lat2: Top right coordinates
     Returns:
         Area of cell in Km2
     """
-    if lon1 == lon2 or lat1 == lat2:
-        return 0
-    else:
-        earth_radius_km = 6371.
-        R2 = earth_radius_km ** 2
-        rad_per_deg = numpy.pi / 180.0e0
-
-        strip_area_steradian = 2 * numpy.pi * (1.0e0 - numpy.cos((90.0e0 - lat1) * rad_per_deg)) \
-                           - 2 * numpy.pi * (1.0e0 - numpy.cos((90.0e0 - lat2) * rad_per_deg))
-        area_km2 = strip_area_steradian * R2 / (360.0 / (lon2 - lon1))
+    earth_radius_km = 6371.
+    R2 = earth_radius_km ** 2
+    rad_per_deg = numpy.pi / 180.0e0
+
+    strip_area_steradian = 2 * numpy.pi * (1.0e0 - numpy.cos((90.0e0 - numpy.asarray(lat1)) * rad_per_deg)) \
+                           - 2 * numpy.pi * (1.0e0 - numpy.cos((90.0e0 - numpy.asarray(lat2)) * rad_per_deg))
+    # cells without width or height have an area of zero
+    area_km2 = strip_area_steradian * R2 * (numpy.asarray(lon2) - numpy.asarray(lon1)) / 360.0
     return area_km2
 
+def _quadkeys_to_tiles(quadkeys):
+    """
+    Returns the tile coordinates x, y and the zoom-level of quadkeys as int64 arrays.
+
+    Each digit of a quadkey interleaves one bit of the tile coordinates, where the x bit is the lowest bit of the digit.
+    This is the vectorized equivalent of mercantile.quadkey_to_tile.
+    """
+    quadkeys = numpy.asarray(quadkeys, dtype=str).reshape(-1)
+    zoom = numpy.char.str_len(quadkeys).astype(numpy.int64)
+    x = numpy.zeros(len(quadkeys), dtype=numpy.int64)
+    y = numpy.zeros(len(quadkeys), dtype=numpy.int64)
+    max_zoom = int(zoom.max()) if len(quadkeys) > 0 else 0
+    if max_zoom == 0:
+        return x, y, zoom
+    # shorter quadkeys are padded with null bytes, these are treated as zeros and shifted out below
+    digits = quadkeys.astype(f'S{max_zoom}').view(numpy.uint8).reshape(-1, max_zoom).astype(numpy.int64)
+    digits = numpy.where(digits > 0, digits - ord('0'), 0)
+    if numpy.any((digits < 0) | (digits > 3)):
+        raise ValueError("quadkeys can only contain the digits 0, 1, 2 and 3.")
+    for i in range(max_zoom):
+        x = (x << 1) | (digits[:, i] & 1)
+        y = (y << 1) | (digits[:, i] >> 1)
+    shift = max_zoom - zoom
+    return x >> shift, y >> shift, zoom
+
+def _lonlat_to_tile_coords(lons, lats, zoom):
+    """
+    Returns the fractional web-mercator tile coordinates of points at a zoom-level.
+
+    The integer part of the coordinates is the tile containing the point, see mercantile.tile.
+    """
+    n = 2.0 ** zoom
+    x = (numpy.asarray(lons, dtype=numpy.float64) + 180.0) / 360.0 * n
+    lat_rad = numpy.radians(numpy.asarray(lats, dtype=numpy.float64))
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        y = (1.0 - numpy.log(numpy.tan(lat_rad) + 1.0 / numpy.cos(lat_rad)) / numpy.pi) / 2.0 * n
+    return x, y
+
+def _spread_bits(v):
+    """ Returns v with a zero bit inserted after each of its lower 32 bits, used to interleave tile coordinates. """
+    v = v & 0x00000000FFFFFFFF
+    v = (v | (v << 16)) & 0x0000FFFF0000FFFF
+    v = (v | (v << 8)) & 0x00FF00FF00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v << 2)) & 0x3333333333333333
+    return (v | (v << 1)) & 0x5555555555555555
+
+def _compact_bits(v):
+    """ Returns the even bits of v packed into its lower 32 bits, this is the inverse of _spread_bits. """
+    v = v & 0x5555555555555555
+    v = (v | (v >> 1)) & 0x3333333333333333
+    v = (v | (v >> 2)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v >> 4)) & 0x00FF00FF00FF00FF
+    v = (v | (v >> 8)) & 0x0000FFFF0000FFFF
+    return (v | (v >> 16)) & 0x00000000FFFFFFFF
+
+def _tiles_to_quadkeys(x, y, zoom):
+    """
+    Returns the quadkeys of tiles as array of strings, this is the inverse of _quadkeys_to_tiles.
+
+    Args:
+        x, y (array-like): tile coordinates
+        zoom (int or array-like): zoom-level of the tiles
+    """
+    x, y, zoom = (numpy.asarray(a, dtype=numpy.int64).reshape(-1) for a in numpy.broadcast_arrays(x, y, zoom))
+    max_zoom = int(zoom.max()) if len(zoom) > 0 else 0
+    if max_zoom == 0:
+        return numpy.full(len(zoom), '', dtype='<U1')
+    # the base-4 digits of the interleaved tile coordinates at the largest zoom-level are the digits of the quadkey
+    shift = max_zoom - zoom
+    index = _spread_bits(x << shift) | (_spread_bits(y << shift) << 1)
+    digits = numpy.empty((len(zoom), max_zoom), dtype=numpy.uint8)
+    for i in range(max_zoom):
+        digits[:, i] = (index >> (2 * (max_zoom - 1 - i))) & 3
+    digits += ord('0')
+    # shorter quadkeys are padded with null bytes, which are removed by numpy
+    if numpy.any(shift > 0):
+        digits[numpy.arange(max_zoom) >= zoom[:, None]] = 0
+    return digits.view(f'S{max_zoom}').reshape(-1).astype(str)
+
+def _tile_lon_edges(x, zoom):
+    """ Returns the western longitude of tiles, computed like mercantile.bounds. """
+    return numpy.asarray(x) / 2.0 ** numpy.asarray(zoom) * 360.0 - 180.0
+
+def _tile_lat_edges(y, zoom):
+    """
+    Returns the northern latitude of tiles.
+
+    The latitudes are computed with the math module for each unique pair of (y, zoom), so they are identical to the
+    values from mercantile.bounds. The number of unique rows is small compared to the number of tiles.
+    """
+    y, zoom = (numpy.asarray(a, dtype=numpy.int64) for a in numpy.broadcast_arrays(y, zoom))
+    keys, inverse = numpy.unique((zoom << 32) | (y & 0xFFFFFFFF), return_inverse=True)
+    lats = numpy.array([math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * int(key & 0xFFFFFFFF) / math.pow(2, int(key >> 32))))))
+                        for key in keys], dtype=numpy.float64)
+    return lats[inverse].reshape(y.shape)
+
+def _tile_bounds(x, y, zoom):
+    """ Returns the bounds of tiles as array [lon1, lat1, lon2, lat2], see quadtree_grid_bounds """
+    x, y, zoom = numpy.broadcast_arrays(x, y, zoom)
+    lats = _tile_lat_edges(numpy.concatenate((y, y + 1)), numpy.concatenate((zoom, zoom)))
+    north, south = lats[:len(y)], lats[len(y):]
+    return numpy.column_stack((_tile_lon_edges(x, zoom), south, _tile_lon_edges(x + 1, zoom), north))
+
+def _lonlat_to_tiles(lons, lats, zoom):
+    """
+    Returns the tile coordinates x, y of the tiles containing the points at a zoom-level.
+
+    The tiles are consistent with the bounds of the tiles, a point is inside a tile if lon1 <= lon < lon2 and
+    lat1 <= lat < lat2. Points outside of the web-mercator domain get the tile coordinates -1.
+    """
+    lons = numpy.atleast_1d(numpy.asarray(lons, dtype=numpy.float64))
+    lats = numpy.atleast_1d(numpy.asarray(lats, dtype=numpy.float64))
+    n = 2 ** zoom
+    fx, fy = _lonlat_to_tile_coords(lons, lats, zoom)
+    finite = numpy.isfinite(fx) & numpy.isfinite(fy)
+    fx = numpy.where(finite, fx, -1.0)
+    fy = numpy.where(finite, fy, -1.0)
+    x = numpy.floor(fx)
+    y = numpy.floor(fy)
+    # the floating point tile coordinates can be off by one for points on the edges of tiles, so these are corrected using
+    # the exact edges. the tolerance is much larger than the rounding errors of the tile coordinates.
+    tol = n * 1e-12
+    near_edge = finite & ((fx - x < tol) | (x + 1 - fx < tol) | (fy - y < tol) | (y + 1 - fy < tol))
+    x = x.astype(numpy.int64)
+    y = y.astype(numpy.int64)
+    idx = numpy.flatnonzero(near_edge)
+    if len(idx) > 0:
+        ex = numpy.clip(x[idx], 0, n - 1)
+        ey = numpy.clip(y[idx], 0, n - 1)
+        ex -= lons[idx] < _tile_lon_edges(ex, zoom)
+        ex += lons[idx] >= _tile_lon_edges(ex + 1, zoom)
+        ey -= lats[idx] >= _tile_lat_edges(ey, zoom)
+        ey += lats[idx] < _tile_lat_edges(ey + 1, zoom)
+        x[idx] = ex
+        y[idx] = ey
+    outside = (x < 0) | (x >= n) | (y < 0) | (y >= n)
+    x[outside] = -1
+    y[outside] = -1
+    return x, y
+
 def quadtree_grid_bounds(quadk):
     """
     Computes the bottom-left and top-right coordinates corresponding to every quadkey
@@ -870,24 +1184,8 @@ def quadtree_grid_bounds(quadk):
                     [lon1,lat1,lon2,lat2]
 
     """
-
-    origin_lat = []
-    origin_lon = []
-    top_right_lon = []
-    top_right_lat = []
-
-    for i in range(len(quadk)):
-        origin_lon.append(mercantile.bounds(mercantile.quadkey_to_tile(quadk[i])).west)
-        origin_lat.append(mercantile.bounds(mercantile.quadkey_to_tile(quadk[i])).south)
-
-        top_right_lon.append(mercantile.bounds(mercantile.quadkey_to_tile(quadk[i])).east)
-        top_right_lat.append(mercantile.bounds(mercantile.quadkey_to_tile(quadk[i])).north)
-
-    grid_origin = numpy.column_stack((numpy.array(origin_lon), numpy.array(origin_lat)))
-    grid_top_right = numpy.column_stack((numpy.array(top_right_lon), numpy.array(top_right_lat)))
-    grid_bounds = numpy.column_stack((grid_origin, grid_top_right))
-
-    return grid_bounds
+    x, y, zoom = _quadkeys_to_tiles(quadk)
+    return _tile_bounds(x, y, zoom)
 
 def compute_vertex_bounds(bound_point, tol=numpy.finfo(float).eps):
     """
@@ -923,97 +1221,64 @@ def compute_vertices_bounds(bounds, tol=numpy.finfo(float).eps):
     """
     return list(map(lambda x: compute_vertex_bounds(x, tol=tol), bounds))
 
-def _create_tile(quadk, threshold, zoom, lon, lat, qk, num):
+def _single_resolution_tiles(zoom):
     """
-    **Alert: This Function uses GLOBAL variable (qk) and (num).
-
-        Provides multi-resolution quadtree spatial grid based on seismic density. It takes in a starting quadtree Tile (Quadkey),
-        then keeps on increasing the zoom-level of every Tile (or dividing cell) recursively, unless every cell meets the cell dividion criteria.
-
-        The primary criterion of dividing a parent cell into 4 child cells is a threshold on seismic denisity.
-        The cells are divided unless evevry cell cas number of earthquakes less than "threshold".
-        The cell division of any also stops if it reaches maximum zoom-level (zoom)
+    Returns the tile coordinates x, y of all tiles at a zoom-level, ordered by their quadkeys.
 
-        Args:
-            quadk : String
-                    0, 1, 2, 3 or any desired starting level of Quad key.
-            threshold : int
-                    Max number of earthquakes/cell allowed
-            zoom: int
-                    Maximum zoom level allowed for a quadkey
-            lon : float
-                    longitudes of earthquakes in catalog
-            lat : float
-                    latitude of earthquakes in catalog
-
-        Returns:
+    The index of a tile in quadkey order interleaves the bits of the tile coordinates, see _quadkeys_to_tiles.
     """
-    boundary = mercantile.bounds(mercantile.quadkey_to_tile(quadk))
-    eqs = numpy.logical_and(numpy.logical_and(lon >= boundary.west, lat >= boundary.south),
-                            numpy.logical_and(lon < boundary.east, lat < boundary.north))
-    num_eqs = numpy.size(lat[eqs])
-    #    global qk
-    #    global num
-
-    # Setting the Min Threshold of Area 1 sq. km. Instead of Depth
-
-    if num_eqs > threshold and len(quadk) < zoom:  # #qk_area_km(quadk)>4:
-        # print('inside If, Current Quad key ', quadk)
-        # print('Length of Quadkey ', len(quadk))
-        # # print('Num of Eqs ', num_eqs)
+    index = numpy.arange(4 ** zoom, dtype=numpy.int64)
+    return _compact_bits(index), _compact_bits(index >> 1)
 
-        _create_tile(quadk + '0', threshold, zoom, lon, lat, qk, num)
-
-        _create_tile(quadk + '1', threshold, zoom, lon, lat, qk, num)
-
-        _create_tile(quadk + '2', threshold, zoom, lon, lat, qk, num)
-
-        _create_tile(quadk + '3', threshold, zoom, lon, lat, qk, num)
-
-    else:
-        # print('inside ELSE, Current Quad key ', quadk)
-        # print('Num of Eqs ', num_eqs)
-        #           qk = numpy.append(qk, quadk)
-        qk.append(quadk)
-        #            num = numpy.append(num, num_eqs)
-        num.append(num_eqs)
-
-def _create_tile_fix_len(quadk, zoom, qk):
-    """
-    ***Alert: This Function uses GLOBAL variable (qk).
-
-        Provides single-resolution quadtree grid. It takes in a starting quadkey (or Quadrant of Globe),
-        then keeps on keeps on dividing it into 4 children unless the maximum zoom-level is achieved
-        Parameters
-        ----------
-        quadk : String
-            0, 1, 2, 3 or any desired starting level of Quad key.
-            zoom : TYPE
-            Length of Quad Key OR Depth of grid.
-
-
-            Returns
-            -------
-            None.
-        """
-
-    if len(quadk) < zoom:
-        #        print('inside If, Current Quad key ', quadk)
-        #        print('Len of QK: ', len(quadk))
-
-        _create_tile_fix_len(quadk + '0', zoom, qk)
-
-        _create_tile_fix_len(quadk + '1', zoom, qk)
+def _adaptive_tiles(lons, lats, threshold, zoom, weights=None):
+    """
+    Returns the tiles of a multi-resolution quadtree grid, where tiles are divided until they contain at most threshold
+    events or reach the zoom-level.
 
-        _create_tile_fix_len(quadk + '2', zoom, qk)
+    The quadkey of each event at the zoom-level is computed once as integer, and the events are sorted by it. The events
+    inside any tile are then a contiguous range of the sorted events, so the number of events in a tile is found using
+    binary search. The tiles are built level by level starting from the four tiles at zoom-level 1.
 
-        _create_tile_fix_len(quadk + '3', zoom, qk)
+    Args:
+        lons, lats (array-like): locations of the events
+        threshold (float): tiles with more events than threshold are divided
+        zoom (int): maximum zoom-level of the tiles
+        weights (array-like): optional, weight of each event. by default each event counts once
 
+    Returns:
+        x, y, tile_zoom, counts: tile coordinates, zoom-levels and event counts ordered by quadkeys
+    """
+    zoom = max(int(zoom), 1)
+    ex, ey = _lonlat_to_tiles(lons, lats, zoom)
+    inside = ex >= 0
+    event_keys = _spread_bits(ex[inside]) | (_spread_bits(ey[inside]) << 1)
+    order = numpy.argsort(event_keys, kind='stable')
+    event_keys = event_keys[order]
+    # cumulative counts of the sorted events, the count in a range of events is the difference of its ends
+    if weights is None:
+        cumulative = numpy.arange(len(event_keys) + 1)
     else:
-        # print('inside ELSE, Current Quad key ', quadk)
-        # print('Num of Eqs ', num_eqs)
-        #        qk = numpy.append(qk, quadk)
-        qk.append(quadk)
+        weights = numpy.broadcast_to(numpy.asarray(weights, dtype=numpy.float64), inside.shape)[inside][order]
+        cumulative = numpy.concatenate(([0.0], numpy.cumsum(weights)))
+    x = numpy.array([0, 1, 0, 1], dtype=numpy.int64)
+    y = numpy.array([0, 0, 1, 1], dtype=numpy.int64)
+    leaves = []
+    for level in range(1, zoom + 1):
+        # events in a tile have keys between the first and last key of its descendants at the zoom-level
+        shift = 2 * (zoom - level)
+        first = (_spread_bits(x) | (_spread_bits(y) << 1)) << shift
+        counts = cumulative[numpy.searchsorted(event_keys, first + (1 << shift))] - \
+                 cumulative[numpy.searchsorted(event_keys, first)]
+        divide = (counts > threshold) & (level < zoom)
+        leaves.append((x[~divide], y[~divide], numpy.full(numpy.count_nonzero(~divide), level), counts[~divide],
+                       first[~divide]))
+        # children of divided tiles
+        x = (2 * x[divide, None] + numpy.array([0, 1, 0, 1])).reshape(-1)
+        y = (2 * y[divide, None] + numpy.array([0, 0, 1, 1])).reshape(-1)
+    x, y, tile_zoom, counts, first = (numpy.concatenate(a) for a in zip(*leaves))
+    # the leaves do not overlap, so ordering them by their first key gives the depth-first order of the quadkeys
+    order = numpy.argsort(first, kind='stable')
+    return x[order], y[order], tile_zoom[order], counts[order]
 
 class QuadtreeGrid2D:
     """
@@ -1030,15 +1295,18 @@ class QuadtreeGrid2D:
         Args:
             polygons: Represents the object of class "polygons" defined through a collection of vertices.
                         This polygon is 2d and vertices are obtained as corner points of quadtree tile.
+                        If None, the polygons are created from the bounds when they are accessed.
             quadkeys: Unique identifier of each quadtree tile. Quadkeys of every tile defines a grid cell.
                         This is the first thing computed while acquiring quadtree grid. Rest can be computed from this.
             bounds: number of cells x [lon1, lat1, lon2, lat2], corresponding to origin coordinates and top right coordinates fo each grid cell
             name: Name of grid
             mask: Masked cells. NotImplemented yet. Always keep it none
         """
-        self.polygons = polygons
+        # polygons are created lazily from the bounds if they are not provided
+        self._polygons = polygons
+        self._lazy_polygons = polygons is None
         self.quadkeys = quadkeys
-        self.bounds = bounds
+        self.bounds = numpy.asarray(bounds)
         self.cell_area = []
         self.poly_mask = mask
         self.name = name
@@ -1047,23 +1315,125 @@ class QuadtreeGrid2D:
         # self.ys = ys
         # self.idx_map = a
 
+    # changing one of these attributes changes the fingerprint of the region
+    _fingerprint_attributes = ('bounds', 'poly_mask', 'magnitudes')
+
+    def __setattr__(self, name, value):
+        if name in self._fingerprint_attributes:
+            self.__dict__.pop('_fingerprint', None)
+        if name in ('quadkeys', 'bounds'):
+            self.__dict__.pop('_spatial_index', None)
+            self.__dict__.pop('_raster', None)
+        if name == 'bounds':
+            self.__dict__['cell_area'] = []
+        super().__setattr__(name, value)
+
+    def __eq__(self, other):
+        if not isinstance(other, QuadtreeGrid2D):
+            return NotImplemented
+        # names are compared as they are serialized by to_dict(), so regions survive a from_dict() round trip
+        return self is other or (str(self.name) == str(other.name) and self.fingerprint == other.fingerprint)
+
+    def __hash__(self):
+        return hash(self.fingerprint)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # polygons created from the bounds are not pickled
+        if self._lazy_polygons:
+            state['_polygons'] = None
+        return state
+
+    @property
+    def polygons(self):
+        """ List of :class:`csep.models.Polygon` for each cell in the region, created on first access """
+        if self._polygons is None:
+            self._polygons = [Polygon(bbox) for bbox in compute_vertices_bounds(self.bounds)]
+        return self._polygons
+
+    @property
+    def fingerprint(self):
+        """ Hash of the cell bounds, mask and magnitudes of the region, computed once and used for comparisons.
+
+        The fingerprint is recomputed if bounds, poly_mask or magnitudes are assigned, but not if these arrays are
+        modified in-place.
+        """
+        fingerprint = self.__dict__.get('_fingerprint')
+        if fingerprint is None:
+            fingerprint = _fingerprint(self.__class__.__name__, self.bounds, self.poly_mask,
+                                       getattr(self, 'magnitudes', None))
+            self._fingerprint = fingerprint
+        return fingerprint
+
     @property
     def num_nodes(self):
         """ Number of polygons in region """
-        return len(self.polygons)
+        return len(self.bounds)
 
     def get_cell_area(self):
         """
         Calls function geographical_area_from_bounds and computes area of each grid cell. It also modified class variable "self.cell_area"
-        It iterates over all the cells of grid and passes bounding coordinates of every cell to function  geographical_area_from_bounds
+        The areas of all cells are computed at once from the bounds and cached in "self.cell_area" as read-only array
         """
-        cell_area = numpy.array([geographical_area_from_bounds(bb[0],bb[1],bb[2],bb[3]) for bb in self.bounds])
-        self.cell_area = cell_area
+        if len(self.cell_area) != self.num_nodes:
+            cell_area = geographical_area_from_bounds(self.bounds[:, 0], self.bounds[:, 1], self.bounds[:, 2],
+                                                      self.bounds[:, 3])
+            cell_area.setflags(write=False)
+            self.cell_area = cell_area
         return self.cell_area
 
-    def get_index_of(self, lons, lats): 
+    @property
+    def spatial_index(self):
+        """ Lookup tables of the cells for each zoom-level in the region, created on first access.
+
+        Returns:
+            list of tuples (zoom, keys, cells) sorted by zoom, where keys are the sorted tile coordinates x * 2**zoom + y of
+            the cells at that zoom-level and cells are the corresponding indexes into self.polygons
+        """
+        spatial_index = self.__dict__.get('_spatial_index')
+        if spatial_index is None:
+            x, y, zoom = _quadkeys_to_tiles(self.quadkeys)
+            spatial_index = []
+            for level in numpy.unique(zoom):
+                cells = numpy.flatnonzero(zoom == level)
+                keys = (x[cells] << level) | y[cells]
+                # stable sort, so the first cell is found if cells are repeated
+                order = numpy.argsort(keys, kind='stable')
+                spatial_index.append((int(level), keys[order], cells[order]))
+            self._spatial_index = spatial_index
+        return spatial_index
+
+    def _locate(self, lons, lats):
+        """ Returns the index of the first cell containing each point, or -1 if the point is outside of the region.
+
+        The tile of each point is computed at the largest zoom-level of the region, and the tiles of the other zoom-levels
+        are looked up from its quadkey prefixes using binary search.
+        """
+        lons = numpy.atleast_1d(numpy.asarray(lons, dtype=numpy.float64))
+        idx = numpy.full(len(lons), -1, dtype=numpy.int64)
+        spatial_index = self.spatial_index
+        if len(spatial_index) == 0:
+            return idx
+        max_zoom = spatial_index[-1][0]
+        tx, ty = _lonlat_to_tiles(lons, lats, max_zoom)
+        points = numpy.flatnonzero(tx >= 0)
+        tx, ty = tx[points], ty[points]
+        found = numpy.full(len(points), len(self.quadkeys), dtype=numpy.int64)
+        for level, keys, cells in spatial_index:
+            shift = max_zoom - level
+            point_keys = ((tx >> shift) << level) | (ty >> shift)
+            pos = numpy.minimum(numpy.searchsorted(keys, point_keys), len(keys) - 1)
+            hit = keys[pos] == point_keys
+            found[hit] = numpy.minimum(found[hit], cells[pos[hit]])
+        located = found < len(self.quadkeys)
+        idx[points[located]] = found[located]
+        return idx
+
+    def get_index_of(self, lons, lats):
         """ Returns the index of lons, lats in self.polygons
 
+        Points outside of the region are not included in the returned indexes.
+
         Args:
             lons: ndarray-like
             lats: ndarray-like
@@ -1073,17 +1443,26 @@ class QuadtreeGrid2D:
         """
         # If its array or many coords
         if isinstance(lons, (list, numpy.ndarray)):
-            idx = []
-            for i in range(len(lons)):
-                idx = numpy.append(idx, self._find_location(lons[i], lats[i]))
-            idx = idx.astype(int)
-            return idx
+            idx = self._locate(lons, lats)
+            return idx[idx >= 0].astype(int)
         # It its just one Lon/Lon
         if isinstance(lons, (int, float)):
-            idx = self._find_location(lons, lats)
-            return idx
+            idx = self._locate(lons, lats)[0]
+            return idx if idx >= 0 else numpy.array([], dtype=numpy.int64)
         return None
 
+    def get_masked(self, lons, lats):
+        """Returns bool array lons and lats are not included in the spatial region.
+
+        Args:
+            lons: array-like
+            lats: array-like
+
+        Returns:
+            mask: array-like
+        """
+        return self._locate(lons, lats) == -1
+
     def _find_location(self, lon, lat):
         """ Takes in single Lon and Lat and finds its Polygon Index.
 
@@ -1107,7 +1486,9 @@ class QuadtreeGrid2D:
             Polygon
         """
         indices = list(indices)
-        polys = [self.polygons[idx] for idx in indices]
+        if self._polygons is None:
+            return [Polygon(compute_vertex_bounds(self.bounds[idx])) for idx in indices]
+        polys = [self._polygons[idx] for idx in indices]
         return polys
 
     def _get_spatial_counts(self, catalog, mag_bins=None):
@@ -1141,11 +1522,8 @@ class QuadtreeGrid2D:
         lon = catalog.get_longitudes()
         lat = catalog.get_latitudes()
 
-        out = numpy.zeros(len(self.quadkeys))
         idx = self.get_index_of(lon, lat)
-        numpy.add.at(out, idx, 1)
-
-        return out
+        return _bin_counts(idx, len(self.quadkeys))
 
     def _get_spatial_magnitude_counts(self, catalog, mag_bins=None):
         """
@@ -1179,14 +1557,10 @@ class QuadtreeGrid2D:
         lon = catalog.get_longitudes()
         lat = catalog.get_latitudes()
         mag = catalog.get_magnitudes()
-        out = numpy.zeros([len(self.quadkeys), len(mag_bins)])
-
         idx_loc = self.get_index_of(lon, lat)
         idx_mag = bin1d_vec(mag, mag_bins, tol=0.00001, right_continuous=True)
 
-        numpy.add.at(out, (idx_loc, idx_mag), 1)
-
-        return out
+        return _bin_spatial_magnitude_counts(idx_loc, idx_mag.astype(numpy.int64), len(self.quadkeys), len(mag_bins))
 
     def get_bbox(self):
         """ Returns rectangular bounding box around region. """
@@ -1195,16 +1569,16 @@ class QuadtreeGrid2D:
 
     def midpoints(self):
         """ Returns midpoints of rectangular polygons in region """
-        return numpy.array([poly.centroid() for poly in self.polygons])
+        return (self.bounds[:, :2] + self.bounds[:, 2:]) / 2
 
     def origins(self):
         """ Returns origins of rectangular polygons in region """
-        return numpy.array([poly.origin for poly in self.polygons])
+        return self.bounds[:, :2].copy()
 
     def to_dict(self):
         adict = {
             'name': str(self.name),
-            'polygons': [{'lat': float(poly.origin[1]), 'lon': float(poly.origin[0])} for poly in self.polygons]
+            'polygons': [{'lat': lat, 'lon': lon} for lon, lat in self.bounds[:, :2].tolist()]
         }
         return adict
 
@@ -1217,44 +1591,36 @@ class QuadtreeGrid2D:
         numpy.savetxt(filename, self.quadkeys, delimiter=',', fmt='%s')
 
     @classmethod
-    def from_catalog(cls, catalog, threshold, zoom=11, magnitudes=None, name=None):
+    def from_catalog(cls, catalog, threshold, zoom=11, magnitudes=None, name=None, weights=None):
         """
         Creates instance of class from 2d numpy.array of lon/lat of Catalog.
         Provides multi-resolution quadtree spatial grid based on seismic density. It starts from whole globe as 4 cells (Quadkeys:'0','1','2','3'),
-        then keeps on increasing the zoom-level of every Tile recursively, unless every cell meets the division criteria.
+        then keeps on increasing the zoom-level of every Tile, unless every cell meets the division criteria.
 
         The primary criterion of dividing a parent cell into 4 child cells is a threshold on seismic density.
         The cells are divided unless every cell has number of earthquakes less than "threshold".
         The division of a cell also stops if it reaches maximum zoom-level (zoom)
 
         Args:
-            catalog (CSEPCatalog): catalog used to create quadtree
-            threshold (int): Max earthquakes allowed per cells
+            catalog (CSEPCatalog or list): catalog used to create quadtree, or list of catalogs whose events are combined
+            threshold (float): Max earthquakes allowed per cells, or max sum of weights if weights are provided
             zoom (int): Max zoom allowed for a cell
             magnitudes (array-like): left end values of magnitude discretization
+            weights (numpy.ndarray or list): optional, weight of each event. if catalog is a list, weights can also be a
+                                             list with a weight or an array of event weights for each catalog
 
         Returns:
             instance of QuadtreeGrid2D
         """
+        catalogs = catalog if isinstance(catalog, (list, tuple)) else [catalog]
+        lon = numpy.concatenate([cat.get_longitudes() for cat in catalogs])
+        lat = numpy.concatenate([cat.get_latitudes() for cat in catalogs])
+        if isinstance(catalog, (list, tuple)) and isinstance(weights, (list, tuple)):
+            weights = numpy.concatenate([numpy.broadcast_to(numpy.asarray(w, dtype=numpy.float64), cat.event_count)
+                                         for w, cat in zip(weights, catalogs)])
 
-        lon = catalog.get_longitudes()
-        lat = catalog.get_latitudes()
-
-        qk = []
-        num = []
-
-        _create_tile('0', threshold, zoom, lon, lat, qk, num)
-        _create_tile('1', threshold, zoom, lon, lat, qk, num)
-        _create_tile('2', threshold, zoom, lon, lat, qk, num)
-        _create_tile('3', threshold, zoom, lon, lat, qk, num)
-
-        qk = numpy.array(qk)
-        bounds = quadtree_grid_bounds(qk)
-        region = QuadtreeGrid2D(
-            [Polygon(bbox) for bbox in compute_vertices_bounds(bounds)],
-            qk,
-            bounds,
-            name=name)
+        x, y, tile_zoom, _ = _adaptive_tiles(lon, lat, threshold, zoom, weights=weights)
+        region = QuadtreeGrid2D(None, _tiles_to_quadkeys(x, y, tile_zoom), _tile_bounds(x, y, tile_zoom), name=name)
 
         if magnitudes is not None:
             region.magnitudes = magnitudes
@@ -1275,18 +1641,10 @@ class QuadtreeGrid2D:
             instance of QuadtreeGrid2D
         """
 
-        qk = []
-        _create_tile_fix_len('0', zoom, qk)
-        _create_tile_fix_len('1', zoom, qk)
-        _create_tile_fix_len('2', zoom, qk)
-        _create_tile_fix_len('3', zoom, qk)
-
-        qk = numpy.array(qk)
-
-        bounds = quadtree_grid_bounds(qk)
-
-        region = QuadtreeGrid2D([Polygon(bbox) for bbox in compute_vertices_bounds(bounds)], qk, bounds,
-                                name=name)
+        # the grid starts from the four tiles at zoom-level 1
+        zoom = max(int(zoom), 1)
+        x, y = _single_resolution_tiles(zoom)
+        region = QuadtreeGrid2D(None, _tiles_to_quadkeys(x, y, zoom), _tile_bounds(x, y, zoom), name=name)
 
         if magnitudes is not None:
             region.magnitudes = magnitudes
@@ -1305,8 +1663,7 @@ class QuadtreeGrid2D:
         """
         bounds = quadtree_grid_bounds(numpy.array(quadk))
 
-        region = QuadtreeGrid2D([Polygon(bbox) for bbox in compute_vertices_bounds(bounds)], quadk, bounds,
-                                name=name)
+        region = QuadtreeGrid2D(None, quadk, bounds, name=name)
 
         if magnitudes is not None:
             region.magnitudes = magnitudes
@@ -1314,19 +1671,21 @@ class QuadtreeGrid2D:
         return region
 
     def _get_idx_map_xs_ys(self):
-        print('inside _get_idx_map')
-        nd_origins = numpy.array([poly.origin for poly in self.polygons])
-        xs = numpy.unique(nd_origins[:, 0])
-        ys = numpy.unique(nd_origins[:, 1])
-        ny = len(ys)
-        nx = len(xs)
-        #Get the index map
-        a = numpy.zeros([ny, nx])
-        for i in range(nx):
-            for j in range(ny):
-                idx = self.get_index_of(xs[i], ys[j])
-                a[j, i] = idx
-        return a, xs, ys
+        """ Returns the index map of the region on a raster and the west and south edges of the raster cells.
+
+        The raster is formed by the cell edges of the region, so every raster cell lies inside one cell of the region or
+        outside of the region, where the index map is nan. The raster is computed once.
+        """
+        raster = self.__dict__.get('_raster')
+        if raster is None:
+            xs = numpy.unique(self.bounds[:, [0, 2]])
+            ys = numpy.unique(self.bounds[:, [1, 3]])
+            lons, lats = numpy.meshgrid((xs[:-1] + xs[1:]) / 2, (ys[:-1] + ys[1:]) / 2)
+            idx = self._locate(lons.ravel(), lats.ravel())
+            a = numpy.where(idx == -1, numpy.nan, idx).reshape(lons.shape)
+            raster = (a, xs[:-1], ys[:-1])
+            self._raster = raster
+        return raster
 
     def get_cartesian(self, data):
         """ Returns 2d ndrray representation of the data set, corresponding to the bounding box.
@@ -1335,52 +1694,32 @@ class QuadtreeGrid2D:
             data (numpy.array): array of values corresponding to cells in the quadtree region
 
         Returns:
-            results (numpy.array): 2d numpy array with rates on cartesian grid
+            results (numpy.array): 2d numpy array with rates on cartesian grid, nan outside of the region
 
         """
         a, xs, ys = self._get_idx_map_xs_ys()
         self.xs = xs
         self.ys = ys
         self.idx_map = a
-        assert len(data) == len(self.polygons)
-        ny = len(self.ys)
-        nx = len(self.xs)
-        results = numpy.zeros([ny, nx])
-        for i in range(nx):
-            for j in range(ny):
-                idx = int(self.idx_map[j,i])
-                results[j, i] = data[idx]
+        assert len(data) == self.num_nodes
+        inside = ~numpy.isnan(a)
+        results = numpy.full(a.shape, numpy.nan)
+        results[inside] = numpy.asarray(data)[a[inside].astype(numpy.int64)]
         return results
 
-    def tight_bbox(self):
-        # creates tight bounding box around the region, probably a faster way to do this.
-        ny, nx = self.idx_map.shape
-        asc = []
-        desc = []
-        for j in range(ny):
-            row = self.idx_map[j, :]
-            argmin = first_nonnan(row)
-            argmax = last_nonnan(row)
-            # points are stored clockwise
-            poly_min = self.polygons[int(row[argmin])].points
-            asc.insert(0, poly_min[0])
-            asc.insert(0, poly_min[1])
-            poly_max = self.polygons[int(row[argmax])].points
-            lat_0 = poly_max[2][1]
-            lat_1 = poly_max[3][1]
-            # last two points are 'right hand side of polygon'
-            if lat_0 < lat_1:
-                desc.append(poly_max[2])
-                desc.append(poly_max[3])
-            else:
-                desc.append(poly_max[3])
-                desc.append(poly_max[2])
-        # close the loop
-        poly = np.array(asc + desc)
-        sorted_idx = np.sort(np.unique(poly, return_index=True, axis=0)[1], kind='stable')
-        unique_poly = poly[sorted_idx]
-        unique_poly = np.append(unique_poly, [unique_poly[0, :]], axis=0)
-        return unique_poly
+    def tight_bbox(self, precision=4):
+        """ Returns the boundary of the region as closed ring of vertices, traced on the raster of the region.
+
+        Args:
+            precision (int): number of decimals the vertices are rounded to
+
+        Returns:
+            numpy.ndarray: vertices of shape (m, 2), separate rings are separated by a row of nan
+        """
+        a, xs, ys = self._get_idx_map_xs_ys()
+        bbox = self.get_bbox()
+        bounds = _raster_boundary(~numpy.isnan(a), numpy.append(xs, bbox[1]), numpy.append(ys, bbox[3]))
+        return numpy.round(bounds, precision)
 
 
 def california_quadtree_region(magnitudes=None, name="california-quadtree"):
@@ -142,6 +142,82 @@ def _compute_likelihood(gridded_data, apprx_rate_density, expected_cond_count, n
 
     return (likelihood, likelihood_norm)
 
+class LikelihoodEvaluator:
+    """ Computes the likelihood scores of catalogs against the expected rates of a catalog-based forecast.
+
+    This computes the same scores as the spatial and pseudolikelihood tests, see :func:`_compute_likelihood`. The log
+    rates and the normalized log rates are computed once, and catalogs are described by the indexes of the cells with
+    events and their counts. Scoring a catalog only reads the rates in these cells, so it does not allocate arrays with
+    the size of the grid.
+
+    Args:
+        apprx_rate_density (numpy.ndarray): expected rates in each spatial cell
+        expected_cond_count (float): expected number of events
+        n_obs (int): number of observed events
+    """
+
+    def __init__(self, apprx_rate_density, expected_cond_count, n_obs):
+        self.expected_cond_count = expected_cond_count
+        self.n_obs = n_obs
+        # the spatial statistic is not defined if there are no target events or forecast is computed undersampled
+        self.has_norm = n_obs != 0 and expected_cond_count != 0
+        with numpy.errstate(divide='ignore'):
+            self.log_rates = numpy.log(apprx_rate_density)
+            self.log_norm_rates = None
+            if self.has_norm:
+                self.log_norm_rates = numpy.log(apprx_rate_density / numpy.sum(apprx_rate_density))
+
+    def evaluate(self, cells, counts):
+        """ Returns the likelihood and normalized likelihood of a catalog.
+
+        Args:
+            cells (numpy.ndarray): sorted indexes of the cells with events
+            counts (numpy.ndarray): number of events in each cell
+
+        Returns:
+            tuple: likelihood, likelihood_norm
+        """
+        n_events = numpy.sum(counts)
+        if n_events == 0:
+            return (-self.expected_cond_count, numpy.nan)
+        likelihood = numpy.sum(counts * self.log_rates[cells]) - self.expected_cond_count
+        if not self.has_norm:
+            return (likelihood, numpy.nan)
+        likelihood_norm = numpy.sum(counts * self.log_norm_rates[cells]) / n_events
+        return (likelihood, likelihood_norm)
+
+    def evaluate_gridded(self, gridded_data):
+        """ Returns the likelihood and normalized likelihood of a catalog given as counts in each spatial cell """
+        cells = numpy.flatnonzero(gridded_data)
+        return self.evaluate(cells, gridded_data[cells])
+
+    def evaluate_batch(self, catalog_idx, cells, counts, n_catalogs):
+        """ Returns the likelihoods and normalized likelihoods of a batch of catalogs.
+
+        The catalogs are described by sparse arrays, where each element contains the count of events in a cell of a
+        catalog. Scores can differ from :meth:`evaluate` by round-off errors, because the terms are summed in order.
+
+        Args:
+            catalog_idx (numpy.ndarray): index of the catalog in the batch
+            cells (numpy.ndarray): index of the cell
+            counts (numpy.ndarray): number of events in the cell
+            n_catalogs (int): number of catalogs in the batch
+
+        Returns:
+            tuple: numpy.ndarray of likelihoods, numpy.ndarray of likelihood_norms
+        """
+        n_events = numpy.bincount(catalog_idx, weights=counts, minlength=n_catalogs)
+        likelihood = numpy.bincount(catalog_idx, weights=counts * self.log_rates[cells], minlength=n_catalogs)
+        likelihood = likelihood - self.expected_cond_count
+        likelihood_norm = numpy.full(n_catalogs, numpy.nan)
+        if self.has_norm:
+            has_events = n_events > 0
+            weighted_log_norm_rates = numpy.bincount(catalog_idx, weights=counts * self.log_norm_rates[cells],
+                                                     minlength=n_catalogs)
+            likelihood_norm[has_events] = weighted_log_norm_rates[has_events] / n_events[has_events]
+        return likelihood, likelihood_norm
+
+
 def _compute_approximate_likelihood(gridded_data, apprx_forecasted_rate):
     """ Computes the approximate likelihood from Rhoades et al., 2011; Equation 4
 
@@ -1,9 +1,14 @@
 import os
+import json
+import glob
 import shutil
+import hashlib
 import collections
 from tempfile import mkdtemp
 from contextlib import contextmanager
 
+import numpy
+
 @contextmanager
 def TemporaryDirectory(suffix='', prefix=None, dir=None):
     """
@@ -100,4 +105,128 @@ def iterable(arg):
 
 def get_file_extension(fname):
     """ Returns the extension from a filepath string ignoring the '.' character """
-    return os.path.splitext(fname)[-1][1:]
\ No newline at end of file
+    return os.path.splitext(fname)[-1][1:]
+
+def hash_file(path, chunk_size=2 ** 20):
+    """ Returns the SHA-256 hash of the contents of a file or of all files in a directory.
+
+    Files in a directory are hashed in sorted order together with their path relative to the directory.
+
+    Args:
+        path (str): filename or directory
+        chunk_size (int): number of bytes read at a time
+
+    Returns:
+        str: hex digest of the contents
+    """
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        fnames = sorted(os.path.join(root, fname) for root, _, fnames in os.walk(path) for fname in fnames)
+    else:
+        fnames = [path]
+    for fname in fnames:
+        if fname != path:
+            digest.update(os.path.relpath(fname, path).encode())
+        with open(fname, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ArrayCache:
+    """ Directory storing collections of numpy arrays by key, e.g., results that take a long time to compute.
+
+    Each entry is stored in a .npz file named by its key. The cache is bounded by max_size, and the least recently used
+    entries are removed when storing a new entry makes the cache larger than max_size. Entries are written to a temporary
+    file first, so that other processes sharing the cache never read partially written entries.
+
+    Args:
+        cache_dir (str): directory of the cache, it is created if it does not exist
+        max_size (int): maximum size of the cache in bytes, if None the size is not bounded
+    """
+
+    file_hashes_fname = 'file_hashes.json'
+
+    def __init__(self, cache_dir, max_size=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        mkdirs(cache_dir)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.npz')
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        """ Returns dict of arrays stored under the key, or None if there is no entry for the key """
+        path = self._path(key)
+        try:
+            with numpy.load(path) as entry:
+                arrays = {name: entry[name] for name in entry.files}
+        except (OSError, ValueError):
+            return None
+        # mark entry as recently used
+        os.utime(path)
+        return arrays
+
+    def put(self, key, **arrays):
+        """ Stores the arrays under the key and removes the least recently used entries if needed """
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            numpy.savez(f, **arrays)
+        os.replace(tmp_path, path)
+        self.evict(keep=key)
+
+    def invalidate(self, key=None):
+        """ Removes the entry stored under the key, or all entries if key is None """
+        paths = glob.glob(os.path.join(self.cache_dir, '*.npz')) if key is None else [self._path(key)]
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def evict(self, keep=None):
+        """ Removes the least recently used entries until the cache is not larger than max_size
+
+        Args:
+            keep (str): key of an entry that is never removed
+        """
+        if self.max_size is None:
+            return
+        entries = []
+        for path in glob.glob(os.path.join(self.cache_dir, '*.npz')):
+            stat = os.stat(path)
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if keep is not None and path == self._path(keep):
+                continue
+            os.remove(path)
+            total_size -= size
+
+    def file_hash(self, path):
+        """ Returns :func:`hash_file` of the path, which is only computed again when the file or directory changes """
+        hashes_fname = os.path.join(self.cache_dir, self.file_hashes_fname)
+        try:
+            with open(hashes_fname) as f:
+                hashes = json.load(f)
+        except (OSError, ValueError):
+            hashes = {}
+        abs_path = os.path.abspath(path)
+        if os.path.isdir(path):
+            stats = [os.stat(os.path.join(root, fname)) for root, _, fnames in os.walk(path) for fname in fnames]
+        else:
+            stats = [os.stat(path)]
+        signature = [len(stats), sum(stat.st_size for stat in stats), max([stat.st_mtime_ns for stat in stats] or [0])]
+        if abs_path in hashes and hashes[abs_path][0] == signature:
+            return hashes[abs_path][1]
+        digest = hash_file(path)
+        hashes[abs_path] = [signature, digest]
+        tmp_fname = f'{hashes_fname}.{os.getpid()}.tmp'
+        with open(tmp_fname, 'w') as f:
+            json.dump(hashes, f)
+        os.replace(tmp_fname, hashes_fname)
+        return digest
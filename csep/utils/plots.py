@@ -2221,8 +2221,7 @@ def plot_concentration_ROC_diagram(forecast, catalog, linear=True, axes=None, pl
     else:
         fig, ax = pyplot.subplots(figsize=figsize)
 
-    # This part could be vectorized if optimizations become necessary
-    # Initialize array to store cell area in km^2
+    # Cell areas in km^2 are cached on the region
     area_km2 = catalog.region.get_cell_area()
     obs_counts = catalog.spatial_counts()
 
@@ -251,7 +251,7 @@ def get_Kagan_I1_score(forecasts, catalog):
     # Initialize array
     I_1 = numpy.zeros(n_forecast, dtype=numpy.float64)
 
-    # Compute cell areas
+    # Compute cell areas, these are cached on the region
     area_km2 = catalog.region.get_cell_area()
     total_area = numpy.sum(area_km2)
     
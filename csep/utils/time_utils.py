@@ -3,8 +3,15 @@ import datetime
 import re
 import os
 import warnings
+
+import numpy
+import pandas
+
 from csep.utils.constants import SECONDS_PER_ASTRONOMICAL_YEAR, SECONDS_PER_DAY
 
+# format='ISO8601' was added in pandas 2.0, older versions infer the format instead
+_PANDAS_HAS_ISO8601 = int(pandas.__version__.split('.')[0]) >= 2
+
 
 def epoch_time_to_utc_datetime(epoch_time_milli):
     """
@@ -75,6 +82,28 @@ def strptime_to_utc_epoch(time_string, format="%Y-%m-%d %H:%M:%S.%f"):
     dt = strptime_to_utc_datetime(time_string, format)
     return datetime_to_utc_epoch(dt)
 
+def strptime_array_to_utc_epoch(time_strings):
+    """ Converts an array of ISO 8601 time strings into epoch times in milliseconds.
+
+    This is the vectorized counterpart of :func:`strptime_to_utc_epoch` and is used when loading large files, such
+    as stochastic event sets. Fractional seconds are optional and the fields do not need to be zero-padded (e.g.,
+    '1992-01-01T0:0:0.0'). Epoch times are truncated to milliseconds the same way as :func:`datetime_to_utc_epoch`.
+
+    Args:
+        time_strings (array-like): ISO 8601 formatted time strings in UTC
+
+    Returns:
+        numpy.ndarray: epoch times in milliseconds with dtype int64
+    """
+    time_strings = pandas.Series(numpy.asarray(time_strings, dtype=object))
+    if _PANDAS_HAS_ISO8601:
+        dts = pandas.to_datetime(time_strings, format='ISO8601')
+    else:
+        dts = pandas.to_datetime(time_strings)
+    micros = dts.to_numpy(dtype='datetime64[us]').astype(numpy.int64)
+    # matches int(1000.0 * total_seconds) from datetime_to_utc_epoch
+    return numpy.trunc(1000.0 * (micros / 1e6)).astype(numpy.int64)
+
 def timedelta_from_years(time_in_years):
     """
     Returns python datetime.timedelta object based on the astronomical year in seconds.
@@ -1,6 +1,6 @@
 import unittest
 import numpy
-from csep.utils.calc import bin1d_vec, cleaner_range
+from csep.utils.calc import bin1d_vec, cleaner_range, LikelihoodEvaluator, _compute_likelihood
 
 
 class TestCleanerRange(unittest.TestCase):
@@ -149,3 +149,32 @@ class TestBin1d(unittest.TestCase):
         idx = bin1d_vec(4, mbins, tol=0.00001, right_continuous=True)
         self.assertEqual(idx, -1)
 
+
+class TestLikelihoodEvaluator(unittest.TestCase):
+
+    def setUp(self):
+        rng = numpy.random.default_rng(0)
+        self.rates = rng.gamma(0.5, 1.0, 50)
+        self.rates[[3, 7]] = 0
+        self.catalogs = [numpy.zeros(50) for _ in range(4)]
+        self.catalogs[0][[1, 2, 2, 10]] = [1, 2, 2, 1]
+        self.catalogs[1][[5, 20, 49]] = [1, 1, 3]
+        # catalog without events and catalog with events in cell without rates
+        self.catalogs[3][[3, 4]] = 1
+
+    def test_evaluate(self):
+        for n_obs, expected_cond_count in [(5, self.rates.sum()), (0, self.rates.sum()), (5, 0)]:
+            evaluator = LikelihoodEvaluator(self.rates, expected_cond_count, n_obs)
+            for gridded_cat in self.catalogs:
+                with numpy.errstate(divide='ignore'):
+                    expected = _compute_likelihood(gridded_cat, self.rates, expected_cond_count, n_obs)
+                numpy.testing.assert_array_equal(expected, evaluator.evaluate_gridded(gridded_cat))
+
+    def test_evaluate_batch(self):
+        evaluator = LikelihoodEvaluator(self.rates, self.rates.sum(), 5)
+        catalog_idx, cells = numpy.nonzero(numpy.array(self.catalogs))
+        counts = numpy.array(self.catalogs)[catalog_idx, cells]
+        likelihood, likelihood_norm = evaluator.evaluate_batch(catalog_idx, cells, counts, len(self.catalogs))
+        expected = numpy.array([evaluator.evaluate_gridded(gridded_cat) for gridded_cat in self.catalogs])
+        numpy.testing.assert_allclose(expected[:, 0], likelihood)
+        numpy.testing.assert_allclose(expected[:, 1], likelihood_norm)
@@ -8,7 +8,7 @@ import numpy
 import csep
 from csep.core import regions, forecasts
 from csep.utils.time_utils import strptime_to_utc_epoch, strptime_to_utc_datetime
-from csep.core.catalogs import CSEPCatalog, AbstractBaseCatalog
+from csep.core.catalogs import CSEPCatalog, AbstractBaseCatalog, CatalogFilter
 from csep.core.regions import CartesianGrid2D, compute_vertices
 from csep.models import Polygon
 
@@ -102,6 +102,47 @@ class CatalogFiltering(unittest.TestCase):
         filtered_test_cat = test_cat.filter(filters, in_place=False)
         numpy.testing.assert_equal(numpy.array([b'1', b'2'], dtype='S256').T, filtered_test_cat.get_event_ids())
 
+    def test_compiled_filter(self):
+        start_dt = strptime_to_utc_datetime('2009-07-01 00:00:00.0')
+        filters = [f'datetime >= {start_dt}', 'magnitude <= 3.0', 'depth  >  1.5']
+        compiled = CatalogFilter(filters)
+        # datetime literals are converted to epoch times when compiled
+        self.assertEqual(('origin_time', strptime_to_utc_epoch('2009-07-01 00:00:00.0')), compiled.predicates[0][::2])
+        numpy.testing.assert_array_equal([False, True, True], compiled(self.test_cat1.catalog))
+        # compiled filters are reused and give the same results as the statements
+        self.assertIs(compiled, CatalogFilter.compile(compiled))
+        expected = copy.deepcopy(self.test_cat1).filter(filters, in_place=False)
+        test_cat = copy.deepcopy(self.test_cat1).filter(compiled)
+        numpy.testing.assert_array_equal(expected.catalog, test_cat.catalog)
+        self.assertEqual(filters, test_cat.filters)
+        self.assertEqual(2.0, test_cat.min_magnitude)
+        with self.assertRaises(ValueError):
+            CatalogFilter('magnitude => 3.0')
+
+    def test_apply_mct(self):
+        m_main = 7.0
+        event_epoch = strptime_to_utc_epoch('2010-01-01 00:00:00.0')
+        day = 86400000
+        # critical time is about one day after the mainshock, mct is 3.25 after 0.1 days and 2.5 after one day
+        times = event_epoch + numpy.array([-day, 0, 0.1 * day, 0.1 * day, 0.5 * day, 2 * day, 0.1 * day]).astype(int)
+        mags = numpy.array([2.0, 6.0, 3.0, 3.5, 2.6, 2.0, 2.0])
+        events = numpy.zeros(len(times), dtype=CSEPCatalog.dtype)
+        events['origin_time'] = times
+        events['magnitude'] = mags
+        # events at the mainshock and below completeness are removed, checking stops after the critical time
+        expected = [True, False, False, True, False, True, True]
+        test_cat = CSEPCatalog(data=events.copy()).apply_mct(m_main, event_epoch)
+        numpy.testing.assert_array_equal(events[expected], test_cat.catalog)
+        self.assertEqual(2.0, test_cat.min_magnitude)
+        # catalogs in columnar form give the same results as filtering each catalog
+        catalogs = [events, events[:0], events[3:], events[::-1]]
+        offsets = numpy.cumsum([0] + [len(c) for c in catalogs])
+        filtered, filtered_offsets = CSEPCatalog.apply_mct_batch(numpy.concatenate(catalogs), offsets, m_main, event_epoch)
+        for i, c in enumerate(catalogs):
+            numpy.testing.assert_array_equal(CSEPCatalog(data=c.copy()).apply_mct(m_main, event_epoch).catalog,
+                                             filtered[filtered_offsets[i]:filtered_offsets[i + 1]])
+        self.assertEqual(len(filtered), filtered_offsets[-1])
+
     def test_filter_spatial(self):
 
         test_cat = copy.deepcopy(self.test_cat1)
@@ -205,5 +246,30 @@ class CatalogFiltering(unittest.TestCase):
         self.assertEqual(test_result[0], 1)
         self.assertEqual(test_result[9], 1)
 
+    def test_bin_spatial_magnitude_counts_skipped(self):
+        origins = list(itertools.product(numpy.arange(8) * 0.1, numpy.arange(10) * 0.1))
+        # grid is missing first and last block
+        origins.pop(0)
+        origins.pop(-1)
+        cart_grid = CartesianGrid2D([Polygon(bbox) for bbox in compute_vertices(origins, 0.1)], 0.1)
+        cart_grid.magnitudes = regions.magnitude_bins(2.5, 4.0, 0.1)
+        events = [(b'1', 0, 0.15, 0.05, 5.0, 2.55),
+                  (b'2', 0, 0.05, 0.15, 5.0, 2.65),
+                  (b'3', 0, 0.05, 0.15, 5.0, 2.05),
+                  (b'4', 0, 0.05, 0.05, 5.0, 2.55),
+                  (b'5', 0, -0.5, -0.5, 5.0, 2.55),
+                  (b'6', 0, 0.15, 0.05, 5.0, 2.55)]
+        catalog = CSEPCatalog(data=events, region=cart_grid)
+        with self.assertRaises(ValueError):
+            catalog.spatial_magnitude_counts()
+        counts, skipped = catalog.spatial_magnitude_counts(return_skipped=True)
+        self.assertEqual(3, numpy.sum(counts))
+        self.assertEqual(2, counts[0, 0])
+        self.assertEqual(1, counts[9, 1])
+        numpy.testing.assert_array_equal([b'3', b'4', b'5'], skipped['id'])
+        # same result as counting the events inside the region
+        inside = CSEPCatalog(data=numpy.delete(catalog.catalog, [2, 3, 4]), region=cart_grid)
+        numpy.testing.assert_array_equal(inside.spatial_magnitude_counts(), counts)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,96 @@
+import os
+import tempfile
+import unittest
+
+import numpy
+
+from csep.core import catalog_evaluations
+from csep.core.exceptions import CSEPEvaluationException
+from csep.core.catalogs import CSEPCatalog, CSEPBinaryCatalog
+from csep.core.forecasts import CatalogForecast
+from csep.core.regions import CartesianGrid2D, magnitude_bins
+
+
+def _random_catalog(rng, region, n_events, catalog_id=None):
+    """ Returns catalog with events uniformly distributed over the bounding box of the region """
+    origins = region.origins()
+    idx = rng.integers(0, len(origins), n_events)
+    lons = origins[idx, 0] + rng.uniform(0, region.dh, n_events)
+    lats = origins[idx, 1] + rng.uniform(0, region.dh, n_events)
+    mags = rng.choice(region.magnitudes, n_events) + 0.05
+    times = numpy.sort(rng.integers(0, 10 ** 9, n_events))
+    events = [(str(i).encode(), times[i], lats[i], lons[i], 10.0, mags[i]) for i in range(n_events)]
+    return CSEPCatalog(data=events, catalog_id=catalog_id, region=region)
+
+
+class TestRunCatalogEvaluations(unittest.TestCase):
+
+    def setUp(self):
+        rng = numpy.random.default_rng(1)
+        origins = numpy.array([[x, y] for x in numpy.arange(0, 1, 0.1) for y in numpy.arange(0, 1, 0.1)])
+        self.region = CartesianGrid2D.from_origins(origins, dh=0.1, magnitudes=magnitude_bins(4.0, 6.0, 0.1))
+        # some catalogs are empty to make sure that these are handled the same way as in the individual tests
+        self.catalogs = [_random_catalog(rng, self.region, n, catalog_id=i)
+                         for i, n in enumerate(rng.poisson(5, 50))]
+        self.observation = _random_catalog(rng, self.region, 6)
+
+    def _forecast(self):
+        return CatalogForecast(catalogs=self.catalogs, region=self.region, n_cat=len(self.catalogs), name='test')
+
+    def test_same_as_individual_tests(self):
+        results = catalog_evaluations.run_catalog_evaluations(self._forecast(), self.observation, verbose=False)
+        forecast = self._forecast()
+        expected = {
+            'number_test': catalog_evaluations.number_test(forecast, self.observation, verbose=False),
+            'spatial_test': catalog_evaluations.spatial_test(forecast, self.observation, verbose=False),
+            'magnitude_test': catalog_evaluations.magnitude_test(forecast, self.observation, verbose=False),
+            'pseudolikelihood_test': catalog_evaluations.pseudolikelihood_test(forecast, self.observation,
+                                                                               verbose=False)
+        }
+        self.assertEqual(list(catalog_evaluations.CATALOG_TESTS), list(results.keys()))
+        for name, result in results.items():
+            self.assertEqual(type(expected[name]), type(result))
+            numpy.testing.assert_array_equal(expected[name].test_distribution, result.test_distribution)
+            self.assertEqual(expected[name].observed_statistic, result.observed_statistic)
+            self.assertEqual(expected[name].quantile, result.quantile)
+            self.assertEqual(expected[name].status, result.status)
+
+    def test_number_test_indexed(self):
+        expected = catalog_evaluations.number_test(self._forecast(), self.observation, verbose=False)
+        with tempfile.TemporaryDirectory() as tempdir:
+            fname = os.path.join(tempdir, 'forecast.bin')
+            CSEPBinaryCatalog.write_catalogs(fname, self.catalogs)
+            forecast = CatalogForecast(filename=fname, loader=CSEPBinaryCatalog.load_catalogs, region=self.region,
+                                       name='test')
+            self.assertTrue(forecast.is_indexed)
+            result = catalog_evaluations.number_test(forecast, self.observation, verbose=False)
+        self.assertEqual(expected.test_distribution, result.test_distribution)
+        self.assertEqual(expected.quantile, result.quantile)
+
+    def test_expected_rates_computed_once(self):
+        forecast = self._forecast()
+        _ = catalog_evaluations.run_catalog_evaluations(forecast, self.observation, tests=['spatial_test'],
+                                                        verbose=False)
+        expected_rates = numpy.sum([cat.spatial_magnitude_counts() for cat in self.catalogs], axis=0) / 50
+        numpy.testing.assert_allclose(expected_rates, forecast.expected_rates.data)
+
+    def test_empty_observation(self):
+        empty = CSEPCatalog(data=[], region=self.region)
+        results = catalog_evaluations.run_catalog_evaluations(self._forecast(), empty, verbose=False)
+        self.assertEqual('not-valid', results['spatial_test'].status)
+        self.assertEqual('not-valid', results['magnitude_test'].status)
+        self.assertIsNone(results['pseudolikelihood_test'])
+
+    def test_unknown_test(self):
+        with self.assertRaises(CSEPEvaluationException):
+            catalog_evaluations.run_catalog_evaluations(self._forecast(), self.observation, tests=['w_test'])
+
+    def test_missing_region(self):
+        forecast = CatalogForecast(catalogs=self.catalogs, n_cat=len(self.catalogs), name='test')
+        for tests in [['magnitude_test'], ['spatial_test'], ['number_test', 'magnitude_test']]:
+            with self.assertRaises(CSEPEvaluationException):
+                catalog_evaluations.run_catalog_evaluations(forecast, self.observation, tests=tests, verbose=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,7 @@ import unittest
 
 import csep.core.poisson_evaluations as poisson
 import csep.core.binomial_evaluations as binary
+from csep.utils.stats import poisson_joint_log_likelihood_ndarray
 
 def get_datadir():
     root_dir = os.path.dirname(os.path.abspath(__file__))
@@ -73,6 +74,73 @@ class TestPoissonLikelihood(unittest.TestCase):
         # calculated by hand given the expected data, see explanation in zechar et al., 2010.
         numpy.testing.assert_allclose(simulated_ll[0], -7.178053830347945)
 
+    def test_likelihood_blocks(self):
+        forecast_data = numpy.random.default_rng(self.seed).gamma(0.5, 0.1, (50, 4))
+        observed_data = numpy.zeros((50, 4))
+        observed_data[[1, 4, 4, 20, 33], [0, 2, 2, 3, 1]] = [1, 1, 1, 2, 1]
+        random_matrix = numpy.random.default_rng(self.seed).random((25, 6))
+
+        # compare against simulating one catalog at a time
+        sampling_weights = numpy.cumsum(forecast_data.ravel()) / numpy.sum(forecast_data)
+        sim_fore = numpy.zeros(sampling_weights.shape)
+        expected_ll = []
+        for idx in range(25):
+            sim_fore = poisson._simulate_catalog(6, sampling_weights, sim_fore, random_numbers=random_matrix[idx, :])
+            target_idx = numpy.nonzero(sim_fore)
+            expected_ll.append(poisson_joint_log_likelihood_ndarray(numpy.log(forecast_data.ravel()[target_idx]) * sim_fore[target_idx],
+                                                                    sim_fore[target_idx], numpy.sum(forecast_data)))
+
+        for block_size in [1, 7, 25, 100]:
+            qs, obs_ll, simulated_ll = poisson._poisson_likelihood_test(forecast_data, observed_data, num_simulations=25,
+                                                                        random_numbers=random_matrix, verbose=False,
+                                                                        block_size=block_size)
+            numpy.testing.assert_allclose(simulated_ll, expected_ll)
+
+        # fixed seed gives the same results for any block size
+        results = [poisson._poisson_likelihood_test(forecast_data, observed_data, num_simulations=50, seed=self.seed,
+                                                    use_observed_counts=False, verbose=False, block_size=block_size)
+                   for block_size in [1, 16, 1000]]
+        for qs, obs_ll, simulated_ll in results[1:]:
+            self.assertEqual(qs, results[0][0])
+            numpy.testing.assert_array_equal(simulated_ll, results[0][2])
+
+    def test_likelihood_seed_regression(self):
+        forecast_data = numpy.random.default_rng(self.seed).gamma(0.5, 0.1, (50, 4))
+        observed_data = numpy.zeros((50, 4))
+        observed_data[[1, 4, 20, 33], [0, 2, 3, 1]] = 1
+        # values computed with pycsep 0.6.3, which simulated one catalog at a time
+        for use_observed_counts, expected_qs, expected_sum in [(False, 0.9433333333333334, -11323.766282445213),
+                                                              (True, 0.013333333333333334, -6014.20112987709)]:
+            for block_size in [1, 100]:
+                qs, obs_ll, simulated_ll = poisson._poisson_likelihood_test(forecast_data, observed_data,
+                                                                            num_simulations=300, seed=3,
+                                                                            use_observed_counts=use_observed_counts,
+                                                                            verbose=False, block_size=block_size)
+                self.assertAlmostEqual(qs, expected_qs)
+                numpy.testing.assert_allclose(obs_ll, -24.79086401693146)
+                numpy.testing.assert_allclose(numpy.sum(simulated_ll), expected_sum)
+
+    def test_likelihood_rng(self):
+        forecast_data = numpy.random.default_rng(self.seed).gamma(0.5, 0.1, (50, 4))
+        observed_data = numpy.zeros((50, 4))
+        observed_data[[1, 4, 20, 33], [0, 2, 3, 1]] = 1
+
+        # same results for any number of workers, and also when passing a seed sequence
+        results = [poisson._poisson_likelihood_test(forecast_data, observed_data, num_simulations=50, rng=rng,
+                                                    use_observed_counts=False, verbose=False, block_size=8,
+                                                    n_workers=n_workers)
+                   for rng, n_workers in [(1, None), (1, 2), (numpy.random.SeedSequence(1), 3)]]
+        for qs, obs_ll, simulated_ll in results[1:]:
+            self.assertEqual(qs, results[0][0])
+            numpy.testing.assert_array_equal(simulated_ll, results[0][2])
+
+        # different seeds give different streams, and the global random state is not used
+        numpy.random.seed(self.seed)
+        _, _, simulated_ll = poisson._poisson_likelihood_test(forecast_data, observed_data, num_simulations=50, rng=2,
+                                                              use_observed_counts=False, verbose=False, block_size=8)
+        self.assertFalse(numpy.array_equal(simulated_ll, results[0][2]))
+        numpy.testing.assert_allclose(numpy.random.rand(1, 4), self.random_matrix)
+
 
 class TestBinomialLikelihood(unittest.TestCase):
     def __init__(self, *args, **kwargs):
@@ -109,11 +177,76 @@ class TestBinomialLikelihood(unittest.TestCase):
         numpy.testing.assert_allclose(expected_catalog, sim_fore)
 
     def test_binomial_likelihood(self):
-        qs, bill, simulated_ll = binary._binary_likelihood_test(self.forecast_data,self.observed_data, num_simulations=1,seed=0, verbose=True)
+        # random numbers that activate the cells of the catalog [0, 0, 1, 1, 1, 1]
+        random_numbers = numpy.array([[0.5, 0.7, 0.85, 0.95]])
+        qs, bill, simulated_ll = binary._binary_likelihood_test(self.forecast_data,self.observed_data, num_simulations=1,
+                                                                random_numbers=random_numbers, verbose=True)
         numpy.testing.assert_allclose(bill, -6.7197988064)
         numpy.testing.assert_allclose(qs, 1)
         numpy.testing.assert_allclose(simulated_ll[0], -7.921741654647629)
 
+    def test_binomial_likelihood_seed(self):
+        # a seed spawns the same random streams as passing its seed sequence as rng
+        results = [binary._binary_likelihood_test(self.forecast_data, self.observed_data, num_simulations=30,
+                                                  verbose=False, block_size=7, **kwargs)
+                   for kwargs in [{'seed': 0}, {'rng': numpy.random.SeedSequence(0)}, {'seed': 0, 'n_workers': 2}]]
+        for qs, bill, simulated_ll in results[1:]:
+            self.assertEqual(qs, results[0][0])
+            numpy.testing.assert_array_equal(simulated_ll, results[0][2])
+
+    def test_binomial_likelihood_zero_rates(self):
+        # cells without rates are masked, they were sampled in previous versions because the masked cumsum was not
+        # normalized under the mask and the sampling weights were not sorted
+        forecast_data = numpy.array([[0.4, 0.0], [0.6, 0.0], [0.0, 1.0]])
+        observed_data = numpy.array([[0, 0], [1, 0], [0, 0]])
+        _, _, simulated_ll = binary._binary_likelihood_test(forecast_data, observed_data, num_simulations=1,
+                                                            random_numbers=numpy.array([[0.3]]), verbose=False)
+        expected = binary.binary_joint_log_likelihood_ndarray(numpy.ma.masked_equal(forecast_data, 0.0).data,
+                                                              observed_data)
+        numpy.testing.assert_allclose(simulated_ll[0], expected)
+        # seeded simulations only activate cells with rates
+        forecast_data = numpy.random.default_rng(self.seed).gamma(0.5, 0.1, (50, 4))
+        forecast_data[numpy.random.default_rng(1).random(forecast_data.shape) < 0.5] = 0
+        observed_data = numpy.zeros((50, 4))
+        observed_data[[1, 4, 20, 33], [0, 2, 3, 1]] = 1
+        _, _, simulated_ll = binary._binary_likelihood_test(forecast_data, observed_data, num_simulations=20, seed=3,
+                                                            verbose=False)
+        # the log-likelihood of catalogs with active cells without rates is -inf
+        self.assertTrue(numpy.all(numpy.isfinite(simulated_ll)))
+
+    def test_sample_active_cells(self):
+        weights = numpy.array([0.1, 0.0, 0.3, 0.4, 0.2, 0.0, 0.1])
+        cells = binary._sample_active_cells(numpy.random.default_rng(self.seed), weights, 4, 1000, max_keys=100)
+        self.assertEqual(cells.shape, (1000, 4))
+        # cells are distinct and never sampled from cells without rates
+        self.assertTrue(numpy.all(numpy.diff(numpy.sort(cells, axis=1), axis=1) > 0))
+        self.assertFalse(numpy.any(numpy.isin(cells, [1, 5])))
+        # every positive cell is active when all of them are requested
+        cells = binary._sample_active_cells(numpy.random.default_rng(self.seed), weights, 5, 10)
+        numpy.testing.assert_array_equal(numpy.sort(cells, axis=1), numpy.tile([0, 2, 3, 4, 6], (10, 1)))
+        with self.assertRaises(ValueError):
+            binary._sample_active_cells(numpy.random.default_rng(self.seed), weights, 6, 10)
+
+    def test_binomial_likelihood_batched(self):
+        # log-likelihoods of batched simulations are the same as computing them one catalog at a time
+        numpy.random.seed(self.seed)
+        cells = binary._sample_active_cells(numpy.random, self.forecast_data.ravel(), 4, 10)
+        numpy.random.seed(self.seed)
+        simulated_ll = binary._simulate_binary_log_likelihoods(numpy.random, 10, self.forecast_data, 4)
+        for idx in range(10):
+            sim_fore = numpy.zeros(self.forecast_data.size)
+            sim_fore[cells[idx]] = 1
+            numpy.testing.assert_allclose(simulated_ll[idx], binary.binary_joint_log_likelihood_ndarray(
+                self.forecast_data, sim_fore.reshape(self.forecast_data.shape)))
+
+    def test_binomial_likelihood_rng(self):
+        results = [binary._binary_likelihood_test(self.forecast_data, self.observed_data, num_simulations=20, rng=0,
+                                                  verbose=False, block_size=6, n_workers=n_workers)
+                   for n_workers in [None, 2]]
+        self.assertEqual(results[0][0], results[1][0])
+        numpy.testing.assert_array_equal(results[0][2], results[1][2])
+        self.assertEqual(len(results[0][2]), 20)
+
 
 if __name__ == '__main__':
     unittest.main()
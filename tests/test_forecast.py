@@ -1,7 +1,19 @@
+import datetime
+import gzip
 import os
+import pickle
+import shutil
+import tempfile
 import unittest
 import numpy
+import scipy.sparse
 from csep import load_catalog_forecast
+from csep.core.catalogs import CSEPCatalog, UCERF3Catalog, CSEPBinaryCatalog, UCERF3CatalogSet
+from csep.core.exceptions import CSEPIOException
+from csep.core.forecasts import CatalogForecast, GriddedDataSet, GriddedForecast
+from csep.core import binomial_evaluations, poisson_evaluations
+from csep.core.regions import CartesianGrid2D, magnitude_bins
+from csep.utils.file import ArrayCache
 
 
 def get_test_catalog_root():
@@ -73,5 +85,547 @@ class TestCatalogForecastCreation(unittest.TestCase):
         ec2 = [cat.event_count for cat in test_fore]
         numpy.testing.assert_array_equal(ec1, ec2)
 
+    def test_ascii_load_chunked(self):
+        """ Catalogs that span multiple chunks should be the same as when the file is read at once. """
+        lines = ['lon,lat,mag,time_string,depth,catalog_id,event_id',
+                 '-117.5,34.1,3.5,1992-06-28T11:57:34.140000,7.5,1,a',
+                 '-117.6,34.2,4.5,1992-06-29T0:0:0,8.0,1,b',
+                 '-117.7,34.3,2.5,1992-06-30T11:57:34.1,9.0,1,',
+                 ',,,,,2,',
+                 '-117.8,34.4,5.5,1992-07-01T11:57:34.14,6.0,4,c']
+        with tempfile.TemporaryDirectory() as tempdir:
+            fname = os.path.join(tempdir, 'chunked.csv')
+            with open(fname, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            expected = list(CSEPCatalog.load_ascii_catalogs(fname))
+            for chunk_size in [1, 2, 4]:
+                catalogs = list(CSEPCatalog.load_ascii_catalogs(fname, chunk_size=chunk_size))
+                self.assertEqual([cat.catalog_id for cat in expected], [cat.catalog_id for cat in catalogs])
+                for cat, expected_cat in zip(catalogs, expected):
+                    numpy.testing.assert_array_equal(expected_cat.catalog, cat.catalog)
+                    self.assertEqual(expected_cat.max_magnitude, cat.max_magnitude)
+                    self.assertEqual(expected_cat.end_time, cat.end_time)
+        self.assertEqual(list(range(5)), [cat.catalog_id for cat in expected])
+        self.assertEqual([0, 3, 0, 0, 1], [cat.event_count for cat in expected])
+        self.assertEqual(2.5, expected[1].min_magnitude)
+        self.assertEqual(709732654140, expected[1].get_epoch_times()[0])
+        self.assertEqual([b'a', b'b', b''], expected[1].get_event_ids().tolist())
+
+    def test_ascii_load_unordered(self):
+        lines = ['-117.5,34.1,3.5,1992-06-28T11:57:34.140000,7.5,1,1',
+                 '-117.5,34.1,3.5,1992-06-28T11:57:34.140000,7.5,0,2']
+        with tempfile.TemporaryDirectory() as tempdir:
+            fname = os.path.join(tempdir, 'unordered.csv')
+            with open(fname, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            with self.assertRaises(ValueError):
+                list(CSEPCatalog.load_ascii_catalogs(fname, chunk_size=1))
+
+    def test_ascii_load_attributes(self):
+        """ Catalogs are copied from a template, they should keep the kwargs but not share mutable attributes. """
+        fname = os.path.join(get_test_catalog_root(), 'all_present.csv')
+        catalogs = list(CSEPCatalog.load_ascii_catalogs(fname, name='landers', filters=['magnitude >= 3.5']))
+        self.assertTrue(all(cat.name == 'landers' for cat in catalogs))
+        self.assertTrue(all(cat.filters == ['magnitude >= 3.5'] for cat in catalogs))
+        catalogs[0].filters.append('depth < 10')
+        catalogs[0].metadata['source'] = 'test'
+        self.assertEqual(['magnitude >= 3.5'], catalogs[1].filters)
+        self.assertEqual({}, catalogs[1].metadata)
+        self.assertEqual(CSEPCatalog.dtype, catalogs[0].catalog.dtype)
+
+
+    def test_apply_filters(self):
+        fname = os.path.join(get_test_catalog_root(), 'all_present.csv')
+        expected = [cat.filter('magnitude >= 3.5', in_place=False).event_count for cat in load_catalog_forecast(fname)]
+        test_fore = load_catalog_forecast(fname, filters=['magnitude >= 3.5'], apply_filters=True)
+        compiled = test_fore.compiled_filters
+        self.assertEqual(expected, [cat.event_count for cat in test_fore])
+        # statements are compiled once, and again only if the filters change
+        self.assertIs(compiled, test_fore.compiled_filters)
+        test_fore.filters.append('magnitude < 4.0')
+        self.assertEqual(2, len(test_fore.compiled_filters.predicates))
+
+
+class TestCatalogForecastBinary(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.fname = os.path.join(self.tempdir.name, 'forecast.bin')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_convert_ascii(self):
+        ascii_fname = os.path.join(get_test_catalog_root(), 'some_empty.csv')
+        n_cat = CSEPBinaryCatalog.write_catalogs(self.fname, CSEPCatalog.load_ascii_catalogs(ascii_fname))
+        self.assertEqual(10, n_cat)
+        test_fore = load_catalog_forecast(self.fname, type='binary')
+        self.assertEqual(10, test_fore.n_cat)
+        expected = list(CSEPCatalog.load_ascii_catalogs(ascii_fname))
+        catalogs = list(test_fore)
+        self.assertEqual([cat.catalog_id for cat in expected], [cat.catalog_id for cat in catalogs])
+        for cat, expected_cat in zip(catalogs, expected):
+            self.assertEqual(expected_cat.event_count, cat.event_count)
+            numpy.testing.assert_array_equal(expected_cat.get_epoch_times(), cat.get_epoch_times())
+            numpy.testing.assert_array_equal(expected_cat.get_magnitudes(), cat.get_magnitudes())
+            numpy.testing.assert_array_equal(expected_cat.get_longitudes(), cat.get_longitudes())
+        numpy.testing.assert_array_equal(test_fore.get_event_counts(), test_fore.catalogs.get_event_counts())
+
+    def test_convert_ucerf3(self):
+        rng = numpy.random.default_rng(0)
+        u3_dtype = UCERF3Catalog._get_catalog_dtype(2)
+        u3_catalogs = []
+        for catalog_id, n_events in enumerate([3, 0, 5]):
+            events = numpy.zeros(n_events, dtype=u3_dtype)
+            events['origin_time'] = numpy.sort(rng.integers(0, 10 ** 12, n_events))
+            events['magnitude'] = rng.uniform(2.5, 7.0, n_events)
+            events['latitude'] = rng.uniform(32, 42, n_events)
+            events['longitude'] = rng.uniform(-125, -114, n_events)
+            u3_catalogs.append(UCERF3Catalog(data=events, catalog_id=catalog_id))
+        CSEPBinaryCatalog.write_catalogs(self.fname, u3_catalogs)
+        catalogs = CSEPBinaryCatalog.load_catalogs(self.fname)
+        self.assertEqual(3, len(catalogs))
+        for cat, expected_cat in zip(catalogs, u3_catalogs):
+            numpy.testing.assert_array_equal(expected_cat.get_magnitudes(), cat.get_magnitudes())
+            numpy.testing.assert_array_equal(expected_cat.get_epoch_times(), cat.get_epoch_times())
+        csep_catalog = catalogs[2].get_csep_format()
+        self.assertIsInstance(csep_catalog, CSEPCatalog)
+        numpy.testing.assert_array_equal(u3_catalogs[2].get_latitudes(), csep_catalog.get_latitudes())
+
+    def test_ucerf3_csep_format(self):
+        rng = numpy.random.default_rng(0)
+        events = numpy.zeros(4, dtype=UCERF3Catalog._get_catalog_dtype(2))
+        events['origin_time'] = numpy.sort(rng.integers(0, 10 ** 12, 4))
+        events['magnitude'] = rng.uniform(2.5, 7.0, 4)
+        events['depth'] = rng.uniform(0, 20, 4)
+        u3_catalog = UCERF3Catalog(data=events, catalog_id=3)
+        csep_catalog = u3_catalog.get_csep_format()
+        self.assertIsInstance(csep_catalog, CSEPCatalog)
+        self.assertEqual(CSEPCatalog.dtype, csep_catalog.catalog.dtype)
+        self.assertEqual([b'0', b'1', b'2', b'3'], csep_catalog.get_event_ids().tolist())
+        self.assertEqual(3, csep_catalog.catalog_id)
+        # events are not copied when asking for a view
+        view = u3_catalog.get_csep_format(copy=False)
+        self.assertTrue(numpy.shares_memory(events, view.catalog))
+        for name in CSEPBinaryCatalog.dtype.names:
+            numpy.testing.assert_array_equal(events[name], csep_catalog.catalog[name])
+            numpy.testing.assert_array_equal(events[name], view.catalog[name])
+        numpy.testing.assert_array_equal(numpy.arange(4), view.get_event_ids())
+        self.assertEqual(csep_catalog.max_magnitude, view.max_magnitude)
+
+    def test_random_access(self):
+        ascii_fname = os.path.join(get_test_catalog_root(), 'all_present.csv')
+        CSEPBinaryCatalog.write_catalogs(self.fname, CSEPCatalog.load_ascii_catalogs(ascii_fname))
+        test_fore = load_catalog_forecast(self.fname, type='binary')
+        catalog = test_fore[7]
+        self.assertEqual(7, catalog.catalog_id)
+        self.assertTrue(numpy.shares_memory(catalog.catalog, test_fore.catalogs.events))
+        subset = test_fore[2:8:2]
+        self.assertEqual(3, len(subset))
+        self.assertEqual([2, 4, 6], [cat.catalog_id for cat in subset])
+        self.assertEqual(9, test_fore[-1].catalog_id)
+
+    def test_summaries(self):
+        ascii_fname = os.path.join(get_test_catalog_root(), 'some_empty.csv')
+        CSEPBinaryCatalog.write_catalogs(self.fname, CSEPCatalog.load_ascii_catalogs(ascii_fname))
+        test_fore = load_catalog_forecast(self.fname, type='binary')
+        self.assertTrue(test_fore.is_indexed)
+        self.assertEqual(10, len(test_fore))
+        # summaries from the catalog set are the same as summarizing the loaded catalogs
+        expected = load_catalog_forecast(ascii_fname).get_summaries()
+        summaries = test_fore.get_summaries()
+        for name in summaries.dtype.names:
+            numpy.testing.assert_array_equal(expected[name], summaries[name])
+        numpy.testing.assert_array_equal(summaries['event_count'], test_fore.get_event_counts())
+        for cat, summary in zip(test_fore, summaries):
+            self.assertEqual(cat.event_count, summary['event_count'])
+            if cat.event_count > 0:
+                self.assertEqual((cat.min_magnitude, cat.max_magnitude),
+                                 (summary['min_magnitude'], summary['max_magnitude']))
+                numpy.testing.assert_array_equal(cat.get_bbox(), [summary['min_longitude'], summary['max_longitude'],
+                                                                  summary['min_latitude'], summary['max_latitude']])
+            else:
+                self.assertTrue(numpy.isnan(summary['max_latitude']))
+        # slices of the forecast are forecasts with a subset of the catalogs
+        subset = test_fore[3:]
+        self.assertIsInstance(subset, CatalogForecast)
+        self.assertEqual(7, len(subset))
+        numpy.testing.assert_array_equal(summaries['max_magnitude'][3:], subset.get_summaries()['max_magnitude'])
+        self.assertEqual(10, len(test_fore))
+        # summaries are computed while iterating, if catalogs are filtered
+        test_fore = load_catalog_forecast(self.fname, type='binary', filters=['magnitude >= 10'], apply_filters=True)
+        self.assertFalse(test_fore.is_indexed)
+        numpy.testing.assert_array_equal(numpy.zeros(10), test_fore.get_summaries()['event_count'])
+        self.assertEqual(0, test_fore[1].event_count)
+
+    def test_invalid_file(self):
+        ascii_fname = os.path.join(get_test_catalog_root(), 'all_present.csv')
+        with self.assertRaises(CSEPIOException):
+            CSEPBinaryCatalog.load_catalogs(ascii_fname)
+
+    def test_generator_not_indexable(self):
+        test_fore = load_catalog_forecast(os.path.join(get_test_catalog_root(), 'all_present.csv'), store=False)
+        with self.assertRaises(TypeError):
+            _ = test_fore[0]
+
+
+
+class TestCatalogForecastUCERF3(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.fname = os.path.join(self.tempdir.name, 'results_complete.bin')
+        rng = numpy.random.default_rng(4)
+        # catalogs using different file versions, including empty catalogs
+        self.catalogs = []
+        for catalog_id, n_events in enumerate([3, 0, 5, 2, 0]):
+            version = 2 if catalog_id % 2 else 3
+            events = numpy.zeros(n_events, dtype=UCERF3Catalog._get_catalog_dtype(version))
+            events['origin_time'] = numpy.sort(rng.integers(0, 10 ** 12, n_events))
+            events['magnitude'] = rng.uniform(2.5, 7.0, n_events)
+            self.catalogs.append((version, events))
+        with open(self.fname, 'wb') as f:
+            f.write(numpy.array([len(self.catalogs)], dtype='>i4').tobytes())
+            for version, events in self.catalogs:
+                header = numpy.zeros(1, dtype=UCERF3Catalog._get_header_dtype(version))
+                header['catalog_size'] = len(events)
+                f.write(numpy.array([version], dtype='>i2').tobytes() + header.tobytes() + events.tobytes())
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_random_access(self):
+        test_fore = load_catalog_forecast(self.fname, type='ucerf3')
+        self.assertEqual(5, test_fore.n_cat)
+        self.assertIsInstance(test_fore.catalogs, UCERF3CatalogSet)
+        for catalog_id in [2, 0, 4, 1]:
+            numpy.testing.assert_array_equal(self.catalogs[catalog_id][1], test_fore[catalog_id].catalog)
+            self.assertEqual(catalog_id, test_fore[catalog_id].catalog_id)
+        self.assertEqual([1, 3], [cat.catalog_id for cat in test_fore[1:4:2]])
+        numpy.testing.assert_array_equal([3, 0, 5, 2, 0], test_fore.catalogs.get_event_counts())
+        self.assertEqual([3, 0, 5, 2, 0], [cat.event_count for cat in test_fore])
+
+    def test_index_cache(self):
+        # the index is only written if requested
+        UCERF3Catalog.load_catalogs(self.fname)
+        self.assertFalse(os.path.exists(self.fname + UCERF3CatalogSet.index_suffix))
+        UCERF3Catalog.load_catalogs(self.fname, cache_index=True)
+        self.assertTrue(os.path.exists(self.fname + UCERF3CatalogSet.index_suffix))
+        catalog_set = UCERF3Catalog.load_catalogs(self.fname, cache_index=True)
+        numpy.testing.assert_array_equal([3, 0, 5, 2, 0], catalog_set.sizes)
+        # cached index is ignored once the file changes
+        with open(self.fname, 'r+b') as f:
+            f.write(numpy.array([2], dtype='>i4').tobytes())
+        os.utime(self.fname, ns=(0, 0))
+        self.assertEqual(2, len(UCERF3Catalog.load_catalogs(self.fname, cache_index=True)))
+
+    def test_index_cache_not_writable(self):
+        # the index cannot replace a directory
+        os.mkdir(self.fname + UCERF3CatalogSet.index_suffix)
+        with self.assertWarns(RuntimeWarning):
+            catalog_set = UCERF3Catalog.load_catalogs(self.fname, cache_index=True)
+        numpy.testing.assert_array_equal([3, 0, 5, 2, 0], catalog_set.sizes)
+
+    def test_summaries(self):
+        catalog_set = UCERF3Catalog.load_catalogs(self.fname, cache_index=True)
+        summaries = catalog_set[1:].get_summaries()
+        numpy.testing.assert_array_equal([0, 5, 2, 0], summaries['event_count'])
+        self.assertEqual(self.catalogs[2][1]['magnitude'].max(), summaries['max_magnitude'][1])
+        # summaries are stored with the cached index
+        cached = UCERF3Catalog.load_catalogs(self.fname, cache_index=True)._summaries['summaries'][1:]
+        numpy.testing.assert_array_equal(summaries['max_magnitude'], cached['max_magnitude'])
+
+    def test_shard(self):
+        catalog_set = UCERF3Catalog.load_catalogs(self.fname, cache_index=False)
+        self.assertFalse(os.path.exists(self.fname + UCERF3CatalogSet.index_suffix))
+        shards = [catalog_set.shard(i, 2) for i in range(2)]
+        self.assertEqual([[0, 1], [2, 3, 4]], [[cat.catalog_id for cat in shard] for shard in shards])
+        # shards can be sent to other processes without copying the file
+        shard = pickle.loads(pickle.dumps(shards[1]))
+        numpy.testing.assert_array_equal(self.catalogs[2][1], shard[0].catalog)
+        with self.assertRaises(ValueError):
+            catalog_set.shard(2, 2)
+
+    def test_compressed(self):
+        gz_fname = self.fname + '.gz'
+        with open(self.fname, 'rb') as infile, gzip.open(gz_fname, 'wb') as outfile:
+            shutil.copyfileobj(infile, outfile)
+        os.remove(self.fname)
+        catalogs = list(UCERF3Catalog.load_catalogs(gz_fname))
+        catalog_set = UCERF3Catalog.load_catalogs(gz_fname, decompress=True)
+        self.assertTrue(os.path.exists(self.fname))
+        self.assertEqual(5, len(catalogs))
+        for cat, (_, events) in zip(catalogs, self.catalogs):
+            numpy.testing.assert_array_equal(events, cat.catalog)
+        numpy.testing.assert_array_equal(self.catalogs[4][1], catalog_set[-1].catalog)
+
+
+class TestCatalogForecastExpectedRates(unittest.TestCase):
+
+    def setUp(self):
+        rng = numpy.random.default_rng(2)
+        origins = numpy.array([[x, y] for x in numpy.arange(0, 1, 0.1) for y in numpy.arange(0, 1, 0.1)])
+        self.region = CartesianGrid2D.from_origins(origins, dh=0.1, magnitudes=magnitude_bins(4.0, 6.0, 0.1))
+        self.catalogs = []
+        for catalog_id, n_events in enumerate(rng.poisson(5, 30)):
+            events = [(str(i).encode(), 1000 * i, rng.uniform(0, 1), rng.uniform(0, 1), 10.0, rng.uniform(4.0, 6.0))
+                      for i in range(n_events)]
+            self.catalogs.append(CSEPCatalog(data=events, catalog_id=catalog_id, region=self.region))
+
+    def test_parallel_stored(self):
+        expected = CatalogForecast(catalogs=self.catalogs, region=self.region, n_cat=30).get_expected_rates()
+        forecast = CatalogForecast(catalogs=self.catalogs, region=self.region, n_cat=30)
+        rates = forecast.get_expected_rates(n_workers=2, chunk_size=7)
+        numpy.testing.assert_array_equal(expected.data, rates.data)
+
+    def test_parallel_generator(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            fname = os.path.join(tempdir, 'forecast.csv')
+            for i, cat in enumerate(self.catalogs):
+                cat.write_ascii(fname, write_header=(i == 0), append=(i != 0))
+            expected = load_catalog_forecast(fname, region=self.region, store=False).get_expected_rates()
+            forecast = load_catalog_forecast(fname, region=self.region, store=False)
+            rates = forecast.get_expected_rates(n_workers=2, chunk_size=4)
+        numpy.testing.assert_array_equal(expected.data, rates.data)
+        self.assertEqual(30, forecast.n_cat)
+        numpy.testing.assert_array_equal([cat.event_count for cat in self.catalogs], forecast.get_event_counts())
+
+
+    def test_parallel_sharded(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            fname = os.path.join(tempdir, 'forecast.bin')
+            CSEPBinaryCatalog.write_catalogs(fname, self.catalogs)
+            kwargs = dict(region=self.region, type='binary', filters=['magnitude >= 4.5'], apply_filters=True)
+            expected = load_catalog_forecast(fname, **kwargs).get_expected_rates()
+            forecast = load_catalog_forecast(fname, **kwargs)
+            # catalog sets are pickled without their events
+            catalogs = pickle.loads(pickle.dumps(forecast.catalogs))
+            self.assertNotIn('events', catalogs.__getstate__())
+            numpy.testing.assert_array_equal(catalogs[3].get_magnitudes(), forecast.catalogs[3].get_magnitudes())
+            rates = forecast.get_expected_rates(n_workers=2, chunk_size=4)
+            event_counts = forecast.get_event_counts()
+        numpy.testing.assert_array_equal(expected.data, rates.data)
+        numpy.testing.assert_array_equal([numpy.sum(cat.get_magnitudes() >= 4.5) for cat in self.catalogs],
+                                         event_counts)
+
+
+class TestCatalogForecastCache(unittest.TestCase):
+
+    def setUp(self):
+        rng = numpy.random.default_rng(5)
+        origins = numpy.array([[x, y] for x in numpy.arange(0, 1, 0.1) for y in numpy.arange(0, 1, 0.1)])
+        self.region = CartesianGrid2D.from_origins(origins, dh=0.1, magnitudes=magnitude_bins(4.0, 6.0, 0.1))
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.fname = os.path.join(self.tempdir.name, 'forecast.csv')
+        self.cache_dir = os.path.join(self.tempdir.name, 'cache')
+        for catalog_id, n_events in enumerate(rng.poisson(5, 20)):
+            events = [(str(i).encode(), 1000 * i, rng.uniform(0, 1), rng.uniform(0, 1), 10.0, rng.uniform(4.0, 6.0))
+                      for i in range(n_events)]
+            CSEPCatalog(data=events, catalog_id=catalog_id).write_ascii(self.fname, write_header=(catalog_id == 0),
+                                                                         append=(catalog_id != 0))
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_cached_expected_rates(self):
+        expected = load_catalog_forecast(self.fname, region=self.region)
+        rates = load_catalog_forecast(self.fname, region=self.region, cache=self.cache_dir).get_expected_rates()
+        numpy.testing.assert_array_equal(expected.get_expected_rates().data, rates.data)
+        # new forecast reads expected rates and event counts from the cache without iterating through the catalogs
+        forecast = load_catalog_forecast(self.fname, region=self.region, cache=self.cache_dir)
+        numpy.testing.assert_array_equal(rates.data, forecast.get_expected_rates().data)
+        numpy.testing.assert_array_equal(expected.get_event_counts(), forecast.get_event_counts())
+        self.assertEqual(20, forecast.n_cat)
+        self.assertEqual(0, forecast._idx)
+        # filters change the cache key
+        filtered = load_catalog_forecast(self.fname, region=self.region, cache=self.cache_dir,
+                                         filters=['magnitude >= 5.0'], apply_filters=True)
+        self.assertLess(filtered.get_expected_rates().data.sum(), rates.data.sum())
+        self.assertEqual(2, len(os.listdir(self.cache_dir)) - 1)
+        filtered.invalidate_cache()
+        self.assertEqual(1, len(os.listdir(self.cache_dir)) - 1)
+        # contents of the forecast file are part of the key
+        with open(self.fname, 'a') as f:
+            f.write('0.5,0.5,5.0,1970-01-01T00:00:00.0,10.0,20,0\n')
+        forecast = load_catalog_forecast(self.fname, region=self.region, cache=self.cache_dir)
+        self.assertEqual(21, len(forecast.get_event_counts(verbose=False)))
+
+    def test_eviction(self):
+        cache = ArrayCache(self.cache_dir, max_size=2500)
+        for key in ['a', 'b', 'c']:
+            cache.put(key, data=numpy.zeros(100))
+        # least recently used entry is removed
+        self.assertNotIn('a', cache)
+        numpy.testing.assert_array_equal(numpy.zeros(100), cache.get('b')['data'])
+        os.utime(os.path.join(self.cache_dir, 'b.npz'), ns=(0, 0))
+        cache.put('d', data=numpy.zeros(100))
+        self.assertEqual([False, True, True], ['b' in cache, 'c' in cache, 'd' in cache])
+        self.assertIsNone(cache.get('b'))
+        cache.invalidate()
+        self.assertNotIn('c', cache)
+
+
+class TestGriddedForecastSparse(unittest.TestCase):
+
+    def setUp(self):
+        rng = numpy.random.default_rng(3)
+        origins = numpy.array([[x, y] for x in numpy.arange(0, 2, 0.1) for y in numpy.arange(0, 2, 0.1)])
+        self.region = CartesianGrid2D.from_origins(origins, dh=0.1, magnitudes=magnitude_bins(4.0, 6.0, 0.1))
+        data = rng.gamma(0.5, 0.01, (len(origins), len(self.region.magnitudes)))
+        data[rng.random(data.shape) < 0.95] = 0
+        self.dense = self._forecast(data)
+        self.sparse = self._forecast(scipy.sparse.csr_matrix(data))
+        # target events are located in bins with rates
+        target_idx = rng.choice(numpy.flatnonzero(data), 8, replace=False)
+        cell_idx, mag_idx = numpy.unravel_index(target_idx, data.shape)
+        events = [(str(i).encode(), 1000 * i, origins[cell, 1] + 0.05, origins[cell, 0] + 0.05, 10.0,
+                   self.region.magnitudes[mag] + 0.05) for i, (cell, mag) in enumerate(zip(cell_idx, mag_idx))]
+        self.catalog = CSEPCatalog(data=events, region=self.dense.region)
+
+    def _forecast(self, data):
+        return GriddedForecast(datetime.datetime(2020, 1, 1), datetime.datetime(2021, 1, 1), data=data,
+                               region=self.region, magnitudes=self.region.magnitudes)
+
+    def test_counts(self):
+        self.assertTrue(self.sparse.is_sparse)
+        self.assertIsInstance(self.sparse.data, scipy.sparse.csr_array)
+        self.assertFalse(self.dense.is_sparse)
+        numpy.testing.assert_allclose(self.dense.sum(), self.sparse.sum())
+        numpy.testing.assert_allclose(self.dense.spatial_counts(), self.sparse.spatial_counts())
+        numpy.testing.assert_allclose(self.dense.magnitude_counts(), self.sparse.magnitude_counts())
+        numpy.testing.assert_allclose(self.dense.spatial_counts(cartesian=True),
+                                      self.sparse.spatial_counts(cartesian=True))
+        # the base class puts the spatial vector of the data on the grid
+        dense = GriddedDataSet(data=self.dense.data, region=self.region)
+        sparse = GriddedDataSet(data=self.sparse.data, region=self.region)
+        numpy.testing.assert_allclose(dense.spatial_counts(cartesian=True), sparse.spatial_counts(cartesian=True))
+        numpy.testing.assert_allclose(sparse.spatial_counts(cartesian=True), self.dense.spatial_counts(cartesian=True))
+        self.dense.scale(0.5)
+        self.sparse.scale(0.5)
+        numpy.testing.assert_allclose(self.dense.data, self.sparse.data.toarray())
+
+    def test_target_event_rates(self):
+        for scale in [False, True]:
+            dense_rates, dense_n_fore = self.dense.target_event_rates(self.catalog, scale=scale)
+            sparse_rates, sparse_n_fore = self.sparse.target_event_rates(self.catalog, scale=scale)
+            numpy.testing.assert_allclose(dense_rates, sparse_rates)
+            numpy.testing.assert_allclose(dense_n_fore, sparse_n_fore)
+            self.assertTrue(numpy.all(sparse_rates > 0))
+
+    def test_seeded_workers(self):
+        # the number of workers does not change the results for a seed
+        for test in [poisson_evaluations.spatial_test, poisson_evaluations.likelihood_test,
+                     binomial_evaluations.binary_spatial_test]:
+            expected = test(self.dense, self.catalog, num_simulations=200, seed=7, n_workers=1)
+            result = test(self.dense, self.catalog, num_simulations=200, seed=7, n_workers=3)
+            self.assertEqual(expected.quantile, result.quantile)
+            numpy.testing.assert_array_equal(expected.test_distribution, result.test_distribution)
+
+    def test_likelihood_tests(self):
+        for test in [poisson_evaluations.likelihood_test, poisson_evaluations.conditional_likelihood_test]:
+            for kwargs in [{'seed': 1}, {'rng': 1}]:
+                expected = test(self.dense, self.catalog, num_simulations=200, **kwargs)
+                result = test(self.sparse, self.catalog, num_simulations=200, **kwargs)
+                self.assertEqual(expected.quantile, result.quantile)
+                numpy.testing.assert_allclose(expected.observed_statistic, result.observed_statistic)
+                numpy.testing.assert_allclose(expected.test_distribution, result.test_distribution)
+
+    def test_likelihood_zero_rate(self):
+        observed = numpy.zeros(self.dense.data.shape)
+        observed.ravel()[numpy.flatnonzero(self.dense.data == 0)[:2]] = 1
+        with numpy.errstate(divide='ignore'):
+            expected = poisson_evaluations._poisson_likelihood_test(self.dense.data, observed, num_simulations=10,
+                                                                    seed=0, verbose=False)
+        result = poisson_evaluations._poisson_likelihood_test(self.sparse.data, observed, num_simulations=10, seed=0,
+                                                              verbose=False)
+        self.assertEqual(-numpy.inf, expected[1])
+        self.assertEqual(-numpy.inf, result[1])
+        numpy.testing.assert_allclose(expected[2], result[2])
+
+
+class TestGriddedForecastDataView(unittest.TestCase):
+
+    def setUp(self):
+        origins = numpy.array([[x, y] for x in numpy.arange(0, 1, 0.1) for y in numpy.arange(0, 1, 0.1)])
+        region = CartesianGrid2D.from_origins(origins, dh=0.1, magnitudes=magnitude_bins(4.0, 6.0, 0.5))
+        self.data = numpy.random.default_rng(4).gamma(0.5, 0.01, (len(origins), len(region.magnitudes)))
+        self.forecast = GriddedForecast(datetime.datetime(2020, 1, 1), datetime.datetime(2021, 1, 1), data=self.data,
+                                        region=region, magnitudes=region.magnitudes)
+
+    def test_no_copy(self):
+        self.assertIs(self.forecast.data_view.materialize(copy=False), self.data)
+        self.assertIsNot(self.forecast.data, self.data)
+        numpy.testing.assert_array_equal(self.forecast.data, self.data)
+
+    def test_scaled(self):
+        for scale in [0.25, numpy.linspace(0.5, 1.5, self.data.shape[1])]:
+            self.forecast.scale(scale)
+            expected = self.data * scale
+            view = self.forecast.data_view
+            numpy.testing.assert_array_equal(self.forecast.data, expected)
+            numpy.testing.assert_array_equal(numpy.asarray(view), expected)
+            numpy.testing.assert_array_equal(view[[1, 5, 7], [0, 2, 1]], expected[[1, 5, 7], [0, 2, 1]])
+            numpy.testing.assert_allclose(self.forecast.sum(), numpy.sum(expected))
+            numpy.testing.assert_allclose(self.forecast.spatial_counts(), numpy.sum(expected, axis=1))
+            numpy.testing.assert_allclose(self.forecast.magnitude_counts(), numpy.sum(expected, axis=0))
+            # scaled data are not modified by the view
+            numpy.testing.assert_array_equal(self.forecast.data_view.materialize(copy=False), expected)
+
+
+class TestGriddedForecastAscii(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.origins = numpy.array([[x, y] for x in numpy.arange(-120, -119.75, 0.1) for y in numpy.arange(34, 34.35, 0.1)])
+        self.mws = magnitude_bins(4.95, 5.25, 0.1)
+        self.flags = numpy.ones(len(self.origins))
+        self.flags[2] = 0
+        self.rates = numpy.random.default_rng(5).gamma(0.5, 0.01, (len(self.origins), len(self.mws)))
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def _write(self, fname, swap_latlon=False, order='C'):
+        rows = []
+        for i, (lon, lat) in enumerate(self.origins):
+            cell = [lat, lat + 0.1, lon, lon + 0.1] if swap_latlon else [lon, lon + 0.1, lat, lat + 0.1]
+            rows.append([cell + [0, 30, mw, mw + 0.1, self.rates[i, j], self.flags[i]] for j, mw in enumerate(self.mws)])
+        rows = numpy.array(rows)
+        rows = rows.transpose(1, 0, 2) if order == 'F' else rows
+        fname = os.path.join(self.tempdir.name, fname)
+        numpy.savetxt(fname, rows.reshape(-1, 10), fmt='%.4f %.4f %.4f %.4f %d %d %.2f %.2f %.10e %d')
+        return fname
+
+    def _check(self, forecast):
+        region = forecast.region
+        numpy.testing.assert_allclose(region.origins(), self.origins)
+        numpy.testing.assert_allclose(forecast.magnitudes, self.mws)
+        numpy.testing.assert_allclose(forecast.data, self.rates, rtol=1e-9)
+        numpy.testing.assert_array_equal(region.poly_mask, self.flags)
+        self.assertAlmostEqual(region.dh, 0.1)
+        # masked cells are not part of the valid region
+        self.assertEqual(region.bbox_mask.sum(), 1)
+        with self.assertRaises(ValueError):
+            region.get_index_of([self.origins[2, 0] + 0.05], [self.origins[2, 1] + 0.05])
+        self.assertEqual(region.get_index_of([self.origins[3, 0] + 0.05], [self.origins[3, 1] + 0.05])[0], 3)
+
+    def test_load_ascii(self):
+        forecast = GriddedForecast.load_ascii(self._write('model.dat'))
+        self.assertEqual(forecast.name, 'model')
+        self._check(forecast)
+
+    def test_load_ascii_swap_latlon(self):
+        self._check(GriddedForecast.load_ascii(self._write('model.dat', swap_latlon=True), swap_latlon=True))
+
+    def test_load_ascii_sparse(self):
+        forecast = GriddedForecast.load_ascii(self._write('model.dat'), sparse=True)
+        self.assertTrue(forecast.is_sparse)
+        numpy.testing.assert_allclose(forecast.data.toarray(), self.rates, rtol=1e-9)
+
+    def test_load_ascii_unordered(self):
+        with self.assertRaises(ValueError):
+            GriddedForecast.load_ascii(self._write('model.dat', order='F'))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,7 +1,9 @@
 import unittest
 import itertools
+import pickle
 import pytest
 
+import mercantile
 import numpy
 
 from csep.core.regions import (
@@ -11,11 +13,14 @@ from csep.core.regions import (
     _bin_catalog_spatio_magnitude_counts,
     _bin_catalog_spatial_counts,
     _bin_catalog_probability,
+    _bin_counts,
     quadtree_grid_bounds,
+    _quadkeys_to_tiles,
     california_relm_region,
     geographical_area_from_bounds
 )
 
+from csep.core.catalogs import CSEPCatalog
 from csep.models import Polygon
 
 
@@ -134,6 +139,69 @@ class TestCartesian2D(unittest.TestCase):
     def test_to_from_dict(self):
         self.assertEqual(self.cart_grid, CartesianGrid2D.from_dict(self.cart_grid.to_dict()))
 
+    def test_from_origins(self):
+        grid = CartesianGrid2D.from_origins(numpy.array(self.origins), dh=self.dh)
+        # polygons are only created when accessed
+        self.assertIsNone(grid._polygons)
+        numpy.testing.assert_array_equal(grid.origins(), self.cart_grid.origins())
+        numpy.testing.assert_array_equal(grid.bbox_mask, self.cart_grid.bbox_mask)
+        numpy.testing.assert_array_equal(grid.idx_map, self.cart_grid.idx_map)
+        numpy.testing.assert_allclose(grid.midpoints(), numpy.array(self.origins) + self.dh / 2)
+        # origins are returned as a copy, the region itself is read-only
+        origins = grid.origins()
+        origins[0, 0] = 1.0
+        self.assertEqual(self.origins[0][0], grid.origins()[0, 0])
+        with pytest.raises(ValueError):
+            grid._origins[0, 0] = 1.0
+        self.assertEqual([poly.points for poly in grid.get_location_of([3, 5])],
+                         [self.cart_grid.polygons[3].points, self.cart_grid.polygons[5].points])
+        self.assertIsNone(grid._polygons)
+        self.assertEqual([poly.points for poly in grid.polygons], [poly.points for poly in self.cart_grid.polygons])
+        # lazily created polygons are not pickled
+        unpickled = pickle.loads(pickle.dumps(grid))
+        self.assertIsNone(unpickled._polygons)
+        self.assertEqual(grid, unpickled)
+
+    def test_get_cartesian(self):
+        data = numpy.arange(self.num_nodes, dtype=float)
+        expected = numpy.full((self.ny, self.nx), numpy.nan)
+        for idx, (x, y) in enumerate(self.origins):
+            expected[int(round(y / self.dh)), int(round(x / self.dh))] = idx
+        numpy.testing.assert_array_equal(self.cart_grid.get_cartesian(data), expected)
+
+    def test_get_cell_area(self):
+        expected = [geographical_area_from_bounds(x, y, x + self.dh, y + self.dh) for x, y in self.origins]
+        area = self.cart_grid.get_cell_area()
+        numpy.testing.assert_allclose(area, expected, rtol=1e-12)
+        # areas are cached on the region
+        self.assertIs(self.cart_grid.get_cell_area(), area)
+        self.cart_grid.dh = 2 * self.dh
+        self.assertIsNot(self.cart_grid.get_cell_area(), area)
+
+    def test_tight_bbox(self):
+        expected = [[0.1, 0.0], [0.8, 0.0], [0.8, 0.9], [0.7, 0.9], [0.7, 1.0], [0.0, 1.0], [0.0, 0.1], [0.1, 0.1],
+                    [0.1, 0.0]]
+        numpy.testing.assert_allclose(self.cart_grid.tight_bbox(), expected)
+
+    def test_fingerprint(self):
+        grid = CartesianGrid2D.from_origins(numpy.array(self.origins), dh=self.dh, name='other')
+        # names are not part of the fingerprint, but regions with different names are not equal
+        self.assertEqual(self.cart_grid.fingerprint, grid.fingerprint)
+        self.assertNotEqual(self.cart_grid, grid)
+        self.assertEqual(len({self.cart_grid: 1, grid: 2}), 2)
+        grid.name = self.cart_grid.name
+        self.assertEqual(self.cart_grid, grid)
+        self.assertEqual(len({self.cart_grid: 1, grid: 2}), 1)
+        fingerprint = grid.fingerprint
+        grid.magnitudes = numpy.array([5.0, 5.1])
+        self.assertNotEqual(fingerprint, grid.fingerprint)
+        self.assertNotEqual(self.cart_grid, grid)
+        masked = CartesianGrid2D.from_origins(numpy.array(self.origins), dh=self.dh, mask=numpy.ones(self.num_nodes),
+                                              magnitudes=numpy.array([5.0, 5.1]))
+        self.assertNotEqual(grid, masked)
+        self.assertEqual(masked, CartesianGrid2D.from_dict(masked.to_dict()))
+        self.assertNotEqual(self.cart_grid, None)
+
 class TestCatalogBinning(unittest.TestCase):
 
     def setUp(self):
@@ -225,7 +293,7 @@ class TestCatalogBinning(unittest.TestCase):
         mags = numpy.array([2.55, 2.65, 2.55, 2.05, 2.0])
 
         # expected bins None, (0, 1), (9, 0), None, None
-        test_result, _ = _bin_catalog_spatio_magnitude_counts(lons, lats, mags,
+        test_result, skipped = _bin_catalog_spatio_magnitude_counts(lons, lats, mags,
                                                               self.cart_grid.num_nodes,
                                                               self.cart_grid.bbox_mask,
                                                               self.cart_grid.idx_map,
@@ -240,6 +308,19 @@ class TestCatalogBinning(unittest.TestCase):
         self.assertEqual(test_result[0, 1], 1)
         self.assertEqual(test_result[9, 0], 1)
 
+        # skipped events are returned as (lon, lat, mag)
+        numpy.testing.assert_array_equal(skipped, [[0.05, 0.05, 2.55], [0.15, 0.05, 2.05], [-0.5, -0.5, 2.0]])
+
+    def test_bin_counts(self):
+        """ scattering few events and counting many events should give the same result """
+        rng = numpy.random.default_rng(0)
+        for n_events in [0, 10, 10000]:
+            idx = rng.integers(0, 1000, n_events)
+            expected = numpy.zeros(1000)
+            for i in idx:
+                expected[i] += 1
+            numpy.testing.assert_array_equal(expected, _bin_counts(idx, 1000))
+
     def test_binning_using_bounds(self):
         """ Tests whether point correctly fall within the bin edges.
 
@@ -314,12 +395,104 @@ class TestQuadtreeGrid2D(unittest.TestCase):
         qk_cell = '12222'
         numpy.testing.assert_array_equal(self.grid.quadkeys[self.grid.get_index_of(lon, lat)], qk_cell)
 
+    def test_get_index_brute_force(self):
+        grid = QuadtreeGrid2D.from_quadkeys(['0', '10', '11', '12', '130', '131', '132', '133', '2', '3'])
+        rng = numpy.random.default_rng(1)
+        lons = numpy.concatenate([rng.uniform(-180, 180, 500), [0, 90, 45, -180, 180, 0]])
+        lats = numpy.concatenate([rng.uniform(-89, 89, 500), [0, 0, 66.51326044311186, 0, 0, 85.06]])
+        expected = [grid._find_location(lon, lat) for lon, lat in zip(lons, lats)]
+        expected_masked = numpy.array([numpy.size(idx) == 0 for idx in expected])
+        numpy.testing.assert_array_equal(grid.get_masked(lons, lats), expected_masked)
+        numpy.testing.assert_array_equal(grid.get_index_of(lons, lats),
+                                         [idx for idx, masked in zip(expected, expected_masked) if not masked])
+
+    def test_single_resolution(self):
+        grid = QuadtreeGrid2D.from_single_resolution(3)
+        quadkeys = [''.join(digits) for digits in itertools.product('0123', repeat=3)]
+        numpy.testing.assert_array_equal(grid.quadkeys, quadkeys)
+        expected = [list(mercantile.bounds(mercantile.quadkey_to_tile(qk))) for qk in quadkeys]
+        numpy.testing.assert_array_equal(grid.bounds, expected)
+        self.assertIsNone(grid._polygons)
+        self.assertEqual(grid.polygons[5].points, grid.get_location_of([5])[0].points)
+
+    def test_from_catalog(self):
+        rng = numpy.random.default_rng(2)
+        lons = numpy.concatenate([rng.normal(-118, 1, 500), rng.uniform(-180, 180, 100), [0, 180, 90]])
+        lats = numpy.concatenate([rng.normal(35, 1, 500), rng.uniform(-90, 90, 100), [0, 0, 66.51326044311186]])
+        catalog = CSEPCatalog(data=[(str(i).encode(), 0, lat, lon, 10.0, 5.0) for i, (lon, lat) in enumerate(zip(lons, lats))])
+
+        def divide(quadkey, threshold, zoom, keys):
+            west, south, east, north = quadtree_grid_bounds([quadkey])[0]
+            count = numpy.count_nonzero((lons >= west) & (lats >= south) & (lons < east) & (lats < north))
+            if count > threshold and len(quadkey) < zoom:
+                for digit in '0123':
+                    divide(quadkey + digit, threshold, zoom, keys)
+            else:
+                keys.append(quadkey)
+
+        for threshold, zoom in [(10, 9), (50, 4), (1000, 5)]:
+            expected = []
+            for quadkey in '0123':
+                divide(quadkey, threshold, zoom, expected)
+            grid = QuadtreeGrid2D.from_catalog(catalog, threshold, zoom=zoom)
+            numpy.testing.assert_array_equal(grid.quadkeys, expected)
+
+    def test_from_catalogs_weighted(self):
+        rng = numpy.random.default_rng(3)
+        catalogs = []
+        for n_events in [300, 200]:
+            lons, lats = rng.normal(-118, 1, n_events), rng.normal(35, 1, n_events)
+            catalogs.append(CSEPCatalog(data=[(str(i).encode(), 0, lat, lon, 10.0, 5.0)
+                                              for i, (lon, lat) in enumerate(zip(lons, lats))]))
+        combined = CSEPCatalog(data=numpy.concatenate([cat.catalog for cat in catalogs]))
+        expected = QuadtreeGrid2D.from_catalog(combined, 10, zoom=9)
+        self.assertEqual(expected, QuadtreeGrid2D.from_catalog(catalogs, 10, zoom=9))
+        self.assertEqual(expected, QuadtreeGrid2D.from_catalog(combined, 5, zoom=9, weights=numpy.full(500, 0.5)))
+        self.assertEqual(expected, QuadtreeGrid2D.from_catalog(catalogs, 5, zoom=9, weights=[0.5, 0.5]))
+        # events with zero weight are not counted
+        weighted = QuadtreeGrid2D.from_catalog(catalogs, 10, zoom=9, weights=[numpy.ones(300), 0.0])
+        self.assertEqual(QuadtreeGrid2D.from_catalog(catalogs[0], 10, zoom=9), weighted)
+
+    def test_quadkeys_to_tiles(self):
+        quadkeys = ['', '3', '0123', '3210', '2', '1302']
+        x, y, zoom = _quadkeys_to_tiles(quadkeys)
+        expected = numpy.array([mercantile.quadkey_to_tile(qk) for qk in quadkeys])
+        numpy.testing.assert_array_equal(numpy.column_stack((x, y, zoom)), expected)
+
+    def test_get_cell_area(self):
+        expected = [geographical_area_from_bounds(*bounds) for bounds in self.grid.bounds]
+        area = self.grid.get_cell_area()
+        numpy.testing.assert_allclose(area, expected, rtol=1e-12)
+        self.assertIs(self.grid.get_cell_area(), area)
+        self.assertIs(self.grid.cell_area, area)
+
+    def test_get_cartesian(self):
+        grid = QuadtreeGrid2D.from_quadkeys(['0', '10', '13', '2'])
+        numpy.testing.assert_array_equal(grid.get_cartesian(numpy.arange(4.0)),
+                                         [[3, numpy.nan, numpy.nan], [0, numpy.nan, 2], [0, 1, numpy.nan]])
+        numpy.testing.assert_array_equal(grid.xs, [-180, 0, 90])
+        # cells touching at a corner are traced as separate rings
+        lat = 66.5133
+        expected = [[-180, -85.0511], [0, -85.0511], [0, lat], [90, lat], [90, 85.0511], [-180, 85.0511],
+                    [-180, -85.0511], [numpy.nan, numpy.nan], [90, 0], [180, 0], [180, lat], [90, lat], [90, 0]]
+        numpy.testing.assert_array_equal(grid.tight_bbox(), expected)
+
+    def test_fingerprint(self):
+        grid = QuadtreeGrid2D.from_single_resolution(self.zoom, magnitudes=self.mbins)
+        self.assertEqual(self.grid, grid)
+        self.assertEqual(hash(self.grid), hash(grid))
+        self.assertNotEqual(self.grid, QuadtreeGrid2D.from_single_resolution(self.zoom - 1, magnitudes=self.mbins))
+        grid.magnitudes = self.mbins[1:]
+        self.assertNotEqual(self.grid, grid)
+
 
 def test_geographical_area_from_bounds():
     area_globe = 510064471.90978825
     area_equator = 12363.6839902611
     numpy.testing.assert_array_equal(geographical_area_from_bounds(-180,-90, 180, 90), area_globe)
     numpy.testing.assert_array_equal(geographical_area_from_bounds(0,0,1,1), area_equator)
+    numpy.testing.assert_array_equal(geographical_area_from_bounds([-180, 0, 0], [-90, 0, 1], [180, 1, 1], [90, 1, 1]),
+                                     [area_globe, area_equator, 0])
 
 
 if __name__ == '__main__':
@@ -1,7 +1,8 @@
 import datetime
 from unittest import TestCase
 from csep.utils.time_utils import strptime_to_utc_datetime, datetime_to_utc_epoch, strptime_to_utc_epoch, \
-    epoch_time_to_utc_datetime, decimal_year_to_utc_datetime, decimal_year, decimal_year_to_utc_epoch
+    epoch_time_to_utc_datetime, decimal_year_to_utc_datetime, decimal_year, decimal_year_to_utc_epoch, \
+    strptime_array_to_utc_epoch
 
 
 class TestTimeUtilities(TestCase):
@@ -55,3 +56,15 @@ class TestTimeUtilities(TestCase):
         epoch = decimal_year_to_utc_epoch(year)
         test_year = decimal_year(epoch_time_to_utc_datetime(epoch))
         self.assertAlmostEqual(year, test_year)
+
+    def test_strptime_array_to_utc_epoch(self):
+        timestrings = ['1970-1-1T0:0:0.0', '1984-04-24T21:15:18.760', '1992-06-28T11:57:34', '1969-12-31T23:59:59.9995']
+        expected = [strptime_to_utc_epoch(timestrings[0], format='%Y-%m-%dT%H:%M:%S.%f'),
+                    strptime_to_utc_epoch(timestrings[1], format='%Y-%m-%dT%H:%M:%S.%f'),
+                    strptime_to_utc_epoch(timestrings[2], format='%Y-%m-%dT%H:%M:%S'),
+                    strptime_to_utc_epoch(timestrings[3], format='%Y-%m-%dT%H:%M:%S.%f')]
+        self.assertEqual(expected, strptime_array_to_utc_epoch(timestrings).tolist())
+
+    def test_strptime_array_to_utc_epoch_invalid(self):
+        with self.assertRaises(ValueError):
+            strptime_array_to_utc_epoch(['1992-06-28T11:57:34', '1992-13-28T11:57:34'])